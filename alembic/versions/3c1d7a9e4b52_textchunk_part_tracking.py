@@ -0,0 +1,30 @@
+"""textchunk part tracking
+
+Revision ID: 3c1d7a9e4b52
+Revises: f9986c665403
+Create Date: 2026-10-16 09:12:41.227310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1d7a9e4b52'
+down_revision: Union[str, None] = 'f9986c665403'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('textchunk', sa.Column('part_id', sa.String(length=64), nullable=True))
+    op.add_column('textchunk', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index('ix_textchunk_source_part', 'textchunk', ['org_id', 'source_type', 'source_id', 'part_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_textchunk_source_part', table_name='textchunk')
+    op.drop_column('textchunk', 'content_hash')
+    op.drop_column('textchunk', 'part_id')
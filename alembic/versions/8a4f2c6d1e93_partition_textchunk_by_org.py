@@ -0,0 +1,99 @@
+"""partition textchunk by org
+
+Revision ID: 8a4f2c6d1e93
+Revises: 3c1d7a9e4b52
+Create Date: 2026-10-17 10:03:18.604112
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from pgvector.sqlalchemy import Vector
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a4f2c6d1e93'
+down_revision: Union[str, None] = '3c1d7a9e4b52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+HASH_BUCKETS = 8
+
+COLUMNS = (
+    "id, org_id, created_at, updated_at, deleted_at, version, source_type, source_id, part_id, "
+    "content_hash, patient_id, locator, text, chunk_index, embedding"
+)
+
+# index names that must be free before the new table's indexes are created
+SECONDARY_INDEXES = (
+    'textchunk_embedding_idx', 'textchunk_fts_idx', 'textchunk_deleted_at_idx',
+    'ix_textchunk_created_at', 'ix_textchunk_updated_at', 'ix_textchunk_source_part',
+)
+
+
+def _columns():
+    return [
+        sa.Column('source_type', sa.String(length=32), nullable=False),
+        sa.Column('source_id', sa.String(length=64), nullable=False),
+        sa.Column('part_id', sa.String(length=64), nullable=True),
+        sa.Column('content_hash', sa.String(length=64), nullable=True),
+        sa.Column('patient_id', sa.Uuid(), nullable=True),
+        sa.Column('locator', sa.JSON(), nullable=True),
+        sa.Column('text', sa.Text(), nullable=False),
+        sa.Column('chunk_index', sa.Integer(), nullable=False),
+        sa.Column('embedding', Vector(dim=384), nullable=False),
+        sa.Column('id', sa.Uuid(), nullable=False),
+        sa.Column('org_id', sa.Uuid(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('deleted_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['patient_id'], ['patient.id'], ),
+    ]
+
+
+def _create_secondary_indexes():
+    op.create_index(op.f('ix_textchunk_created_at'), 'textchunk', ['created_at'], unique=False)
+    op.create_index(op.f('ix_textchunk_updated_at'), 'textchunk', ['updated_at'], unique=False)
+    op.create_index('ix_textchunk_source_part', 'textchunk', ['org_id', 'source_type', 'source_id', 'part_id'], unique=False)
+    op.create_index('textchunk_fts_idx', 'textchunk', [sa.text("to_tsvector('simple'::regconfig, text)")], unique=False, postgresql_using='gin')
+    op.create_index('textchunk_deleted_at_idx', 'textchunk', ['deleted_at'], unique=False, postgresql_where=sa.text('deleted_at IS NOT NULL'))
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE textchunk RENAME TO textchunk_unpartitioned")
+    op.execute("ALTER INDEX textchunk_pkey RENAME TO textchunk_unpartitioned_pkey")
+    for name in SECONDARY_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+
+    op.create_table('textchunk',
+    *_columns(),
+    sa.PrimaryKeyConstraint('id', 'org_id'),
+    postgresql_partition_by='LIST (org_id)',
+    )
+    op.execute("CREATE TABLE textchunk_default PARTITION OF textchunk DEFAULT PARTITION BY HASH (org_id)")
+    for r in range(HASH_BUCKETS):
+        op.execute(
+            f"CREATE TABLE textchunk_h{r} PARTITION OF textchunk_default "
+            f"FOR VALUES WITH (MODULUS {HASH_BUCKETS}, REMAINDER {r})"
+        )
+    _create_secondary_indexes()
+
+    op.execute(f"INSERT INTO textchunk ({COLUMNS}) SELECT {COLUMNS} FROM textchunk_unpartitioned")
+    op.execute("DROP TABLE textchunk_unpartitioned")
+    # per-partition vector indexes are built by the app's index manager on startup
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE textchunk RENAME TO textchunk_partitioned")
+    op.execute("ALTER INDEX textchunk_pkey RENAME TO textchunk_partitioned_pkey")
+
+    op.create_table('textchunk_new',
+    *_columns(),
+    sa.PrimaryKeyConstraint('id', name='textchunk_pkey'),
+    )
+    op.execute(f"INSERT INTO textchunk_new ({COLUMNS}) SELECT {COLUMNS} FROM textchunk_partitioned")
+    op.execute("DROP TABLE textchunk_partitioned CASCADE")
+    op.execute("ALTER TABLE textchunk_new RENAME TO textchunk")
+    _create_secondary_indexes()
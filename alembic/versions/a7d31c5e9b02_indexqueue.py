@@ -0,0 +1,37 @@
+"""indexqueue
+
+Revision ID: a7d31c5e9b02
+Revises: e4a9b3f07c16
+Create Date: 2026-10-17 18:21:09.514227
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d31c5e9b02'
+down_revision: Union[str, None] = 'e4a9b3f07c16'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('indexqueue',
+    sa.Column('org_id', sa.Uuid(), nullable=False),
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('source_id', sa.Uuid(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('org_id', 'kind', 'source_id')
+    )
+    op.create_index(op.f('ix_indexqueue_next_attempt_at'), 'indexqueue', ['next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_indexqueue_next_attempt_at'), table_name='indexqueue')
+    op.drop_table('indexqueue')
@@ -0,0 +1,26 @@
+"""textchunk org/patient index
+
+Revision ID: b71e05d9c2a4
+Revises: 8a4f2c6d1e93
+Create Date: 2026-10-17 11:26:52.318840
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b71e05d9c2a4'
+down_revision: Union[str, None] = '8a4f2c6d1e93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_textchunk_org_patient', 'textchunk', ['org_id', 'patient_id'], unique=False, postgresql_where=sa.text('deleted_at IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_textchunk_org_patient', table_name='textchunk')
@@ -0,0 +1,31 @@
+"""textchunk simhash
+
+Revision ID: d25c8e1f4a70
+Revises: b71e05d9c2a4
+Create Date: 2026-10-17 13:48:05.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd25c8e1f4a70'
+down_revision: Union[str, None] = 'b71e05d9c2a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('textchunk', sa.Column('simhash', sa.BigInteger(), nullable=True))
+    op.add_column('textchunk', sa.Column('simhash_bands', postgresql.ARRAY(sa.Integer()), nullable=True))
+    op.create_index('ix_textchunk_simhash_bands', 'textchunk', ['simhash_bands'], unique=False, postgresql_using='gin', postgresql_where=sa.text('deleted_at IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_textchunk_simhash_bands', table_name='textchunk')
+    op.drop_column('textchunk', 'simhash_bands')
+    op.drop_column('textchunk', 'simhash')
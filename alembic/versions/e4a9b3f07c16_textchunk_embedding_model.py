@@ -0,0 +1,45 @@
+"""textchunk embedding model
+
+Revision ID: e4a9b3f07c16
+Revises: d25c8e1f4a70
+Create Date: 2026-10-17 15:02:41.337810
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a9b3f07c16'
+down_revision: Union[str, None] = 'd25c8e1f4a70'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# every existing vector came from the hashing provider at the default dimension
+_EXISTING_MODEL = 'hashing:384:v1'
+
+
+def upgrade() -> None:
+    # a constant default is stored in the catalog, so this does not rewrite the table
+    op.add_column('textchunk', sa.Column('embedding_model', sa.String(length=64), nullable=False, server_default=_EXISTING_MODEL))
+    op.alter_column('textchunk', 'embedding_model', server_default=None)
+    op.create_table('embeddingmigration',
+    sa.Column('target_model', sa.String(length=64), nullable=False),
+    sa.Column('source_model', sa.String(length=64), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('cursor_id', sa.Uuid(), nullable=True),
+    sa.Column('cursor_org_id', sa.Uuid(), nullable=True),
+    sa.Column('rows_scanned', sa.BigInteger(), nullable=False),
+    sa.Column('rows_embedded', sa.BigInteger(), nullable=False),
+    sa.Column('rows_retired', sa.BigInteger(), nullable=False),
+    sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('target_model')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('embeddingmigration')
+    op.drop_column('textchunk', 'embedding_model')
@@ -20,6 +20,7 @@ from app.modules.intake.router import router as intake_router
 from app.modules.availability.router import router as availability_router
 from app.modules.patient_context.router import router as patient_context_router
 from app.modules.n8n.router import router as n8n_router
+from app.modules.events.router import router as events_router
 
 
 
@@ -46,6 +47,7 @@ api_router.include_router(intake_router, tags=["intake"])
 api_router.include_router(availability_router, tags=["availability"])
 api_router.include_router(patient_context_router, tags=["patient_context"])
 api_router.include_router(n8n_router, tags=["n8n"])
+api_router.include_router(events_router, tags=["events"])
 
 @api_router.get("/health", tags=["health"])
 async def health():
@@ -1,11 +1,14 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from pydantic import field_validator
+from pydantic import field_validator, model_validator
 from typing import Literal
 import os
+import re
 from dotenv import load_dotenv
 
 load_dotenv()
 
+SIMHASH_BANDS = 4  # app/modules/vector/simhash.py BANDS
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", case_sensitive=False, extra="ignore")
 
@@ -41,14 +44,103 @@ class Settings(BaseSettings):
     EVENT_BUS_PROVIDER: str = "noop"  # noop | redis
     REDIS_URL: str | None = None
     REDIS_STREAM: str | None = None  # default "prm.events" if None
-    REDIS_STREAM_MAXLEN: int = 10000
+    REDIS_STREAM_MAXLEN: int = 10000  # approximate cap per stream
+    # Stream routing (see bus_redis.StreamRouter): one stream per slice of event
+    # types ("prm.events.appointment"), per org ("prm.events.org.<id>"), or both
+    REDIS_STREAM_ROUTE_BY: Literal["none", "event_type", "org", "event_type_org"] = "none"
+    REDIS_STREAM_ROUTES: dict[str, str] = {}  # event-type prefix -> slice, e.g. {"APPT_": "appointment"}; default: subject type
+    REDIS_STREAM_MAXLENS: dict[str, int] = {}  # per-slice cap, overrides the defaults
+    REDIS_STREAM_ORG_MAXLEN: int = 1000  # cap of each per-org stream
+
+    # Redis Streams consumers (app/modules/events/consumer.py)
+    STREAM_CONSUMER_ENABLED: bool = False  # react to events from Redis streams instead of in the relay process
+    STREAM_CONSUMER_GROUP: str = "prm-workers"
+    STREAM_CONSUMER_SLICES: list[str] = []  # with event-type routing: slices to read; empty = all
+    STREAM_CONSUMER_START_ID: str = "$"  # where a new group starts on existing streams ("0" = full history)
+    STREAM_CONSUMER_BATCH_SIZE: int = 100
+    STREAM_CONSUMER_BLOCK_MS: int = 5000
+    STREAM_CONSUMER_CONCURRENCY: int = 8
+    STREAM_CONSUMER_CLAIM_IDLE_MS: int = 60_000  # pending this long -> reclaimed from its consumer
+    STREAM_CONSUMER_MAX_DELIVERIES: int = 5  # then moved to "<stream>.dlq"
+    STREAM_CONSUMER_DISCOVERY_SECONDS: float = 30.0
+
+    # Outbox relay: wakes on LISTEN/NOTIFY; polling is only the fallback / safety net
+    OUTBOX_LISTEN_ENABLED: bool = True
+    OUTBOX_SAFETY_POLL_SECONDS: float = 30.0  # max sleep while listening
+    OUTBOX_POLL_INTERVAL_SECONDS: float = 1.0  # poll interval without a LISTEN connection
+    OUTBOX_PUBLISH_CONCURRENCY: int = 8  # webhook deliveries in flight per batch; order is kept per patient / subject
+    OUTBOX_CLAIM_LEASE_SECONDS: float = 300.0  # a claimed batch not settled by then (relay died) is claimed again
     
     EMBEDDINGS_PROVIDER: str = "hashing"  # hashing | openai | <add yours>
+    EMBEDDINGS_DIM: int = 384
+    EMBEDDINGS_MODEL_VERSION: str = "v1"  # bump when the provider's vectors change
+    # "provider:dim:version" to migrate to; while set, ingest dual-writes both
+    # models and a background job re-embeds existing chunks
+    EMBEDDINGS_MIGRATION_TARGET: str | None = None
+    EMBEDDINGS_REEMBED_ROWS_PER_SECOND: float = 200.0
+    EMBEDDINGS_REEMBED_BATCH_SIZE: int = 100
+    EMBEDDINGS_CACHE_SIZE: int = 20000  # in-process LRU entries; 0 disables the cache
+    EMBEDDINGS_CACHE_REDIS: bool = False  # add a shared Redis tier (uses REDIS_URL)
+    EMBEDDINGS_CACHE_TTL_SECONDS: int = 7 * 24 * 3600
+    # coalesce concurrent small embed() calls (e.g. one query per /search) into one call to a remote provider
+    EMBEDDINGS_BATCH_MAX_SIZE: int = 64
+    EMBEDDINGS_BATCH_MAX_WAIT_MS: float = 2.0  # 0 disables micro-batching
     OPENAI_API_KEY:str = os.getenv("OPENAI_API_KEY")
     DB_MANAGE: str = "alembic"  # "alembic" | "create_all"
 
     TWILIO_WHATSAPP_NUMBER: str | None = None
 
+    # Hybrid search: per-index candidate pool size and how the two lists are fused
+    VECTOR_SEARCH_CANDIDATES: int = 100
+    VECTOR_SEARCH_FUSION: Literal["weighted", "rrf"] = "weighted"
+    VECTOR_SEARCH_CACHE_TTL_SECONDS: int = 30  # 0 disables; needs REDIS_URL (shared generations) unless VECTOR_SEARCH_CACHE_LOCAL
+    VECTOR_SEARCH_CACHE_LOCAL: bool = False  # allow a per-process cache without Redis; only safe when ingest and search share one process
+    VECTOR_SEARCH_CACHE_SIZE: int = 2000
+    VECTOR_DEDUP_ENABLED: bool = True  # collapse near-duplicate hits (same numbers / negations) in results
+    # skip exact duplicate chunks at ingest; the skipped copy is gone if the kept one's source is deleted
+    VECTOR_DEDUP_INGEST: bool = False
+    VECTOR_DEDUP_MAX_HAMMING: int = 3  # SimHash bits; must stay below simhash.BANDS
+    VECTOR_EXACT_SCOPE_MAX_ROWS: int = 5000  # patient scopes up to this size are ranked exactly, without the ANN index
+
+    # textchunk compaction: purge soft-deleted chunks, reindex after heavy churn
+    VECTOR_COMPACTION_INTERVAL_SECONDS: int = 3600
+    VECTOR_COMPACTION_RETENTION_HOURS: int = 72
+    VECTOR_COMPACTION_BATCH_SIZE: int = 5000
+    VECTOR_REINDEX_CHURN_RATIO: float = 0.2  # purged / live rows that triggers a rebuild
+
+    # Vector index management (see app/modules/vector/setup.py)
+    VECTOR_INDEX_TYPE: Literal["auto", "ivfflat", "hnsw"] = "auto"
+    VECTOR_INDEX_HNSW_MIN_ROWS: int = 1_000_000  # "auto" switches to HNSW past this size
+    VECTOR_INDEX_REBUILD_GROWTH: float = 2.0  # rebuild once the table grows by this factor
+    VECTOR_INDEX_CHECK_INTERVAL_SECONDS: int = 900
+    # full: index the float32 vectors; halfvec / binary: index a half-precision or
+    # binary-quantized copy and re-rank its candidates on the full vectors
+    VECTOR_STORAGE_MODE: Literal["full", "halfvec", "binary"] = "full"
+    VECTOR_STORAGE_RERANK_FACTOR: float = 4.0
+    VECTOR_PARTITION_HASH_BUCKETS: int = 8  # fixed once the DEFAULT partition has buckets
+    # automatic tenant promotion past this many chunks; 0 = off (promote via the admin endpoint in a
+    # maintenance window: the move blocks writes to the DEFAULT partition while it copies)
+    VECTOR_PARTITION_PROMOTE_ROWS: int = 0
+
+    # ANN recall monitor: re-run a sample of live searches as exact KNN in the background
+    VECTOR_RECALL_SAMPLE_RATE: float = 0.01  # fraction of ANN searches sampled; 0 disables
+    VECTOR_RECALL_WINDOW: int = 500  # rolling samples kept per partition
+    VECTOR_RECALL_MAX_IN_FLIGHT: int = 2  # concurrent exact re-runs per process; extra samples are dropped
+    VECTOR_RECALL_TIMEOUT_MS: int = 30_000  # statement_timeout of an exact re-run
+    VECTOR_RECALL_REBUILD_BELOW: float = 0.0  # rebuild a partition's index when rolling recall@k falls below; 0 = never
+    VECTOR_RECALL_REBUILD_MIN_SAMPLES: int = 50
+    VECTOR_RECALL_REBUILD_MIN_INTERVAL_SECONDS: int = 6 * 3600  # per partition
+
+    # Event-driven auto-indexing of transcripts / ticket notes
+    VECTOR_AUTOINDEX_ENABLED: bool = True
+    VECTOR_AUTOINDEX_WINDOW_SECONDS: float = 2.0  # coalescing window per flush
+    VECTOR_AUTOINDEX_MAX_SOURCES: int = 500  # sources claimed from indexqueue per flush
+    VECTOR_AUTOINDEX_POLL_SECONDS: float = 10.0  # pick up work queued by other processes / due retries
+    VECTOR_AUTOINDEX_CHUNK_CHARS: int = 800
+    VECTOR_AUTOINDEX_OVERLAP: int = 120
+    VECTOR_BULK_WORKERS: int = 0  # 0 = os.cpu_count()
+    VECTOR_BULK_QUEUE_SIZE: int = 64
+
 
     @field_validator("POSTGRES_DSN")
     @classmethod
@@ -57,4 +149,45 @@ class Settings(BaseSettings):
             raise ValueError("POSTGRES_DSN must use asyncpg driver (postgresql+asyncpg://...)")
         return v
 
+    @field_validator("EMBEDDINGS_PROVIDER")
+    @classmethod
+    def _provider(cls, v: str):
+        # part of the model id, which is inlined into SQL (see EMBEDDINGS_MODEL_VERSION)
+        if not re.fullmatch(r"[a-z0-9_-]+", (v or "hashing").lower()):
+            raise ValueError("EMBEDDINGS_PROVIDER may only contain letters, digits, '_' and '-'")
+        return v
+
+    @field_validator("EMBEDDINGS_MODEL_VERSION")
+    @classmethod
+    def _model_version(cls, v: str):
+        # model ids are inlined into SQL so partial vector indexes can match
+        if not re.fullmatch(r"[A-Za-z0-9._-]+", v):
+            raise ValueError("EMBEDDINGS_MODEL_VERSION may only contain letters, digits, '.', '_' and '-'")
+        return v
+
+    @field_validator("VECTOR_DEDUP_MAX_HAMMING")
+    @classmethod
+    def _dedup_hamming(cls, v: int):
+        # the SimHash band lookup only finds every pair within simhash.BANDS - 1 bits
+        if not 0 <= v < SIMHASH_BANDS:
+            raise ValueError(f"VECTOR_DEDUP_MAX_HAMMING must be between 0 and {SIMHASH_BANDS - 1}")
+        return v
+
+    @property
+    def EMBEDDINGS_MODEL(self) -> str:
+        """Id of the active embedding model, stored on every chunk it produced."""
+        return f"{(self.EMBEDDINGS_PROVIDER or 'hashing').lower()}:{self.EMBEDDINGS_DIM}:{self.EMBEDDINGS_MODEL_VERSION}"
+
+    @model_validator(mode="after")
+    def _migration_target(self):
+        target = self.EMBEDDINGS_MIGRATION_TARGET
+        if target:
+            parts = target.split(":")
+            if not re.fullmatch(r"[a-z0-9_-]+:\d+:[A-Za-z0-9._-]+", target):
+                raise ValueError("EMBEDDINGS_MIGRATION_TARGET must look like provider:dim:version")
+            if int(parts[1]) != self.EMBEDDINGS_DIM:
+                # textchunk.embedding has a fixed dimension
+                raise ValueError("EMBEDDINGS_MIGRATION_TARGET must keep EMBEDDINGS_DIM; a new dimension needs a schema migration")
+        return self
+
 settings = Settings()
@@ -14,7 +14,12 @@ from contextvars import ContextVar
 import asyncio
 
 from app.modules.events.outbox import run_outbox_relay
-from app.modules.vector.setup import ensure_vector_indexes
+from app.modules.vector.setup import ensure_vector_indexes, run_vector_index_manager
+from app.modules.vector.maintenance import run_vector_compaction
+from app.modules.vector.indexer import run_auto_indexer, register_auto_indexer
+from app.modules.vector.bulk import shutdown_bulk_pool
+from app.modules.vector.reembed import run_embedding_migration
+from app.modules.events.consumer import run_stream_consumer, stream_consumer
 
 
 setup_logging()
@@ -73,16 +78,29 @@ async def on_startup():
     await ensure_vector_indexes()
     await redis_manager.connect()
     app.state.outbox_task = asyncio.create_task(run_outbox_relay())
+    app.state.compaction_task = asyncio.create_task(run_vector_compaction())
+    app.state.index_task = asyncio.create_task(run_vector_index_manager())
+    app.state.reembed_task = asyncio.create_task(run_embedding_migration())
+    if settings.VECTOR_AUTOINDEX_ENABLED:
+        register_auto_indexer()
+        app.state.autoindex_task = asyncio.create_task(run_auto_indexer())
+    if settings.STREAM_CONSUMER_ENABLED:
+        if not stream_consumer.has_handlers:
+            # the consumer would acknowledge every entry unhandled
+            raise RuntimeError("STREAM_CONSUMER_ENABLED but no stream handlers are registered (enable VECTOR_AUTOINDEX_ENABLED)")
+        app.state.consumer_task = asyncio.create_task(run_stream_consumer())
 
 @app.on_event("shutdown")
 async def on_shutdown():
-    task = getattr(app.state, "outbox_task", None)
-    if task:
-        task.cancel()
-        try:
-            await task
-        except Exception:
-            pass
+    for name in ("outbox_task", "compaction_task", "index_task", "reembed_task", "autoindex_task", "consumer_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+            try:
+                await task
+            except (Exception, asyncio.CancelledError):
+                pass
+    shutdown_bulk_pool()
     await redis_manager.close()
 
 
@@ -57,4 +57,22 @@ class ConsentRepository:
             Consent.revoked_at.is_(None),
         )
         res = await self.session.execute(q)
-        return res.scalar_one_or_none() is not None
\ No newline at end of file
+        return res.scalar_one_or_none() is not None
+
+    async def allowed_patients(self, org_id: uuid.UUID, patient_ids: set[uuid.UUID], scope: str, at: datetime | None = None) -> set[uuid.UUID]:
+        # Batched form of is_allowed: which of these patients have an active consent for scope
+        if not patient_ids:
+            return set()
+        t = at or datetime.now(timezone.utc)
+        q = select(Consent.patient_id).where(
+            Consent.org_id == org_id,
+            Consent.patient_id.in_(patient_ids),
+            Consent.scope == scope,
+            Consent.deleted_at.is_(None),
+            Consent.active.is_(True),
+            Consent.effective_at <= t,
+            or_(Consent.expires_at.is_(None), Consent.expires_at > t),
+            Consent.revoked_at.is_(None),
+        ).distinct()
+        res = await self.session.execute(q)
+        return set(res.scalars().all())
\ No newline at end of file
@@ -40,4 +40,7 @@ class ConsentService:
         return obj
 
     async def is_allowed(self, org_id: uuid.UUID, patient_id: uuid.UUID, scope: str) -> bool:
-        return await self.repo.is_allowed(org_id, patient_id, scope, at=_now())
\ No newline at end of file
+        return await self.repo.is_allowed(org_id, patient_id, scope, at=_now())
+
+    async def allowed_patients(self, org_id: uuid.UUID, patient_ids: set[uuid.UUID], scope: str) -> set[uuid.UUID]:
+        return await self.repo.allowed_patients(org_id, patient_ids, scope, at=_now())
\ No newline at end of file
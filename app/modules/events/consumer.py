@@ -0,0 +1,389 @@
+"""
+Redis Streams consumer runtime.
+
+Handlers register per event type (or "*") and run in consumer-group workers
+that can be scaled horizontally: every event is handled by one consumer of the
+group. Entries are read with XREADGROUP and acknowledged once all their
+handlers succeed. A failed entry stays pending, and the consumer holds back
+(unhandled, unacked) every later entry of its key (the bus key: subject id)
+it reads, in this read or later ones, until the older entries are handled;
+per-key order therefore holds within a consumer, while a group with several
+consumers may hand one key's entries to different members. Entries left
+pending longer than STREAM_CONSUMER_CLAIM_IDLE_MS (failures, held entries,
+crashed consumers) are taken over with XAUTOCLAIM, in id order. After
+STREAM_CONSUMER_MAX_DELIVERIES attempts they go to "<stream>.dlq"; deliveries
+that only held an entry back do not count as attempts.
+
+Streams come from the bus's routing (bus_redis.StreamRouter): the base stream,
+or the STREAM_CONSUMER_SLICES slices (all slices when empty) and, with per-org
+routing, every matching org stream, rediscovered every
+STREAM_CONSUMER_DISCOVERY_SECONDS.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable
+import numpy as np
+from redis.asyncio import from_url as redis_from_url
+from redis.exceptions import ResponseError
+from app.core.config import settings
+from app.platform.adapters.bus_redis import StreamRouter
+
+log = logging.getLogger("event.consumer")
+
+_DLQ_SUFFIX = ".dlq"
+
+@dataclass
+class StreamEvent:
+    """One bus entry; exposes the same fields handlers see on an EventOutbox row."""
+    stream: str
+    entry_id: str
+    key: str
+    org_id: uuid.UUID | None
+    event_type: str
+    subject_type: str | None
+    subject_id: str | None
+    payload: dict
+    occurred_at: datetime | None = None
+    outbox_id: str | None = None
+    headers: dict = field(default_factory=dict)
+
+    @classmethod
+    def parse(cls, stream: str, entry_id: str, fields: dict) -> "StreamEvent":
+        value = json.loads(fields["value"])
+        subject = value.get("subject") or {}
+        return cls(
+            stream=stream,
+            entry_id=entry_id,
+            key=fields.get("key") or "-",
+            org_id=uuid.UUID(value["org_id"]) if value.get("org_id") else None,
+            event_type=value.get("event_type") or "",
+            subject_type=subject.get("type"),
+            subject_id=subject.get("id"),
+            payload=value.get("payload") or {},
+            occurred_at=datetime.fromisoformat(value["occurred_at"]) if value.get("occurred_at") else None,
+            outbox_id=value.get("outbox_id"),
+            headers=json.loads(fields.get("headers") or "{}"),
+        )
+
+Handler = Callable[[StreamEvent], Awaitable[None]]
+
+def _entry_order(entry_id: str) -> tuple[int, int]:
+    ms, _, seq = entry_id.partition("-")
+    return int(ms), int(seq or 0)
+
+class StreamConsumer:
+    def __init__(
+        self,
+        group: str,
+        *,
+        consumer: str | None = None,
+        slices: list[str] | None = None,
+        batch_size: int = 100,
+        block_ms: int = 5000,
+        concurrency: int = 8,
+        claim_idle_ms: int = 60_000,
+        max_deliveries: int = 5,
+        discovery_seconds: float = 30.0,
+    ):
+        self.group = group
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.slices = slices or []
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.concurrency = max(1, concurrency)
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self.discovery_seconds = discovery_seconds
+        self.router = StreamRouter(
+            settings.REDIS_STREAM or "prm.events", settings.REDIS_STREAM_ROUTE_BY,
+            settings.REDIS_STREAM_ROUTES, settings.REDIS_STREAM_MAXLENS,
+        )
+        self._handlers: dict[str, list[Handler]] = {}
+        self._redis = None
+        self._streams: list[str] = []
+        self._discovered = False
+        self._delays: deque[float] = deque(maxlen=1000)
+        # (stream, key) -> ids of this consumer's failed or held-back entries
+        self._blocked: dict[tuple[str, str], set[str]] = {}
+        # (stream, entry id) -> deliveries that only held the entry back
+        self._holds: dict[tuple[str, str], int] = {}
+        self.running = False
+        self.stats = {"received": 0, "acked": 0, "failed": 0, "held": 0, "reclaimed": 0, "dead_lettered": 0, "last_batch_ms": 0.0}
+
+    # ---- registration ----
+    def register(self, event_types: str | list[str], handler: Handler) -> None:
+        """Run handler for these event types ("*" = all). Handlers must be idempotent: delivery is at least once."""
+        for et in [event_types] if isinstance(event_types, str) else event_types:
+            if handler not in self._handlers.setdefault(et, []):
+                self._handlers[et].append(handler)
+
+    @property
+    def has_handlers(self) -> bool:
+        return any(self._handlers.values())
+
+    def on(self, *event_types: str):
+        def decorator(fn: Handler) -> Handler:
+            self.register(list(event_types), fn)
+            return fn
+        return decorator
+
+    # ---- streams ----
+    def _connect(self):
+        if self._redis is None:
+            if not settings.REDIS_URL:
+                raise RuntimeError("REDIS_URL not configured")
+            self._redis = redis_from_url(settings.REDIS_URL, encoding="utf-8", decode_responses=True)
+        return self._redis
+
+    async def discover(self) -> list[str]:
+        """
+        Streams this consumer reads, creating the group on new ones. Streams
+        present at the first discovery start at STREAM_CONSUMER_START_ID;
+        streams that appear later are read from their beginning.
+        """
+        r = self._connect()
+        mode = self.router.mode
+        per_org = mode in ("org", "event_type_org")
+        streams: set[str] = set()
+        if mode == "none":
+            streams.add(self.router.base)
+        elif self.slices and mode in ("event_type", "event_type_org"):
+            for s in self.slices:
+                if per_org:
+                    streams.update([n async for n in r.scan_iter(match=self.router.stream_name(s, "*"), _type="stream")])
+                else:
+                    streams.add(self.router.stream_name(s))
+        else:
+            streams.update([n async for n in r.scan_iter(match=self.router.stream_name("*", "*"), _type="stream")])
+        streams = {n for n in streams if not n.endswith(_DLQ_SUFFIX)}
+        start_id = settings.STREAM_CONSUMER_START_ID if not self._discovered else "0"
+        for name in streams - set(self._streams):
+            try:
+                await r.xgroup_create(name, self.group, id=start_id, mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+        self._discovered = True
+        self._streams = sorted(streams)
+        return self._streams
+
+    # ---- processing ----
+    async def _handle(self, ev: StreamEvent) -> None:
+        for handler in self._handlers.get(ev.event_type, []) + self._handlers.get("*", []):
+            await handler(ev)
+
+    def _held_back(self, ev: StreamEvent) -> bool:
+        ids = self._blocked.get((ev.stream, ev.key))
+        if not ids:
+            return False
+        order = _entry_order(ev.entry_id)
+        return any(_entry_order(i) < order for i in ids if i != ev.entry_id)
+
+    def _block(self, ev: StreamEvent, held: bool) -> None:
+        self._blocked.setdefault((ev.stream, ev.key), set()).add(ev.entry_id)
+        if held:
+            self._holds[(ev.stream, ev.entry_id)] = self._holds.get((ev.stream, ev.entry_id), 0) + 1
+
+    def _unblock(self, stream: str, key: str, entry_id: str) -> None:
+        self._holds.pop((stream, entry_id), None)
+        ids = self._blocked.get((stream, key))
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._blocked[(stream, key)]
+
+    async def _prune_blocked(self) -> None:
+        """Forget blocked entries no longer pending for this consumer (acked, dead-lettered or claimed elsewhere)."""
+        if not self._blocked:
+            return
+        r = self._connect()
+        refs = [(k, entry_id) for k, ids in self._blocked.items() for entry_id in ids]
+        pipe = r.pipeline(transaction=False)
+        for (stream, _), entry_id in refs:
+            pipe.xpending_range(stream, self.group, min=entry_id, max=entry_id, count=1, consumername=self.consumer)
+        for ((stream, key), entry_id), pending in zip(refs, await pipe.execute()):
+            if not pending:
+                self._unblock(stream, key, entry_id)
+
+    async def process(self, entries: list[tuple[str, str, dict | None]]) -> None:
+        """
+        Handle (stream, entry id, fields) entries: per-key order, bounded
+        concurrency, then one XACK per stream. An entry behind an older
+        failed or held entry of its key is left pending (see module doc).
+        """
+        started = time.perf_counter()
+        r = self._connect()
+        acks: dict[str, list[str]] = {}
+        groups: dict[tuple[str, str], list[StreamEvent]] = {}
+        for stream, entry_id, fields in entries:
+            if fields is None:
+                # trimmed away while pending
+                acks.setdefault(stream, []).append(entry_id)
+                continue
+            try:
+                ev = StreamEvent.parse(stream, entry_id, fields)
+            except Exception as e:
+                await self._dead_letter(stream, entry_id, fields, f"unparseable: {e}")
+                continue
+            groups.setdefault((stream, ev.key), []).append(ev)
+        self.stats["received"] += len(entries)
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def work(events: list[StreamEvent]) -> None:
+            for n, ev in enumerate(events):
+                if self._held_back(ev):
+                    for held in events[n:]:
+                        self._block(held, held=True)
+                    self.stats["held"] += len(events) - n
+                    return
+                try:
+                    async with slots:
+                        await self._handle(ev)
+                except Exception:
+                    log.exception("Stream handler failed for %s %s", ev.event_type, ev.entry_id)
+                    self.stats["failed"] += 1
+                    # the rest of this key stays pending, in order
+                    self._block(ev, held=False)
+                    for held in events[n + 1:]:
+                        self._block(held, held=True)
+                    return
+                self._unblock(ev.stream, ev.key, ev.entry_id)
+                acks.setdefault(ev.stream, []).append(ev.entry_id)
+                if ev.occurred_at:
+                    self._delays.append(time.time() - ev.occurred_at.timestamp())
+
+        await asyncio.gather(*(work(events) for events in groups.values()))
+        if acks:
+            pipe = r.pipeline(transaction=False)
+            for stream, ids in acks.items():
+                pipe.xack(stream, self.group, *ids)
+            await pipe.execute()
+            self.stats["acked"] += sum(len(ids) for ids in acks.values())
+        self.stats["last_batch_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    async def reclaim(self) -> int:
+        """Take over entries idle past claim_idle_ms; dead-letter those delivered too often."""
+        r = self._connect()
+        await self._prune_blocked()
+        total = 0
+        for stream in self._streams:
+            start = "0-0"
+            while True:
+                res = await r.xautoclaim(stream, self.group, self.consumer, self.claim_idle_ms, start_id=start, count=self.batch_size)
+                start, claimed = res[0], res[1]
+                if claimed:
+                    ids = [entry_id for entry_id, _ in claimed]
+                    pending = await r.xpending_range(stream, self.group, min=ids[0], max=ids[-1], count=len(ids) * 2, consumername=self.consumer)
+                    deliveries = {p["message_id"]: p["times_delivered"] for p in pending}
+                    retry = []
+                    for entry_id, fields in claimed:
+                        attempts = deliveries.get(entry_id, 0) - self._holds.get((stream, entry_id), 0)
+                        if fields is not None and attempts > self.max_deliveries:
+                            await self._dead_letter(stream, entry_id, fields, "max deliveries exceeded")
+                        else:
+                            retry.append((stream, entry_id, fields))
+                    total += len(claimed)
+                    await self.process(retry)
+                if start in ("0-0", "0"):
+                    break
+        self.stats["reclaimed"] += total
+        return total
+
+    async def _dead_letter(self, stream: str, entry_id: str, fields: dict, reason: str) -> None:
+        r = self._connect()
+        await r.xadd(stream + _DLQ_SUFFIX, {**fields, "source_id": entry_id, "error": reason[:500]}, maxlen=settings.REDIS_STREAM_MAXLEN, approximate=True)
+        await r.xack(stream, self.group, entry_id)
+        # no longer holds back the rest of its key
+        self._unblock(stream, fields.get("key") or "-", entry_id)
+        self.stats["dead_lettered"] += 1
+        log.warning("Dead-lettered %s %s: %s", stream, entry_id, reason)
+
+    # ---- metrics ----
+    async def lag(self) -> list[dict]:
+        """Per stream: entries not yet delivered to the group (Redis 7 'lag') and delivered but unacked ('pending')."""
+        r = self._connect()
+        out = []
+        for stream in self._streams or await self.discover():
+            for g in await r.xinfo_groups(stream):
+                if g.get("name") == self.group:
+                    out.append({
+                        "stream": stream,
+                        "lag": g.get("lag"),
+                        "pending": g.get("pending"),
+                        "consumers": g.get("consumers"),
+                        "last_delivered_id": g.get("last-delivered-id"),
+                    })
+        return out
+
+    async def metrics(self) -> dict:
+        delays = np.array(self._delays) if self._delays else None
+        return {
+            "group": self.group,
+            "consumer": self.consumer,
+            "running": self.running,
+            "handlers": {et: len(hs) for et, hs in self._handlers.items()},
+            "blocked_keys": len(self._blocked),
+            **self.stats,
+            "end_to_end_ms_p50": round(float(np.percentile(delays, 50)) * 1000, 1) if delays is not None else None,
+            "end_to_end_ms_p95": round(float(np.percentile(delays, 95)) * 1000, 1) if delays is not None else None,
+            "streams": await self.lag() if settings.REDIS_URL else [],
+        }
+
+    # ---- loop ----
+    async def run(self):
+        if not self.has_handlers:
+            # reading without handlers would acknowledge (drop) the whole backlog
+            raise RuntimeError("Stream consumer has no handlers registered")
+        log.info("Stream consumer %s/%s started", self.group, self.consumer)
+        self.running = True
+        next_discovery = next_claim = 0.0
+        try:
+            while True:
+                try:
+                    now = time.monotonic()
+                    if now >= next_discovery:
+                        await self.discover()
+                        next_discovery = now + self.discovery_seconds
+                    if now >= next_claim:
+                        await self.reclaim()
+                        next_claim = now + max(1.0, self.claim_idle_ms / 2000)
+                    if not self._streams:
+                        await asyncio.sleep(min(self.discovery_seconds, self.block_ms / 1000))
+                        continue
+                    res = await self._connect().xreadgroup(
+                        self.group, self.consumer, {s: ">" for s in self._streams},
+                        count=self.batch_size, block=self.block_ms,
+                    )
+                    entries = [(stream, entry_id, fields) for stream, items in res or [] for entry_id, fields in items]
+                    if entries:
+                        await self.process(entries)
+                except Exception:
+                    log.exception("Stream consumer iteration failed")
+                    await asyncio.sleep(1.0)
+        except asyncio.CancelledError:
+            log.info("Stream consumer cancelled; shutting down")
+            raise
+        finally:
+            self.running = False
+
+stream_consumer = StreamConsumer(
+    settings.STREAM_CONSUMER_GROUP,
+    slices=settings.STREAM_CONSUMER_SLICES,
+    batch_size=settings.STREAM_CONSUMER_BATCH_SIZE,
+    block_ms=settings.STREAM_CONSUMER_BLOCK_MS,
+    concurrency=settings.STREAM_CONSUMER_CONCURRENCY,
+    claim_idle_ms=settings.STREAM_CONSUMER_CLAIM_IDLE_MS,
+    max_deliveries=settings.STREAM_CONSUMER_MAX_DELIVERIES,
+    discovery_seconds=settings.STREAM_CONSUMER_DISCOVERY_SECONDS,
+)
+
+async def run_stream_consumer():
+    await stream_consumer.run()
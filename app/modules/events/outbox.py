@@ -2,24 +2,33 @@ import uuid
 import asyncio
 import logging
 from datetime import datetime, timedelta, timezone
-from typing import Sequence
+from typing import Awaitable, Callable, Sequence
 
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import TIMESTAMP, text, String, Integer, Text, JSON, select, and_, update
+import asyncpg
+from sqlalchemy import TIMESTAMP, text, String, Integer, Text, JSON, select, and_, update, func, exists, literal
+from sqlalchemy.orm import aliased
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.base import Base, TimestampedTenantMixin
+from app.core.config import settings
 from app.core.db import SessionLocal
 from app.platform.provider_registry import registry
+from app.platform.ports.event_bus import BusMessage
 # add imports
 import httpx
 from app.modules.webhooks.repository import WebhookRepository
 
 log = logging.getLogger("event.outbox")
 
-async def _deliver_webhooks(session: AsyncSession, ev_obj):
-    # fetch subscriptions for org
-    subs = await WebhookRepository(session).list_active(ev_obj.org_id)
+# NOTIFY channel the relay LISTENs on; enqueue notifies it, delivered on commit
+OUTBOX_CHANNEL = "prm_outbox"
+_BATCH_SIZE = 50
+# held by the relay that is claiming a batch (see claim_batch)
+_RELAY_LOCK = "prm_outbox_relay"
+
+async def _deliver_webhooks(client: httpx.AsyncClient, subs, ev_obj):
+    # subs: the org's active subscriptions, fetched by the relay before fan-out
     if not subs: return
     payload = {
         "id": str(ev_obj.id),
@@ -29,15 +38,38 @@ async def _deliver_webhooks(session: AsyncSession, ev_obj):
         "data": ev_obj.payload,
         "org_id": str(ev_obj.org_id)
     }
-    async with httpx.AsyncClient(timeout=5) as client:
-        for sub in subs:
-            try:
-                headers = {"X-PRM-Org": str(ev_obj.org_id)}
-                if sub.secret: headers["X-PRM-Signature"] = sub.secret  # TODO: HMAC later
-                await client.post(sub.endpoint_url, json=payload, headers=headers)
-            except Exception:
-                # swallow errors; outbox retry still applies for bus, not webhooks; we could add retry table later
-                pass
+    for sub in subs:
+        try:
+            headers = {"X-PRM-Org": str(ev_obj.org_id)}
+            if sub.secret: headers["X-PRM-Signature"] = sub.secret  # TODO: HMAC later
+            await client.post(sub.endpoint_url, json=payload, headers=headers)
+        except Exception:
+            # swallow errors; outbox retry still applies for bus, not webhooks; we could add retry table later
+            pass
+
+
+# In-process subscribers called for each event this relay publishes, with the
+# relay's session: whatever they write commits together with the event's
+# "sent" status. Handlers must be cheap (e.g. record work for a worker).
+LocalHandler = Callable[[AsyncSession, "EventOutbox"], Awaitable[None]]
+_local_handlers: list[LocalHandler] = []
+
+def register_local_handler(handler: LocalHandler) -> None:
+    if handler not in _local_handlers:
+        _local_handlers.append(handler)
+
+async def _dispatch_local(session: AsyncSession, ev_obj) -> bool:
+    """Run the local handlers in a savepoint; False (and their writes rolled back) if one failed."""
+    if not _local_handlers:
+        return True
+    try:
+        async with session.begin_nested():
+            for handler in _local_handlers:
+                await handler(session, ev_obj)
+    except Exception:
+        log.exception("Local event handler failed for %s", ev_obj.event_type)
+        return False
+    return True
 
 
 class EventOutbox(Base, TimestampedTenantMixin):
@@ -71,28 +103,72 @@ class OutboxRepository:
         )
         self.session.add(obj)
         await self.session.flush()
+        # sent when the transaction commits, dropped on rollback; identical
+        # payloads within one transaction collapse into a single notification
+        await self.session.execute(select(func.pg_notify(OUTBOX_CHANNEL, "")))
         return obj
 
+    async def next_due_at(self, floor_seconds: float) -> datetime | None:
+        """
+        Earliest next_attempt_at among unsent events (retries waiting out
+        their backoff, claims waiting out their lease). Events already due
+        that this relay did not claim are being claimed by another relay, or
+        queued behind an older same-key event, so they count as due
+        floor_seconds from now.
+        """
+        res = await self.session.execute(
+            select(func.min(func.greatest(
+                EventOutbox.next_attempt_at, func.now() + func.make_interval(0, 0, 0, 0, 0, 0, floor_seconds),
+            ))).where(
+                EventOutbox.deleted_at.is_(None),
+                EventOutbox.status.in_(("pending", "processing")),
+            )
+        )
+        return res.scalar()
+
     async def claim_batch(self, limit: int = 50) -> list[EventOutbox]:
+        """
+        Claim due events in created_at order, keeping per-key order across
+        batches and relays: an event is held back while an older event with
+        the same ordering_key is in flight (claimed by any relay) or waiting
+        out a retry backoff. Claimed events are leased for
+        OUTBOX_CLAIM_LEASE_SECONDS; the caller commits the claim before
+        publishing, so the advisory lock (one claimer at a time, the others
+        get nothing) covers only this query. A lease that runs out (the relay
+        died) makes the event due again.
+        """
+        if not (await self.session.execute(select(func.pg_try_advisory_xact_lock(func.hashtext(_RELAY_LOCK))))).scalar():
+            return []
+        older = aliased(EventOutbox)
+        blocked = exists().where(
+            older.deleted_at.is_(None),
+            older.status.in_(("pending", "processing")),
+            older.next_attempt_at > func.now(),
+            _ordering_key_sql(older) == _ordering_key_sql(EventOutbox),
+            older.created_at < EventOutbox.created_at,
+        )
         # SELECT ... FOR UPDATE SKIP LOCKED
         q = (
             select(EventOutbox)
             .where(
                 and_(
                     EventOutbox.deleted_at.is_(None),
-                    EventOutbox.status == "pending",
+                    EventOutbox.status.in_(("pending", "processing")),
                     EventOutbox.next_attempt_at <= datetime.now(timezone.utc),
+                    ~blocked,
                 )
             )
-            .order_by(EventOutbox.created_at.asc())
+            .order_by(EventOutbox.created_at.asc(), EventOutbox.id.asc())
             .limit(limit)
             .with_for_update(skip_locked=True)
         )
         res = await self.session.execute(q)
         rows = list(res.scalars().all())
-        # mark as processing
+        # mark as processing, leased
+        lease_until = datetime.now(timezone.utc) + timedelta(seconds=settings.OUTBOX_CLAIM_LEASE_SECONDS)
         for r in rows:
             r.status = "processing"
+            r.next_attempt_at = lease_until
         await self.session.flush()
         return rows
 
@@ -101,6 +177,12 @@ class OutboxRepository:
         obj.last_error = None
         await self.session.flush()
 
+    async def release(self, obj: EventOutbox):
+        # back to pending, due now, without counting an attempt
+        obj.status = "pending"
+        obj.next_attempt_at = datetime.now(timezone.utc)
+        await self.session.flush()
+
     async def mark_failed(self, obj: EventOutbox, error: str):
         obj.status = "pending"  # retry
         obj.attempts = (obj.attempts or 0) + 1
@@ -119,44 +201,182 @@ class OutboxService:
 
 # ---- Background relay ----
 
-async def run_outbox_relay(poll_interval_seconds: float = 1.0):
+def ordering_key(ev: EventOutbox) -> str:
+    """Events sharing a key are delivered in created_at order: per patient when the payload names one, else per subject."""
+    patient_id = (ev.payload or {}).get("patient_id") if isinstance(ev.payload, dict) else None
+    if patient_id:
+        return f"patient:{patient_id}"
+    return f"{ev.subject_type}:{ev.subject_id}"
+
+def _ordering_key_sql(t):
+    # ordering_key() as SQL, for claim_batch
+    patient_id = func.nullif(t.payload["patient_id"].as_string(), "")
+    return func.coalesce(literal("patient:") + patient_id, t.subject_type + literal(":") + t.subject_id)
+
+def _bus_message(ev: EventOutbox) -> BusMessage:
+    return BusMessage(topic="prm.events", key=ev.subject_id or "-", value={
+        "org_id": str(ev.org_id),
+        "event_type": ev.event_type,
+        "subject": {"type": ev.subject_type, "id": ev.subject_id},
+        "payload": ev.payload,
+        "occurred_at": ev.occurred_at.isoformat(),
+        "outbox_id": str(ev.id),
+    })
+
+async def _relay_batch(bus, limit: int = _BATCH_SIZE) -> int:
+    """
+    Claim and publish one batch; returns the number of events claimed.
+
+    The whole batch goes to the bus in one publish_many call, in created_at
+    order. Local handlers then run per event, in order. Once an event fails
+    (publish or local handler) it is retried with backoff, and every later
+    event of its ordering_key in the batch is released back to pending
+    without an attempt: no webhooks, not marked sent. claim_batch then keeps
+    them behind the retry, so subscribers see the key in order; the bus may
+    see a held event twice (at least once). Webhooks for the rest are
+    delivered by one worker per ordering_key, in order within the key, with
+    up to OUTBOX_PUBLISH_CONCURRENCY deliveries in flight, so one slow
+    endpoint only holds up its own key. mark_sent runs after the workers
+    finish.
+    """
+    async with SessionLocal() as session:
+        repo = OutboxRepository(session)
+        batch = await repo.claim_batch(limit=limit)
+        # ends the claim (and its lock) before any I/O; the rest is a new transaction
+        await session.commit()
+        if not batch:
+            return 0
+        try:
+            errors = await bus.publish_many([_bus_message(ev) for ev in batch])
+        except Exception as ex:  # noqa
+            log.exception("Publish failed")
+            for ev in batch:
+                await repo.mark_failed(ev, error=str(ex))
+            await session.commit()
+            return len(batch)
+        failed_keys: set[str] = set()
+        published = []
+        for ev, err in zip(batch, errors):
+            key = ordering_key(ev)
+            if key in failed_keys:
+                await repo.release(ev)
+            elif err is not None:
+                log.warning("Publish failed for outbox event %s: %s", ev.id, err)
+                await repo.mark_failed(ev, error=str(err))
+                failed_keys.add(key)
+            elif await _dispatch_local(session, ev):
+                published.append(ev)
+            else:
+                # retried later; the bus sees it again (at least once)
+                await repo.mark_failed(ev, error="local handler failed")
+                failed_keys.add(key)
+
+        webhooks = WebhookRepository(session)
+        subs = {org_id: await webhooks.list_active(org_id) for org_id in {ev.org_id for ev in published}}
+        groups: dict[str, list[EventOutbox]] = {}
+        for ev in published:
+            if subs[ev.org_id]:
+                groups.setdefault(ordering_key(ev), []).append(ev)
+        slots = asyncio.Semaphore(max(1, settings.OUTBOX_PUBLISH_CONCURRENCY))
+
+        async def work(client: httpx.AsyncClient, events: list[EventOutbox]) -> None:
+            for ev in events:
+                async with slots:
+                    await _deliver_webhooks(client, subs[ev.org_id], ev)
+
+        if groups:
+            async with httpx.AsyncClient(timeout=5) as client:
+                await asyncio.gather(*(work(client, events) for events in groups.values()))
+
+        for ev in published:
+            await repo.mark_sent(ev)
+        await session.commit()
+        return len(batch)
+
+async def _seconds_until_due(max_wait: float) -> float:
+    async with SessionLocal() as session:
+        due = await OutboxRepository(session).next_due_at(settings.OUTBOX_POLL_INTERVAL_SECONDS)
+    if due is None:
+        return max_wait
+    return min(max_wait, max(0.0, (due - datetime.now(timezone.utc)).total_seconds()))
+
+class _OutboxListener:
+    """Dedicated asyncpg connection LISTENing on OUTBOX_CHANNEL; sets `wake` on every notification."""
+    def __init__(self):
+        self.wake = asyncio.Event()
+        self._conn: asyncpg.Connection | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None and not self._conn.is_closed()
+
+    async def connect(self) -> bool:
+        try:
+            # the SQLAlchemy DSN minus the dialect suffix; kept outside the pool
+            self._conn = await asyncpg.connect(settings.POSTGRES_DSN.replace("+asyncpg", "", 1))
+            await self._conn.add_listener(OUTBOX_CHANNEL, self._notified)
+            # a dropped connection wakes the relay, which then reconnects or polls
+            self._conn.add_termination_listener(self._terminated)
+        except Exception:
+            log.warning("Outbox LISTEN connection failed; polling every %ss", settings.OUTBOX_POLL_INTERVAL_SECONDS, exc_info=True)
+            await self.close()
+            return False
+        # anything committed while we were not listening is picked up by the next drain
+        self.wake.set()
+        return True
+
+    def _notified(self, *_args) -> None:
+        self.wake.set()
+
+    def _terminated(self, *_args) -> None:
+        log.warning("Outbox LISTEN connection lost")
+        self.wake.set()
+
+    async def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None and not conn.is_closed():
+            try:
+                await conn.close(timeout=5)
+            except Exception:
+                conn.terminate()
+
+async def run_outbox_relay(poll_interval_seconds: float | None = None):
+    """
+    Publish pending outbox events. Wakes on NOTIFY from enqueue, so events go
+    out as soon as their transaction commits; otherwise sleeps until the
+    earliest retry is due, at most OUTBOX_SAFETY_POLL_SECONDS. Without a LISTEN
+    connection (disabled, or while reconnecting) it polls every
+    OUTBOX_POLL_INTERVAL_SECONDS instead.
+    """
     bus = registry.event_bus()
-    log.info("Outbox relay started with bus=%s", bus.__class__.__name__)
+    poll = poll_interval_seconds or settings.OUTBOX_POLL_INTERVAL_SECONDS
+    listener = _OutboxListener() if settings.OUTBOX_LISTEN_ENABLED else None
+    log.info("Outbox relay started with bus=%s listen=%s", bus.__class__.__name__, listener is not None)
     try:
         while True:
-            # claim and publish in small batches
-            async with SessionLocal() as session:
-                repo = OutboxRepository(session)
+            if listener is not None and not listener.connected:
+                await listener.connect()
+            listening = listener is not None and listener.connected
+            if listening:
+                # cleared before draining: a notification during the drain means another pass
+                listener.wake.clear()
+            try:
+                while await _relay_batch(bus) >= _BATCH_SIZE:
+                    await asyncio.sleep(0)  # yield
+                wait = await _seconds_until_due(settings.OUTBOX_SAFETY_POLL_SECONDS) if listening else poll
+            except Exception:
+                log.exception("Outbox relay iteration failed")
+                wait = poll
+            if listening:
                 try:
-                    batch = await repo.claim_batch(limit=50)
-                    if not batch:
-                        await session.commit()
-                        await asyncio.sleep(poll_interval_seconds)
-                        continue
-                    for ev in batch:
-                        try:
-                            topic = "prm.events"
-                            key = ev.subject_id or "-"
-                            # publish
-                            await bus.publish(topic=topic, key=key, value={
-                                "org_id": str(ev.org_id),
-                                "event_type": ev.event_type,
-                                "subject": {"type": ev.subject_type, "id": ev.subject_id},
-                                "payload": ev.payload,
-                                "occurred_at": ev.occurred_at.isoformat(),
-                                "outbox_id": str(ev.id),
-                            })
-                            await _deliver_webhooks(session, ev)
-                            await repo.mark_sent(ev)
-                        except Exception as ex:  # noqa
-                            log.exception("Publish failed")
-                            await repo.mark_failed(ev, error=str(ex))
-                    await session.commit()
-                except Exception as e:
-                    log.exception("Outbox relay iteration failed")
-                    await session.rollback()
-                    await asyncio.sleep(poll_interval_seconds)
-            await asyncio.sleep(0)  # yield
+                    await asyncio.wait_for(listener.wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(wait)
     except asyncio.CancelledError:
         log.info("Outbox relay cancelled; shutting down")
         raise
+    finally:
+        if listener is not None:
+            await listener.close()
@@ -0,0 +1,9 @@
+from fastapi import APIRouter, Depends
+from app.core.security import require_scopes
+from app.modules.events.consumer import stream_consumer
+
+router = APIRouter()
+
+@router.get("/events/admin/consumer", dependencies=[Depends(require_scopes("admin:read"))])
+async def stream_consumer_stats():
+    return await stream_consumer.metrics()
@@ -121,6 +121,10 @@ class TicketService:
         if not t:
             return None
         obj = await self.notes.create(org_id, ticket_id, payload.author_id, payload.body, payload.visibility)
+        await OutboxService(self.session).enqueue(
+            org_id, "TICKET_NOTE_ADDED", "ticket_note", obj.id,
+            {"ticket_id": str(ticket_id), "visibility": obj.visibility}
+        )
         await self.session.commit()
         return obj
 
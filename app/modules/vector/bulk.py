@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import tarfile
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterator
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.platform.provider_registry import registry
+from app.modules.vector.cache import search_cache
+from app.modules.vector.chunking import chunk_and_embed
+from app.modules.vector.repository import VectorRepository
+from app.modules.vector.service import embed_rows
+
+log = logging.getLogger("vector.bulk")
+
+_DOC_SUFFIXES = (".txt", ".md", ".markdown", ".rst", ".csv", ".html", ".htm")
+_MAX_JOBS_KEPT = 100
+
+@dataclass
+class BulkIngestJob:
+    id: str
+    org_id: uuid.UUID
+    filename: str
+    status: str = "queued"  # queued | running | done | failed
+    documents: int = 0
+    chunks: int = 0
+    duplicates: int = 0
+    failed_documents: int = 0
+    started_at: float | None = None
+    finished_at: float | None = None
+    error: str | None = None
+    task: asyncio.Task | None = field(default=None, repr=False)
+
+    def as_dict(self) -> dict:
+        end = self.finished_at or time.time()
+        elapsed = (end - self.started_at) if self.started_at else 0.0
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "documents": self.documents,
+            "chunks": self.chunks,
+            "duplicates": self.duplicates,
+            "failed_documents": self.failed_documents,
+            "elapsed_seconds": round(elapsed, 3),
+            "documents_per_second": round(self.documents / elapsed, 2) if elapsed else 0.0,
+            "chunks_per_second": round(self.chunks / elapsed, 2) if elapsed else 0.0,
+            "error": self.error,
+        }
+
+_jobs: OrderedDict[str, BulkIngestJob] = OrderedDict()
+_pool: ProcessPoolExecutor | None = None
+
+def _pool_size() -> int:
+    return settings.VECTOR_BULK_WORKERS or os.cpu_count() or 1
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the API process has a running event loop and threads
+        _pool = ProcessPoolExecutor(
+            max_workers=_pool_size(),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+def shutdown_bulk_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def get_job(job_id: str) -> BulkIngestJob | None:
+    return _jobs.get(job_id)
+
+def iter_documents(path: str, filename: str) -> Iterator[dict]:
+    """
+    Documents from an NDJSON file (one {"title", "text", "patient_id"?} per line)
+    or a zip/tar archive of text files (title = member name). Read lazily.
+    """
+    name = filename.lower()
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(_DOC_SUFFIXES):
+                    yield {"title": info.filename, "text": zf.read(info).decode("utf-8", errors="replace")}
+    elif name.endswith((".tar", ".tar.gz", ".tgz")):
+        with tarfile.open(path, "r:*") as tf:
+            for member in tf:
+                if member.isfile() and member.name.lower().endswith(_DOC_SUFFIXES):
+                    f = tf.extractfile(member)
+                    if f is not None:
+                        yield {"title": member.name, "text": f.read().decode("utf-8", errors="replace")}
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for n, line in enumerate(f, start=1):
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as e:
+                        # counted as a failed document by the job, not fatal
+                        yield {"_error": f"line {n}: {e}"}
+
+async def start_job(org_id: uuid.UUID, path: str, filename: str, *, chunk_chars: int, overlap: int) -> BulkIngestJob:
+    job = BulkIngestJob(id=str(uuid.uuid4()), org_id=org_id, filename=filename)
+    _jobs[job.id] = job
+    while len(_jobs) > _MAX_JOBS_KEPT:
+        _jobs.popitem(last=False)
+    job.task = asyncio.create_task(_run_job(job, path, chunk_chars=chunk_chars, overlap=overlap))
+    return job
+
+class _WriterStopped(Exception):
+    pass
+
+async def _run_job(job: BulkIngestJob, path: str, *, chunk_chars: int, overlap: int) -> None:
+    """
+    Chunking + embedding fan out to a process pool so the event loop only does
+    I/O; results flow through a bounded queue to a single DB writer, which
+    applies backpressure to the reader when writes fall behind. Bad documents
+    (invalid JSON, patient_id or text) are counted in failed_documents; if
+    the writer fails, the in-flight documents are cancelled and the job fails.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    # the hashing provider can run inside the workers; others embed in-process
+    dim = settings.EMBEDDINGS_DIM if (settings.EMBEDDINGS_PROVIDER or "hashing").lower() == "hashing" else None
+    queue: asyncio.Queue = asyncio.Queue(maxsize=settings.VECTOR_BULK_QUEUE_SIZE)
+    in_flight = asyncio.Semaphore(_pool_size() * 2)
+    job.status, job.started_at = "running", time.time()
+    writer = asyncio.create_task(_write_results(job, queue))
+
+    async def put(item) -> None:
+        # a put must not outlive the writer: with it gone the queue never drains
+        putter = asyncio.ensure_future(queue.put(item))
+        await asyncio.wait({putter, writer}, return_when=asyncio.FIRST_COMPLETED)
+        if not putter.done():
+            putter.cancel()
+            raise _WriterStopped()
+
+    def check_writer() -> None:
+        if writer.done():
+            writer.result()  # re-raises the writer's error
+            raise _WriterStopped()
+
+    async def process(doc: dict):
+        try:
+            if not isinstance(doc, dict) or "_error" in doc:
+                raise ValueError(doc.get("_error") if isinstance(doc, dict) else "document is not an object")
+            patient_id = uuid.UUID(str(doc["patient_id"])) if doc.get("patient_id") else None
+            chunks, sigs, matrix = await loop.run_in_executor(pool, chunk_and_embed, doc.get("text") or "", chunk_chars, overlap, dim)
+            vectors = matrix if matrix is not None else await registry.embeddings().embed(chunks)
+            await put((doc, patient_id, chunks, sigs, vectors))
+        except _WriterStopped:
+            pass
+        except Exception:
+            log.exception("Bulk ingest document failed (job %s)", job.id)
+            job.failed_documents += 1
+        finally:
+            in_flight.release()
+
+    tasks: set[asyncio.Task] = set()
+    try:
+        docs = iter_documents(path, job.filename)
+        while True:
+            # file reads and JSON parsing stay off the event loop too
+            doc = await asyncio.to_thread(next, docs, None)
+            if doc is None:
+                break
+            await in_flight.acquire()
+            check_writer()
+            t = asyncio.create_task(process(doc))
+            tasks.add(t)
+            t.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+        check_writer()
+        await put(None)
+        await writer
+        job.status = "done"
+    except Exception as e:
+        if isinstance(e, _WriterStopped) and writer.done() and not writer.cancelled() and writer.exception():
+            e = writer.exception()
+        log.error("Bulk ingest job %s failed", job.id, exc_info=e)
+        job.status, job.error = "failed", str(e)[:500] or type(e).__name__
+    finally:
+        pending = [t for t in (*tasks, writer) if not t.done()]
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        job.finished_at = time.time()
+        os.unlink(path)
+        if job.chunks:
+            await search_cache.bump(job.org_id)
+        log.info("Bulk ingest job %s: %s", job.id, job.as_dict())
+
+async def _write_results(job: BulkIngestJob, queue: asyncio.Queue) -> None:
+    async with SessionLocal() as session:
+        repo = VectorRepository(session)
+        while (item := await queue.get()) is not None:
+            doc, patient_id, chunks, sigs, vectors = item
+            source_id = str(uuid.uuid4())
+            rows = [{
+                "org_id": job.org_id,
+                "source_type": "knowledge",
+                "source_id": source_id,
+                "patient_id": patient_id,
+                "locator": {"title": doc.get("title")},
+                "text": ch,
+                "chunk_index": i,
+                **sigs[i],
+            } for i, ch in enumerate(chunks)]
+            keep = await repo.duplicate_mask(rows)
+            kept = [(r, v) for r, v, k in zip(rows, vectors, keep) if k]
+            n = len(kept)
+            # other write models (a migration target) embed here, in-process
+            await repo.bulk_insert_chunks(await embed_rows([r for r, _ in kept], [v for _, v in kept]))
+            # one document per transaction keeps locks and WAL bursts short
+            await session.commit()
+            job.documents += 1
+            job.chunks += n
+            job.duplicates += len(rows) - n
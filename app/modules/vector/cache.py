@@ -0,0 +1,105 @@
+import hashlib
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from redis.asyncio import from_url as redis_from_url
+from app.core.config import settings
+from app.platform.adapters.embeddings_cache import normalize_text
+
+log = logging.getLogger("vector.cache")
+
+class SearchResultCache:
+    """
+    Short-TTL cache of search candidates, stored before consent filtering so
+    revocations still apply on every read.
+
+    Keys carry a per-org generation number that VectorService bumps on every
+    ingest or delete; entries written under an older generation are simply never
+    read again. With REDIS_URL set, generations and entries live in Redis and are
+    shared by every API/worker process. Without it a bump is only seen by the
+    process that made it, so the cache stays off unless `local` is set (ingest
+    and search in one single process). A Redis bump that fails is retried on
+    this process's next read of the org, which bypasses the cache until the
+    bump lands.
+    """
+    def __init__(self, ttl_seconds: int, max_entries: int = 2000, redis_url: str | None = None, *, local: bool = False):
+        self.ttl = int(ttl_seconds)
+        if self.ttl and not redis_url and not local:
+            log.warning("Search result cache disabled: REDIS_URL is not set (set VECTOR_SEARCH_CACHE_LOCAL for a single-process deployment)")
+            self.ttl = 0
+        self._max = int(max_entries)
+        self._local: OrderedDict[str, tuple[float, list[dict]]] = OrderedDict()
+        self._generations: dict[uuid.UUID, int] = {}
+        self._unbumped: set[uuid.UUID] = set()
+        self._redis = redis_from_url(redis_url, encoding="utf-8", decode_responses=True) if redis_url and self.ttl else None
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    @staticmethod
+    def key(q: str, top_k: int, patient_id: uuid.UUID | None, source_type: str | None, recall: str | None = None, model: str | None = None) -> str:
+        raw = json.dumps([normalize_text(q), top_k, str(patient_id) if patient_id else None, source_type, recall, model])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def generation(self, org_id: uuid.UUID) -> int:
+        if self._redis is None:
+            return self._generations.get(org_id, 0)
+        return int(await self._redis.get(f"prm:search:gen:{org_id}") or 0)
+
+    async def bump(self, org_id: uuid.UUID) -> None:
+        if self._redis is None:
+            self._generations[org_id] = self._generations.get(org_id, 0) + 1
+            return
+        try:
+            await self._redis.incr(f"prm:search:gen:{org_id}")
+            self._unbumped.discard(org_id)
+        except Exception:
+            log.error("Search cache generation bump failed for org %s; bypassing its cache until it succeeds", org_id, exc_info=True)
+            self._unbumped.add(org_id)
+
+    async def get(self, org_id: uuid.UUID, key: str) -> tuple[int, list[dict] | None]:
+        """Returns (generation, cached candidates or None); pass the generation back to set()."""
+        if not self.enabled:
+            return 0, None
+        if org_id in self._unbumped:
+            await self.bump(org_id)
+            if org_id in self._unbumped:
+                return -1, None
+        try:
+            gen = await self.generation(org_id)
+            full = f"prm:search:{org_id}:{gen}:{key}"
+            if self._redis is not None:
+                raw = await self._redis.get(full)
+                return gen, json.loads(raw) if raw else None
+        except Exception:
+            log.warning("Search cache read failed", exc_info=True)
+            return -1, None
+        entry = self._local.get(full)
+        if entry is None or entry[0] < time.monotonic():
+            return gen, None
+        return gen, entry[1]
+
+    async def set(self, org_id: uuid.UUID, key: str, generation: int, hits: list[dict]) -> None:
+        if not self.enabled or generation < 0:
+            return
+        full = f"prm:search:{org_id}:{generation}:{key}"
+        if self._redis is not None:
+            try:
+                await self._redis.set(full, json.dumps(hits), ex=self.ttl)
+            except Exception:
+                log.warning("Search cache write failed", exc_info=True)
+            return
+        self._local[full] = (time.monotonic() + self.ttl, hits)
+        self._local.move_to_end(full)
+        while len(self._local) > self._max:
+            self._local.popitem(last=False)
+
+search_cache = SearchResultCache(
+    ttl_seconds=settings.VECTOR_SEARCH_CACHE_TTL_SECONDS,
+    max_entries=settings.VECTOR_SEARCH_CACHE_SIZE,
+    redis_url=settings.REDIS_URL,
+    local=settings.VECTOR_SEARCH_CACHE_LOCAL,
+)
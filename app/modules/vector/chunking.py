@@ -0,0 +1,78 @@
+import re
+from itertools import islice
+from typing import Iterable, Iterator, TypeVar
+from app.modules.vector.simhash import signature
+
+T = TypeVar("T")
+
+_PARAGRAPH = re.compile(r"\n\s*\n")
+_SENTENCE = re.compile(r"[.!?][\"')\]]*\s")
+_SPACE = re.compile(r"\s")
+
+def iter_pieces(text: str, size: int = 65536) -> Iterator[str]:
+    """Slice an in-memory string into pieces for iter_chunks."""
+    for i in range(0, len(text or ""), size):
+        yield text[i:i + size]
+
+def iter_chunks(pieces: Iterable[str], chunk_chars: int, overlap: int) -> Iterator[str]:
+    """
+    Chunk text that arrives incrementally (file reads, stream lines, slices).
+
+    Each chunk is at most chunk_chars long and ends at the last paragraph break
+    in the back half of the window, else the last sentence end, else the last
+    whitespace; only a window with none of those is cut mid-word. The next chunk
+    re-reads up to `overlap` characters (capped at half a chunk), starting on a
+    word boundary. Only about one piece plus one chunk is buffered at a time.
+    """
+    overlap = max(0, min(overlap, chunk_chars // 2))
+    buf, pos = "", 0
+    for piece in pieces:
+        buf = buf[pos:] + piece
+        pos = 0
+        while len(buf) - pos > chunk_chars:
+            window = buf[pos:pos + chunk_chars]
+            cut = _boundary(window)
+            chunk = window[:cut].strip()
+            if chunk:
+                yield chunk
+            pos += _overlap_start(window, cut, overlap)
+    tail = buf[pos:].strip()
+    if tail:
+        yield tail
+
+def _boundary(window: str) -> int:
+    lo = len(window) // 2
+    for pattern in (_PARAGRAPH, _SENTENCE, _SPACE):
+        last = None
+        for m in pattern.finditer(window, lo):
+            last = m
+        if last is not None:
+            return last.end()
+    return len(window)
+
+def _overlap_start(window: str, cut: int, overlap: int) -> int:
+    # where the next chunk starts, relative to the window; always > 0
+    start = max(cut - overlap, 1)
+    if 0 < start < cut and not window[start - 1].isspace():
+        m = _SPACE.search(window, start, cut)
+        start = m.end() if m else start
+    return start
+
+def batched(items: Iterable[T], n: int) -> Iterator[list[T]]:
+    it = iter(items)
+    while batch := list(islice(it, n)):
+        yield batch
+
+def chunk_and_embed(text: str, chunk_chars: int, overlap: int, dim: int | None):
+    """
+    Process-pool entry point for bulk ingest: chunk one document, sign each
+    chunk (SimHash) and, when dim is given, embed it with HashingEmbeddings in
+    the worker. Returns (chunks, signatures, float32 matrix or None). Must stay
+    module-level so it pickles.
+    """
+    chunks = list(iter_chunks(iter_pieces(text), chunk_chars, overlap))
+    sigs = [signature(ch) for ch in chunks]
+    if dim is None or not chunks:
+        return chunks, sigs, None
+    from app.platform.adapters.embeddings_hash import HashingEmbeddings
+    return chunks, sigs, HashingEmbeddings(d=dim).embed_matrix(chunks)
@@ -0,0 +1,25 @@
+"""
+Binary wire formats for pgvector types, used by COPY-based bulk writes.
+Layout matches pgvector's vector_send/vector_recv: int16 dim, int16 unused,
+then dim big-endian float4 values.
+"""
+import struct
+import numpy as np
+
+_HEADER = struct.Struct(">HH")
+
+def encode_vector(v) -> bytes:
+    a = np.asarray(v, dtype=">f4")
+    return _HEADER.pack(a.shape[0], 0) + a.tobytes()
+
+def decode_vector(b: bytes) -> np.ndarray:
+    dim, _ = _HEADER.unpack_from(b)
+    return np.frombuffer(b, dtype=">f4", count=dim, offset=_HEADER.size).astype(np.float32)
+
+async def register_binary_codecs(conn) -> None:
+    """Switch an asyncpg connection to binary vector I/O (needed by copy_records_to_table)."""
+    await conn.set_type_codec("vector", schema="public", encoder=encode_vector, decoder=decode_vector, format="binary")
+
+async def reset_binary_codecs(conn) -> None:
+    # Restore the text codec the SQLAlchemy Vector type expects
+    await conn.reset_type_codec("vector", schema="public")
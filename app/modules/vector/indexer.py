@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+import uuid
+from sqlalchemy import select, delete, update, func, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.modules.conversations.models import Conversation, Message
+from app.modules.conversations.transcripts import Transcript
+from app.modules.consent.service import ConsentService
+from app.modules.events.consumer import stream_consumer
+from app.modules.events.outbox import register_local_handler, run_outbox_relay
+from app.modules.vector.models import IndexQueue
+from app.modules.vector.service import VectorService
+
+log = logging.getLogger("vector.indexer")
+
+class AutoIndexer:
+    """
+    Background indexing of transcripts and ticket notes from outbox events.
+
+    Intake records each source in the indexqueue table, in the caller's
+    transaction (the relay's, for outbox events), so nothing is lost to a
+    restart. The worker waits a short window so bursts for one source
+    coalesce, then claims up to max_sources queued sources (SKIP LOCKED, so
+    several indexer processes can share the queue), plans them incrementally,
+    embeds all new chunks in one batch and writes them with a single bulk
+    insert; the claimed queue rows are deleted in that same transaction. A
+    failed flush leaves them queued with a backoff.
+    """
+    def __init__(self, window_seconds: float, max_sources: int, chunk_chars: int, overlap: int, poll_seconds: float = 10.0):
+        self.window = window_seconds
+        self.max_sources = max_sources
+        self.chunk_chars = chunk_chars
+        self.overlap = overlap
+        # queue rows written by other processes are found by polling
+        self.poll = poll_seconds
+        self._wakeup = asyncio.Event()
+        self.stats = {"flushes": 0, "sources": 0, "chunks": 0, "failed": 0, "last_flush_ms": 0.0}
+
+    # ---- intake ----
+    async def enqueue(self, session: AsyncSession, org_id: uuid.UUID, kind: str, source_id: uuid.UUID) -> None:
+        """Queue a source in the session's transaction; the caller commits."""
+        q = pg_insert(IndexQueue).values(org_id=org_id, kind=kind, source_id=source_id, attempts=0)
+        # queued again while in backoff: retry with the new change right away
+        q = q.on_conflict_do_update(
+            index_elements=[IndexQueue.org_id, IndexQueue.kind, IndexQueue.source_id],
+            set_={"next_attempt_at": func.now()},
+        )
+        await session.execute(q)
+        self._wakeup.set()
+
+    async def on_event(self, session: AsyncSession, ev) -> None:
+        """Outbox local handler: queued in the relay's transaction."""
+        payload = ev.payload or {}
+        if ev.event_type == "TRANSCRIPT_CREATED" and payload.get("message_id"):
+            await self.enqueue(session, ev.org_id, "transcript", uuid.UUID(ev.subject_id))
+        elif ev.event_type == "TICKET_NOTE_ADDED" and payload.get("ticket_id"):
+            await self.enqueue(session, ev.org_id, "ticket", uuid.UUID(payload["ticket_id"]))
+
+    async def on_stream_event(self, ev) -> None:
+        """Stream handler: returns (and the entry is acked) once the source is queued."""
+        async with SessionLocal() as session:
+            await self.on_event(session, ev)
+            await session.commit()
+
+    async def enqueue_conversation(self, session: AsyncSession, org_id: uuid.UUID, conversation_id: uuid.UUID) -> None:
+        await self.enqueue(session, org_id, "conversation", conversation_id)
+
+    async def enqueue_ticket(self, session: AsyncSession, org_id: uuid.UUID, ticket_id: uuid.UUID) -> None:
+        await self.enqueue(session, org_id, "ticket", ticket_id)
+
+    async def pending(self) -> int:
+        async with SessionLocal() as session:
+            return (await session.execute(select(func.count()).select_from(IndexQueue))).scalar() or 0
+
+    # ---- worker ----
+    async def run(self):
+        log.info("Auto-indexer started (window=%ss)", self.window)
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll)
+                    # coalesce: let a burst of events for the same sources queue up
+                    await asyncio.sleep(self.window)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                try:
+                    while await self.drain_once() >= self.max_sources:
+                        await asyncio.sleep(0)
+                except Exception:
+                    log.exception("Auto-index drain failed")
+        except asyncio.CancelledError:
+            log.info("Auto-indexer cancelled; shutting down")
+            raise
+
+    async def drain_once(self) -> int:
+        """Claim and index up to max_sources due queue rows; returns how many were claimed."""
+        async with SessionLocal() as session:
+            res = await session.execute(
+                select(IndexQueue)
+                .where(IndexQueue.next_attempt_at <= func.now())
+                .order_by(IndexQueue.next_attempt_at)
+                .limit(self.max_sources)
+                .with_for_update(skip_locked=True)
+            )
+            claimed = list(res.scalars().all())
+            if not claimed:
+                await session.commit()
+                return 0
+            queued: dict[str, dict[uuid.UUID, set[uuid.UUID]]] = {"transcript": {}, "conversation": {}, "ticket": {}}
+            for q in claimed:
+                queued[q.kind].setdefault(q.org_id, set()).add(q.source_id)
+            keys = [(q.org_id, q.kind, q.source_id) for q in claimed]
+            try:
+                await session.execute(
+                    delete(IndexQueue).where(tuple_(IndexQueue.org_id, IndexQueue.kind, IndexQueue.source_id).in_(keys))
+                )
+                await self.flush(session, queued["transcript"], queued["conversation"], queued["ticket"])
+            except Exception as e:
+                await session.rollback()
+                self.stats["failed"] += 1
+                log.exception("Auto-index flush of %s sources failed; retrying later", len(claimed))
+                await self._backoff(keys, str(e))
+        return len(claimed)
+
+    async def _backoff(self, keys: list[tuple], error: str) -> None:
+        async with SessionLocal() as session:
+            await session.execute(
+                update(IndexQueue)
+                .where(tuple_(IndexQueue.org_id, IndexQueue.kind, IndexQueue.source_id).in_(keys))
+                .values(
+                    attempts=IndexQueue.attempts + 1,
+                    # 2, 4, 8 ... 300s
+                    next_attempt_at=func.now() + func.make_interval(0, 0, 0, 0, 0, 0, func.least(300, func.power(2, IndexQueue.attempts + 1))),
+                    last_error=error[:2000],
+                )
+            )
+            await session.commit()
+
+    async def flush(self, session: AsyncSession, transcripts: dict, conversations: dict, tickets: dict) -> None:
+        """Plan the given sources (org_id -> ids) and write their chunks; commits the session."""
+        started = time.perf_counter()
+        svc = VectorService(session)
+        consent = ConsentService(session)
+        plans = []
+        for org_id in set(transcripts) | set(conversations):
+            convs = set(conversations.get(org_id, ()))
+            if transcripts.get(org_id):
+                res = await session.execute(
+                    select(Message.conversation_id)
+                    .join(Transcript, Transcript.message_id == Message.id)
+                    .where(Transcript.org_id == org_id, Transcript.id.in_(transcripts[org_id]))
+                )
+                convs.update(res.scalars().all())
+            if not convs:
+                continue
+            res = await session.execute(
+                select(Conversation.id, Conversation.patient_id).where(
+                    Conversation.org_id == org_id, Conversation.id.in_(convs), Conversation.deleted_at.is_(None)
+                )
+            )
+            patients = dict(res.all())
+            allowed = await consent.allowed_patients(org_id, {p for p in patients.values() if p}, "data_processing")
+            indexable = {cid for cid, pid in patients.items() if not pid or pid in allowed}
+            if not indexable:
+                continue
+            parts = await svc.conversation_parts(org_id, indexable)
+            for cid in indexable:
+                plans.append(await svc.plan_parts(org_id, "transcript", str(cid), patients[cid], parts[cid], self.chunk_chars, self.overlap, prune=True))
+        for org_id, ticket_ids in tickets.items():
+            parts = await svc.ticket_parts(org_id, ticket_ids)
+            for tid in ticket_ids:
+                plans.append(await svc.plan_parts(org_id, "ticket_note", str(tid), None, parts[tid], self.chunk_chars, self.overlap, prune=True))
+        if not plans:
+            await session.commit()
+            return
+        await svc.write_plans(plans)
+
+        chunks = sum(len(p.rows) for p in plans)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stats["flushes"] += 1
+        self.stats["sources"] += len(plans)
+        self.stats["chunks"] += chunks
+        self.stats["last_flush_ms"] = round(elapsed, 2)
+        log.info("Auto-indexed %s sources, %s chunks in %.1fms", len(plans), chunks, elapsed)
+
+auto_indexer = AutoIndexer(
+    window_seconds=settings.VECTOR_AUTOINDEX_WINDOW_SECONDS,
+    max_sources=settings.VECTOR_AUTOINDEX_MAX_SOURCES,
+    chunk_chars=settings.VECTOR_AUTOINDEX_CHUNK_CHARS,
+    overlap=settings.VECTOR_AUTOINDEX_OVERLAP,
+    poll_seconds=settings.VECTOR_AUTOINDEX_POLL_SECONDS,
+)
+
+def register_auto_indexer() -> None:
+    """Subscribe the auto-indexer to indexable events; call before the stream consumer starts reading."""
+    if settings.STREAM_CONSUMER_ENABLED:
+        # events arrive from the bus via the consumer group, so indexers scale out
+        stream_consumer.register(["TRANSCRIPT_CREATED", "TICKET_NOTE_ADDED"], auto_indexer.on_stream_event)
+    else:
+        register_local_handler(auto_indexer.on_event)
+
+async def run_auto_indexer():
+    register_auto_indexer()
+    await auto_indexer.run()
+
+async def run_relay_with_indexer():
+    """Entry point for the standalone outbox container: relay and auto-indexer share one loop."""
+    await asyncio.gather(run_outbox_relay(), run_auto_indexer())
+
+async def run_indexing_consumer():
+    """Entry point for stream consumer containers: consumer group member feeding the auto-indexer."""
+    if not settings.STREAM_CONSUMER_ENABLED:
+        # the auto-indexer would take events from the outbox relay instead,
+        # and the consumer would acknowledge the backlog without handling it
+        raise RuntimeError("run_indexing_consumer requires STREAM_CONSUMER_ENABLED")
+    register_auto_indexer()
+    await asyncio.gather(stream_consumer.run(), run_auto_indexer())
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from collections import Counter
+from sqlalchemy import select, text, update
+from app.core.config import settings
+from app.core.db import engine, SessionLocal
+from app.modules.vector.models import TextChunk
+from app.modules.vector.setup import index_manager
+from app.modules.vector.simhash import signature
+
+log = logging.getLogger("vector.maintenance")
+
+# Only one process compacts at a time; others skip the run
+_COMPACTION_LOCK = "SELECT pg_try_advisory_lock(hashtext('textchunk_compaction'))"
+_COMPACTION_UNLOCK = "SELECT pg_advisory_unlock(hashtext('textchunk_compaction'))"
+
+_PURGE_BATCH = text("""
+    DELETE FROM textchunk WHERE id IN (
+        SELECT id FROM textchunk
+        WHERE deleted_at IS NOT NULL AND deleted_at < now() - make_interval(hours => :hours)
+        LIMIT :batch
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING tableoid::regclass::text
+""")
+
+async def compact_textchunks(
+    *,
+    retention_hours: int | None = None,
+    batch_size: int | None = None,
+    reindex_churn_ratio: float | None = None,
+) -> dict:
+    """
+    Hard-delete chunks soft-deleted longer than the retention window, one
+    short transaction per batch. ANALYZE the partitions that lost rows; rebuild
+    a partition's vector index (concurrently, re-sized for the smaller
+    partition) when the purge removed a large share of it, since ivfflat
+    centroids and lists degrade with that much churn.
+    """
+    hours = retention_hours if retention_hours is not None else settings.VECTOR_COMPACTION_RETENTION_HOURS
+    batch = batch_size or settings.VECTOR_COMPACTION_BATCH_SIZE
+    ratio = reindex_churn_ratio if reindex_churn_ratio is not None else settings.VECTOR_REINDEX_CHURN_RATIO
+
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not (await conn.exec_driver_sql(_COMPACTION_LOCK)).scalar():
+            return {"purged": 0, "skipped": "locked"}
+        try:
+            by_partition: Counter[str] = Counter()
+            while True:
+                async with engine.begin() as tx:
+                    n = 0
+                    for (partition,) in (await tx.execute(_PURGE_BATCH, {"hours": hours, "batch": batch})).all():
+                        by_partition[partition] += 1
+                        n += 1
+                if n < batch:
+                    break
+
+            reindexed = []
+            if by_partition:
+                # row estimates from before the purge
+                await index_manager.load(conn)
+                for partition, purged in by_partition.items():
+                    before = index_manager.partitions[partition].rows if partition in index_manager.partitions else 0
+                    await conn.exec_driver_sql(f"ANALYZE {partition}")
+                    if purged / max(before, 1) >= ratio and await index_manager.rebuild(partition):
+                        reindexed.append(partition)
+            purged = sum(by_partition.values())
+            log.info("textchunk compaction purged=%s reindexed=%s", purged, reindexed)
+            return {"purged": purged, "by_partition": dict(by_partition), "reindexed": reindexed}
+        finally:
+            await conn.exec_driver_sql(_COMPACTION_UNLOCK)
+
+async def backfill_simhashes(batch_size: int | None = None) -> int:
+    """Sign live chunks written before SimHash existed, so search can collapse them."""
+    batch = batch_size or settings.VECTOR_COMPACTION_BATCH_SIZE
+    total = 0
+    while True:
+        async with SessionLocal() as session:
+            res = await session.execute(
+                select(TextChunk.id, TextChunk.org_id, TextChunk.text)
+                .where(TextChunk.simhash.is_(None), TextChunk.deleted_at.is_(None))
+                .limit(batch)
+            )
+            rows = res.all()
+            if not rows:
+                return total
+            await session.execute(
+                update(TextChunk),
+                [{"id": cid, "org_id": org_id, **signature(body)} for cid, org_id, body in rows],
+            )
+            await session.commit()
+        total += len(rows)
+        if len(rows) < batch:
+            return total
+
+async def run_vector_compaction(interval_seconds: float | None = None):
+    interval = interval_seconds or settings.VECTOR_COMPACTION_INTERVAL_SECONDS
+    log.info("Vector compaction started (every %ss)", interval)
+    try:
+        while True:
+            try:
+                result = await compact_textchunks()
+                # the process that won the compaction lock also does the backfill
+                if "skipped" not in result and (signed := await backfill_simhashes()):
+                    log.info("Backfilled SimHash signatures for %s chunks", signed)
+            except Exception:
+                log.exception("Vector compaction run failed")
+            await asyncio.sleep(interval)
+    except asyncio.CancelledError:
+        log.info("Vector compaction cancelled; shutting down")
+        raise
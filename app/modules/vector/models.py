@@ -1,6 +1,8 @@
 import uuid
+from datetime import datetime
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import String, Text, Integer, ForeignKey, JSON
+from sqlalchemy import String, Text, Integer, BigInteger, ForeignKey, JSON, Index, TIMESTAMP, func, text as sql_text
+from sqlalchemy.dialects.postgresql import ARRAY
 from pgvector.sqlalchemy import Vector
 from app.core.base import Base, TimestampedTenantMixin
 
@@ -11,9 +13,25 @@ class TextChunk(Base, TimestampedTenantMixin):
       - transcript (message/conversation)
       - ticket_note
       - knowledge (free text ingestion)
+
+    LIST-partitioned by org_id (see vector/partitions.py); the partition key
+    has to be part of the primary key.
     """
+    __table_args__ = (
+        Index("ix_textchunk_source_part", "org_id", "source_type", "source_id", "part_id"),
+        # scope lookups for patient-filtered search (exact KNN fast path)
+        Index("ix_textchunk_org_patient", "org_id", "patient_id", postgresql_where=sql_text("deleted_at IS NULL")),
+        # near-duplicate candidate lookup by SimHash band
+        Index("ix_textchunk_simhash_bands", "simhash_bands", postgresql_using="gin", postgresql_where=sql_text("deleted_at IS NULL")),
+        {"postgresql_partition_by": "LIST (org_id)"},
+    )
+
+    org_id: Mapped[uuid.UUID] = mapped_column(primary_key=True, default=uuid.uuid4)
+
     source_type: Mapped[str] = mapped_column(String(32))  # transcript | ticket_note | knowledge
     source_id: Mapped[str] = mapped_column(String(64))    # UUID string or custom id
+    part_id: Mapped[str | None] = mapped_column(String(64), nullable=True)  # transcript_id | note_id within the source
+    content_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)  # sha256 of the part's text + chunking params
     patient_id: Mapped[uuid.UUID | None] = mapped_column(ForeignKey("patient.id"), nullable=True)
 
     # Optional cross-links for provenance
@@ -22,5 +40,43 @@ class TextChunk(Base, TimestampedTenantMixin):
     text: Mapped[str] = mapped_column(Text)
     chunk_index: Mapped[int] = mapped_column(Integer, default=0)
 
-    # Vector column (pgvector)
-    embedding: Mapped[list[float]] = mapped_column(Vector(dim=384))
\ No newline at end of file
+    # Near-duplicate detection (see vector/simhash.py)
+    simhash: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    simhash_bands: Mapped[list[int] | None] = mapped_column(ARRAY(Integer), nullable=True)
+
+    # Vector column (pgvector) and the "provider:dim:version" model that produced it.
+    # While a model migration runs a chunk has one row per model.
+    embedding: Mapped[list[float]] = mapped_column(Vector(dim=384))
+    embedding_model: Mapped[str] = mapped_column(String(64))
+
+class EmbeddingMigration(Base):
+    """Progress of re-embedding textchunk from one model to another (see vector/reembed.py)."""
+    __tablename__ = "embeddingmigration"
+
+    target_model: Mapped[str] = mapped_column(String(64), primary_key=True)
+    source_model: Mapped[str] = mapped_column(String(64))
+    status: Mapped[str] = mapped_column(String(16), default="backfill")  # backfill | backfilled | retiring | done | cancelled
+    # keyset cursor over textchunk (id, org_id)
+    cursor_id: Mapped[uuid.UUID | None] = mapped_column(nullable=True)
+    cursor_org_id: Mapped[uuid.UUID | None] = mapped_column(nullable=True)
+    rows_scanned: Mapped[int] = mapped_column(BigInteger, default=0)
+    rows_embedded: Mapped[int] = mapped_column(BigInteger, default=0)
+    rows_retired: Mapped[int] = mapped_column(BigInteger, default=0)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class IndexQueue(Base):
+    """
+    Sources waiting for the auto-indexer (see vector/indexer.py). A row is
+    deleted in the transaction that writes the source's chunks, so queued
+    work survives restarts and failed flushes.
+    """
+    __tablename__ = "indexqueue"
+
+    org_id: Mapped[uuid.UUID] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(String(16), primary_key=True)  # transcript | conversation | ticket
+    source_id: Mapped[uuid.UUID] = mapped_column(primary_key=True)
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now(), index=True)
+    last_error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
@@ -0,0 +1,130 @@
+"""
+textchunk partition layout.
+
+textchunk is LIST-partitioned by org_id. Large tenants get a dedicated
+partition (textchunk_t_<org hex>); everyone else lands in the DEFAULT
+partition, which is itself HASH-partitioned by org_id into
+VECTOR_PARTITION_HASH_BUCKETS buckets (textchunk_h<n>). Every leaf carries its
+own vector index, sized for that leaf. Before the partitioning migration runs,
+the plain table shows up as a single leaf named "textchunk".
+"""
+import hashlib
+import logging
+import re
+import uuid
+from dataclasses import dataclass
+from sqlalchemy import text
+from app.core.config import settings
+
+log = logging.getLogger("vector.partitions")
+
+PARENT = "textchunk"
+DEFAULT_PARTITION = "textchunk_default"
+_TENANT_PREFIX = "textchunk_t_"
+_HASH_PREFIX = "textchunk_h"
+
+_LIST_BOUND = re.compile(r"FOR VALUES IN \('([0-9a-f-]{36})'\)")
+_HASH_BOUND = re.compile(r"modulus (\d+), remainder (\d+)")
+
+@dataclass
+class Partition:
+    name: str
+    kind: str  # tenant | hash | table
+    rows: int
+    org_id: uuid.UUID | None = None
+    modulus: int | None = None
+    remainder: int | None = None
+
+def tenant_partition_name(org_id: uuid.UUID) -> str:
+    return f"{_TENANT_PREFIX}{org_id.hex}"
+
+def vector_index_name(partition: str, model: str | None = None) -> str:
+    # "textchunk_embedding_idx" for the unpartitioned table, as before; per-model
+    # partial indexes get a short digest of the model id (identifiers cap at 63)
+    if model is None:
+        return f"{partition}_embedding_idx"
+    return f"{partition}_emb_{hashlib.sha1(model.encode('utf-8')).hexdigest()[:8]}"
+
+async def is_partitioned(conn) -> bool:
+    kind = (await conn.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"), {"t": PARENT})).scalar()
+    return kind == "p"
+
+async def ensure_partitions(conn) -> None:
+    """Create the DEFAULT partition and its hash buckets if the parent is partitioned."""
+    if not await is_partitioned(conn):
+        return
+    await conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT PARTITION BY HASH (org_id)"
+    )
+    existing = (await conn.execute(
+        text("SELECT count(*) FROM pg_inherits WHERE inhparent = to_regclass(:t)"), {"t": DEFAULT_PARTITION}
+    )).scalar()
+    if existing:
+        # the modulus is fixed once buckets exist
+        return
+    m = settings.VECTOR_PARTITION_HASH_BUCKETS
+    for r in range(m):
+        await conn.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {_HASH_PREFIX}{r} PARTITION OF {DEFAULT_PARTITION} "
+            f"FOR VALUES WITH (MODULUS {m}, REMAINDER {r})"
+        )
+
+async def list_partitions(conn) -> list[Partition]:
+    """Leaf partitions of textchunk with row estimates (exact counts if never analyzed)."""
+    res = await conn.execute(text(f"""
+        SELECT c.relname, c.reltuples::bigint, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_partition_tree('{PARENT}'::regclass) t
+        JOIN pg_class c ON c.oid = t.relid
+        WHERE t.isleaf
+        ORDER BY c.relname
+    """))
+    parts = []
+    for name, reltuples, bound in res.all():
+        if reltuples is None or reltuples < 0:
+            reltuples = (await conn.exec_driver_sql(f"SELECT count(*) FROM {name}")).scalar() or 0
+        p = Partition(name=name, kind="table", rows=int(reltuples))
+        if bound and (m := _LIST_BOUND.search(bound)):
+            p.kind, p.org_id = "tenant", uuid.UUID(m.group(1))
+        elif bound and (m := _HASH_BOUND.search(bound)):
+            p.kind, p.modulus, p.remainder = "hash", int(m.group(1)), int(m.group(2))
+        parts.append(p)
+    return parts
+
+async def hash_bucket_for(conn, org_id: uuid.UUID, modulus: int) -> str | None:
+    """Name of the DEFAULT-partition bucket an org's rows hash to."""
+    r = (await conn.execute(text(f"""
+        SELECT r FROM generate_series(0, :m - 1) r
+        WHERE satisfies_hash_partition('{DEFAULT_PARTITION}'::regclass, :m, r, CAST(:org AS uuid))
+    """), {"m": modulus, "org": str(org_id)})).scalar()
+    return None if r is None else f"{_HASH_PREFIX}{r}"
+
+async def large_tenants(conn, partition: str, min_rows: int) -> list[tuple[uuid.UUID, int]]:
+    res = await conn.execute(
+        text(f"SELECT org_id, count(*) FROM {partition} GROUP BY org_id HAVING count(*) >= :n ORDER BY 2 DESC"),
+        {"n": min_rows},
+    )
+    return [(org_id, int(n)) for org_id, n in res.all()]
+
+async def move_tenant(conn, org_id: uuid.UUID) -> str:
+    """
+    Move an org's rows out of the DEFAULT partition into a dedicated LIST
+    partition; run inside one transaction. Writes to the DEFAULT partition,
+    i.e. ingest for every tenant without its own partition, block for the
+    whole copy (minutes for millions of rows), so this is a maintenance
+    operation. Parent-level indexes (FTS, source/part, ...) are
+    created on the new partition by ATTACH; the vector index is the caller's.
+    """
+    name = tenant_partition_name(org_id)
+    org = str(org_id)
+    await conn.exec_driver_sql(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS)")
+    # lets ATTACH skip scanning the new table for its partition constraint
+    await conn.exec_driver_sql(f"ALTER TABLE {name} ADD CONSTRAINT {name}_org CHECK (org_id = '{org}'::uuid)")
+    await conn.exec_driver_sql(f"LOCK TABLE {DEFAULT_PARTITION} IN EXCLUSIVE MODE")
+    moved = (await conn.execute(
+        text(f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE org_id = CAST(:org AS uuid)"), {"org": org}
+    )).rowcount
+    await conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE org_id = CAST(:org AS uuid)"), {"org": org})
+    await conn.exec_driver_sql(f"ALTER TABLE {PARENT} ATTACH PARTITION {name} FOR VALUES IN ('{org}')")
+    await conn.exec_driver_sql(f"ALTER TABLE {name} DROP CONSTRAINT {name}_org")
+    log.info("Moved %s chunks of org %s into partition %s", moved, org_id, name)
+    return name
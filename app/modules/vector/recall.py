@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import asdict
+import numpy as np
+from app.core.config import settings
+
+log = logging.getLogger("vector.recall")
+
+class RecallMonitor:
+    """
+    Rolling recall@k of the ANN vector stage, per partition.
+
+    search_hybrid hands a VECTOR_RECALL_SAMPLE_RATE fraction of its ANN
+    queries to submit(); each is re-run as exact KNN (sequential scan) on a
+    separate connection after the request has returned, and the two candidate
+    lists are compared here. At most VECTOR_RECALL_MAX_IN_FLIGHT re-runs are
+    pending per process; samples beyond that are dropped rather than queued.
+    A partition's window resets whenever its index plan changes, so numbers
+    always describe the index currently serving it. Per process, like the
+    other in-memory stats.
+    """
+    def __init__(self, window: int, sample_rate: float, max_in_flight: int):
+        self.window = max(1, int(window))
+        self.sample_rate = float(sample_rate)
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._samples: dict[str, deque[dict]] = {}
+        self._plans: dict[str, str | None] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.dropped = 0
+        self.failed = 0
+
+    def should_sample(self) -> bool:
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def submit(self, coro) -> bool:
+        """Run a measurement coroutine in the background, unless too many are pending."""
+        if len(self._tasks) >= self.max_in_flight:
+            self.dropped += 1
+            coro.close()
+            return False
+        task = asyncio.create_task(self._run(coro))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, coro) -> None:
+        try:
+            await coro
+        except Exception:
+            self.failed += 1
+            log.warning("Recall sample failed", exc_info=True)
+
+    def record(self, partition: str, plan, *, top_k: int, ann_ids: list, exact_ids: list, ann_ms: float, exact_ms: float) -> None:
+        key = json.dumps(asdict(plan), sort_keys=True) if plan else None
+        if self._plans.get(partition, key) != key:
+            self._samples.pop(partition, None)
+        self._plans[partition] = key
+        k = min(top_k, len(exact_ids))
+        truth = set(exact_ids[:k])
+        self._samples.setdefault(partition, deque(maxlen=self.window)).append({
+            "at": time.time(),
+            "recall": len(truth & set(ann_ids[:k])) / k if k else 1.0,
+            # share of the exact candidate pool the ANN pool also found
+            "overlap": len(set(exact_ids) & set(ann_ids)) / len(exact_ids) if exact_ids else 1.0,
+            "ann_ms": ann_ms,
+            "exact_ms": exact_ms,
+        })
+
+    def reset(self, partition: str) -> None:
+        self._samples.pop(partition, None)
+        self._plans.pop(partition, None)
+
+    def recall(self, partition: str) -> tuple[float | None, int]:
+        samples = self._samples.get(partition)
+        if not samples:
+            return None, 0
+        return float(np.mean([s["recall"] for s in samples])), len(samples)
+
+    def degraded(self, threshold: float, min_samples: int) -> list[str]:
+        """Partitions whose rolling recall@k is below threshold over at least min_samples samples."""
+        out = []
+        for partition in self._samples:
+            value, n = self.recall(partition)
+            if n >= min_samples and value is not None and value < threshold:
+                out.append(partition)
+        return out
+
+    def report(self) -> dict:
+        partitions = []
+        for partition, samples in sorted(self._samples.items()):
+            recalls = np.array([s["recall"] for s in samples])
+            ann = np.array([s["ann_ms"] for s in samples])
+            exact = np.array([s["exact_ms"] for s in samples])
+            partitions.append({
+                "partition": partition,
+                "index_plan": json.loads(self._plans[partition]) if self._plans.get(partition) else None,
+                "samples": len(samples),
+                "recall_at_k_mean": round(float(recalls.mean()), 4),
+                "recall_at_k_p10": round(float(np.percentile(recalls, 10)), 4),
+                "recall_at_k_min": round(float(recalls.min()), 4),
+                "candidate_overlap_mean": round(float(np.mean([s["overlap"] for s in samples])), 4),
+                "ann_ms_p50": round(float(np.percentile(ann, 50)), 3),
+                "ann_ms_p95": round(float(np.percentile(ann, 95)), 3),
+                "exact_ms_p50": round(float(np.percentile(exact, 50)), 3),
+                "latency_delta_ms_p50": round(float(np.percentile(exact - ann, 50)), 3),
+                "first_sample_at": samples[0]["at"],
+                "last_sample_at": samples[-1]["at"],
+            })
+        return {
+            "sample_rate": self.sample_rate,
+            "window": self.window,
+            "in_flight": len(self._tasks),
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "rebuild_below": settings.VECTOR_RECALL_REBUILD_BELOW or None,
+            "partitions": partitions,
+        }
+
+recall_monitor = RecallMonitor(
+    window=settings.VECTOR_RECALL_WINDOW,
+    sample_rate=settings.VECTOR_RECALL_SAMPLE_RATE,
+    max_in_flight=settings.VECTOR_RECALL_MAX_IN_FLIGHT,
+)
@@ -0,0 +1,286 @@
+"""
+Online embedding-model migration.
+
+Set EMBEDDINGS_MIGRATION_TARGET to a new "provider:dim:version" id and:
+
+  1. backfill: new chunks are dual-written (active + target model) while this
+     job walks textchunk in (id, org_id) keyset order and writes a target-model
+     twin for every live chunk of the source model, at most
+     EMBEDDINGS_REEMBED_ROWS_PER_SECOND. The cursor is committed with each
+     batch, so a restart resumes where it stopped.
+  2. backfilled: the target's vector indexes are built; searches still use the
+     active model. Switch over by making the target the active model
+     (EMBEDDINGS_PROVIDER / EMBEDDINGS_MODEL_VERSION).
+  3. retiring -> done: once the target is active, the source model's rows are
+     soft-deleted (throttled the same way) and purged by compaction; the index
+     manager drops the source model's indexes.
+
+Unsetting the target before switching cancels the migration and retires the
+target's rows instead. Switching before the job reports "backfilled" is
+tolerated: searches stay on the source model (which keeps being written)
+until the backfill completes, and an error is logged.
+"""
+import asyncio
+import logging
+import time
+from sqlalchemy import select, tuple_, update, text, func
+from app.core.config import settings
+from app.core.db import engine, SessionLocal
+from app.platform.provider_registry import registry
+from app.modules.vector.models import TextChunk, EmbeddingMigration
+from app.modules.vector.repository import VectorRepository, model_filter
+from app.modules.vector.setup import index_manager
+
+log = logging.getLogger("vector.reembed")
+
+# Only one process re-embeds at a time; others skip the run
+_REEMBED_LOCK = "SELECT pg_try_advisory_lock(hashtext('textchunk_reembed'))"
+_REEMBED_UNLOCK = "SELECT pg_advisory_unlock(hashtext('textchunk_reembed'))"
+_IDLE_SECONDS = 60
+_STATE_TTL_SECONDS = 30
+_state_checked = 0.0
+
+# columns a twin row copies from its source-model row
+_TWIN_COLUMNS = (
+    "org_id", "source_type", "source_id", "part_id", "content_hash", "patient_id",
+    "locator", "text", "chunk_index", "simhash", "simhash_bands",
+)
+
+# target-model rows whose source-model row was deleted while the twin was being written
+_SWEEP_ORPHANS = text("""
+    UPDATE textchunk t SET deleted_at = now()
+    WHERE t.embedding_model = :target AND t.deleted_at IS NULL
+      AND NOT EXISTS (
+        SELECT 1 FROM textchunk s
+        WHERE s.org_id = t.org_id AND s.source_type = t.source_type AND s.source_id = t.source_id
+          AND s.part_id IS NOT DISTINCT FROM t.part_id AND s.chunk_index = t.chunk_index
+          AND s.embedding_model = :source AND s.deleted_at IS NULL
+      )
+""")
+
+async def _throttle(rows: int, started: float) -> None:
+    rate = settings.EMBEDDINGS_REEMBED_ROWS_PER_SECOND
+    if rate > 0:
+        await asyncio.sleep(max(0.0, rows / rate - (time.monotonic() - started)))
+
+async def refresh_migration_state(force: bool = False) -> None:
+    """
+    Point registry.search_model() at a migration's source model while its
+    target is already active but still backfilling, so searches do not lose
+    the rows not re-embedded yet. Checked at most every _STATE_TTL_SECONDS
+    per process; a failed check keeps the previous state.
+    """
+    global _state_checked
+    if not force and time.monotonic() - _state_checked < _STATE_TTL_SECONDS:
+        return
+    _state_checked = time.monotonic()
+    active = settings.EMBEDDINGS_MODEL
+    try:
+        async with SessionLocal() as session:
+            res = await session.execute(
+                select(EmbeddingMigration.source_model).where(
+                    EmbeddingMigration.target_model == active, EmbeddingMigration.status == "backfill"
+                )
+            )
+            source = res.scalar()
+    except Exception:
+        log.warning("Embedding migration state check failed", exc_info=True)
+        return
+    if source and registry.search_model() != source:
+        log.error("Active embedding model %s is still being backfilled; searching %s until the backfill finishes", active, source)
+    elif not source and registry.search_model() != active:
+        log.info("Backfill of %s finished; searching it", active)
+    registry.set_search_fallback(source)
+
+async def _current_job(session) -> EmbeddingMigration | None:
+    target = settings.EMBEDDINGS_MIGRATION_TARGET
+    active = settings.EMBEDDINGS_MODEL
+    if target and target != active:
+        job = await session.get(EmbeddingMigration, target)
+        if job is None:
+            job = EmbeddingMigration(target_model=target, source_model=active)
+            session.add(job)
+        elif job.status in ("done", "cancelled"):
+            # migrating to a model again: start over from the current one
+            job.source_model, job.status, job.cursor_id, job.cursor_org_id = active, "backfill", None, None
+            job.rows_scanned = job.rows_embedded = job.rows_retired = 0
+        else:
+            return job
+        await session.commit()
+        log.info("Embedding migration %s -> %s started", active, target)
+        return job
+    # switched over (the target is now the active model) or cancelled
+    res = await session.execute(
+        select(EmbeddingMigration).where(EmbeddingMigration.status.not_in(("done", "cancelled")))
+    )
+    return res.scalars().first()
+
+async def backfill_batch(job_target: str) -> int:
+    """Re-embed the next keyset page of source-model rows; returns rows scanned (0 = finished)."""
+    async with SessionLocal() as session:
+        job = await session.get(EmbeddingMigration, job_target)
+        conds = [model_filter(job.source_model), TextChunk.deleted_at.is_(None)]
+        if job.cursor_id is not None:
+            conds.append(tuple_(TextChunk.id, TextChunk.org_id) > tuple_(job.cursor_id, job.cursor_org_id))
+        # FOR SHARE: a concurrent re-index of the same source waits for this batch
+        res = await session.execute(
+            select(TextChunk).where(*conds)
+            .order_by(TextChunk.id, TextChunk.org_id)
+            .limit(settings.EMBEDDINGS_REEMBED_BATCH_SIZE)
+            .with_for_update(read=True)
+        )
+        page = list(res.scalars().all())
+        if not page:
+            return 0
+        res = await session.execute(
+            select(TextChunk.org_id, TextChunk.source_type, TextChunk.source_id, TextChunk.part_id, TextChunk.chunk_index)
+            .where(
+                TextChunk.org_id.in_({c.org_id for c in page}),
+                TextChunk.source_id.in_({c.source_id for c in page}),
+                TextChunk.deleted_at.is_(None),
+                model_filter(job.target_model),
+            )
+        )
+        have = set(res.all())
+        # dual-written since the migration started, or done by an earlier run
+        missing = [c for c in page if (c.org_id, c.source_type, c.source_id, c.part_id, c.chunk_index) not in have]
+        if missing:
+            vectors = await registry.embeddings_for(job.target_model).embed([c.text for c in missing])
+            await VectorRepository(session).bulk_insert_chunks({
+                **{col: getattr(c, col) for col in _TWIN_COLUMNS},
+                "embedding": vectors[i],
+                "embedding_model": job.target_model,
+            } for i, c in enumerate(missing))
+        job.cursor_id, job.cursor_org_id = page[-1].id, page[-1].org_id
+        job.rows_scanned += len(page)
+        job.rows_embedded += len(missing)
+        await session.commit()
+        return len(page)
+
+async def retire_batch(model: str) -> int:
+    """Soft-delete the next batch of a model's live rows; returns rows retired (0 = none left)."""
+    async with SessionLocal() as session:
+        batch = (
+            select(TextChunk.id, TextChunk.org_id)
+            .where(model_filter(model), TextChunk.deleted_at.is_(None))
+            .limit(settings.EMBEDDINGS_REEMBED_BATCH_SIZE)
+        )
+        res = await session.execute(
+            update(TextChunk)
+            .where(tuple_(TextChunk.id, TextChunk.org_id).in_(batch))
+            .values(deleted_at=func.now())
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        return res.rowcount or 0
+
+async def _set_status(job_target: str, status: str, retired: int = 0) -> None:
+    async with SessionLocal() as session:
+        job = await session.get(EmbeddingMigration, job_target)
+        job.status = status
+        job.rows_retired += retired
+        await session.commit()
+
+async def _retire(job: EmbeddingMigration, model: str) -> int:
+    total = 0
+    while True:
+        started = time.monotonic()
+        n = await retire_batch(model)
+        if not n:
+            return total
+        total += n
+        await _set_status(job.target_model, job.status, n)
+        await _throttle(n, started)
+
+async def migrate_embeddings() -> dict:
+    """Advance the current migration as far as it can go; one process at a time."""
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not (await conn.exec_driver_sql(_REEMBED_LOCK)).scalar():
+            return {"skipped": "locked"}
+        try:
+            async with SessionLocal() as session:
+                job = await _current_job(session)
+            if job is None:
+                return {"status": None}
+            active = settings.EMBEDDINGS_MODEL
+            writing = registry.write_models()
+
+            if job.target_model not in writing:
+                # target unset before switching over: drop what was written for it
+                if job.status != "retiring":
+                    job.status = "retiring"
+                    await _set_status(job.target_model, "retiring")
+                n = await _retire(job, job.target_model)
+                await _set_status(job.target_model, "cancelled")
+                log.info("Embedding migration to %s cancelled; retired %s rows", job.target_model, n)
+                return {"status": "cancelled", "retired": n}
+
+            if job.status == "backfill":
+                while True:
+                    started = time.monotonic()
+                    n = await backfill_batch(job.target_model)
+                    if not n:
+                        break
+                    await _throttle(n, started)
+                async with engine.begin() as tx:
+                    swept = (await tx.execute(_SWEEP_ORPHANS, {"target": job.target_model, "source": job.source_model})).rowcount
+                if swept:
+                    log.info("Embedding migration to %s: retired %s orphaned rows", job.target_model, swept)
+                # indexes are built now that the target's rows exist (ivfflat trains on them)
+                async with engine.connect() as c:
+                    await index_manager.load(c)
+                for p in list(index_manager.partitions.values()):
+                    await index_manager.rebuild(p.name, p.rows, model=job.target_model)
+                job.status = "backfilled"
+                await _set_status(job.target_model, "backfilled")
+                log.info("Embedding migration to %s backfilled; switch the active model to complete it", job.target_model)
+                await refresh_migration_state(force=True)
+                writing = registry.write_models()
+
+            if job.status in ("backfilled", "retiring") and active == job.target_model and job.source_model not in writing:
+                job.status = "retiring"
+                await _set_status(job.target_model, "retiring")
+                n = await _retire(job, job.source_model)
+                await _set_status(job.target_model, "done")
+                log.info("Embedding migration to %s done; retired %s rows of %s", job.target_model, n, job.source_model)
+                return {"status": "done", "retired": n}
+            return {"status": job.status}
+        finally:
+            await conn.exec_driver_sql(_REEMBED_UNLOCK)
+
+async def migration_status() -> dict:
+    async with SessionLocal() as session:
+        res = await session.execute(select(EmbeddingMigration).order_by(EmbeddingMigration.created_at.desc()))
+        jobs = res.scalars().all()
+    return {
+        "active_model": settings.EMBEDDINGS_MODEL,
+        "search_model": registry.search_model(),
+        "migration_target": settings.EMBEDDINGS_MIGRATION_TARGET,
+        "write_models": registry.write_models(),
+        "jobs": [{
+            "source_model": j.source_model,
+            "target_model": j.target_model,
+            "status": j.status,
+            "rows_scanned": j.rows_scanned,
+            "rows_embedded": j.rows_embedded,
+            "rows_retired": j.rows_retired,
+            "created_at": j.created_at,
+            "updated_at": j.updated_at,
+        } for j in jobs],
+    }
+
+async def run_embedding_migration(interval_seconds: float | None = None):
+    interval = interval_seconds or _IDLE_SECONDS
+    log.info("Embedding migration runner started (every %ss)", interval)
+    try:
+        while True:
+            try:
+                await refresh_migration_state(force=True)
+                await migrate_embeddings()
+            except Exception:
+                log.exception("Embedding migration run failed")
+            await asyncio.sleep(interval)
+    except asyncio.CancelledError:
+        log.info("Embedding migration runner cancelled; shutting down")
+        raise
@@ -1,56 +1,435 @@
+import json
+import math
+import time
 import uuid
-from typing import Sequence
+from dataclasses import asdict
+from itertools import islice
+from typing import Iterable, Sequence
+import numpy as np
+from pgvector.sqlalchemy import HALFVEC
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, func, literal, desc
+from sqlalchemy.dialects.postgresql import BIT
+from sqlalchemy import select, insert, update, and_, or_, func, literal, literal_column, cast, desc, text, Float
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.platform.provider_registry import registry
 from app.modules.vector.models import TextChunk
+from app.modules.vector.codecs import register_binary_codecs, reset_binary_codecs
+from app.modules.vector.setup import index_manager
+from app.modules.vector.recall import recall_monitor
+from app.modules.vector.simhash import hamming, same_facts
+
+_FTS_CONFIG = literal_column("'simple'::regconfig")
+
+# Columns written by bulk_insert_chunks; timestamps come from server defaults
+_COPY_COLUMNS = (
+    "id", "org_id", "version", "source_type", "source_id", "part_id", "content_hash",
+    "patient_id", "locator", "text", "chunk_index", "simhash", "simhash_bands", "embedding",
+    "embedding_model",
+)
 
 class VectorRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
 
     async def delete_by_source(self, org_id: uuid.UUID, source_type: str, source_id: str) -> int:
-        q = select(TextChunk).where(
+        # single set-based soft delete; rows are purged later by compact_textchunks
+        q = update(TextChunk).where(
             TextChunk.org_id == org_id,
             TextChunk.source_type == source_type,
             TextChunk.source_id == source_id,
             TextChunk.deleted_at.is_(None),
-        )
+        ).values(deleted_at=func.now()).execution_options(synchronize_session=False)
         res = await self.session.execute(q)
-        rows = res.scalars().all()
-        for r in rows:
-            r.deleted_at = func.now()  # soft delete
-        await self.session.flush()
-        return len(rows)
+        return res.rowcount or 0
+
+    async def part_hashes(self, org_id: uuid.UUID, source_type: str, source_id: str) -> dict[str | None, str | None]:
+        # part_id -> content_hash of the live chunks currently indexed for a source
+        q = select(TextChunk.part_id, TextChunk.content_hash).where(
+            TextChunk.org_id == org_id,
+            TextChunk.source_type == source_type,
+            TextChunk.source_id == source_id,
+            TextChunk.deleted_at.is_(None),
+        ).distinct()
+        res = await self.session.execute(q)
+        return {part_id: content_hash for part_id, content_hash in res.all()}
+
+    async def delete_by_parts(self, org_id: uuid.UUID, source_type: str, source_id: str, part_ids: Sequence[str | None]) -> int:
+        if not part_ids:
+            return 0
+        ids = [p for p in part_ids if p is not None]
+        match = TextChunk.part_id.in_(ids)
+        if len(ids) != len(part_ids):
+            # chunks indexed before part tracking have no part_id
+            match = or_(match, TextChunk.part_id.is_(None))
+        q = update(TextChunk).where(
+            TextChunk.org_id == org_id,
+            TextChunk.source_type == source_type,
+            TextChunk.source_id == source_id,
+            TextChunk.deleted_at.is_(None),
+            match,
+        ).values(deleted_at=func.now()).execution_options(synchronize_session=False)
+        res = await self.session.execute(q)
+        return res.rowcount or 0
+
+    async def duplicate_mask(self, rows: list[dict]) -> list[bool]:
+        """
+        With VECTOR_DEDUP_INGEST, for rows carrying simhash / simhash_bands,
+        True where the row should be written: no live chunk of the same org
+        and patient, and no earlier row in the batch, has the same text
+        (ignoring case and whitespace). Only exact duplicates are skipped;
+        near-duplicates can differ in a dose or a negation. Identical texts
+        have identical signatures, so one GIN band lookup per (org, patient)
+        group finds the candidates.
+        """
+        if not settings.VECTOR_DEDUP_INGEST:
+            return [True] * len(rows)
+        groups: dict[tuple, list[int]] = {}
+        for i, r in enumerate(rows):
+            if r.get("simhash") is not None:
+                groups.setdefault((r["org_id"], r.get("patient_id")), []).append(i)
+        keep = [True] * len(rows)
+        for (org_id, patient_id), idxs in groups.items():
+            res = await self.session.execute(
+                select(TextChunk.text).distinct().where(
+                    TextChunk.org_id == org_id,
+                    TextChunk.patient_id.is_not_distinct_from(patient_id),
+                    TextChunk.deleted_at.is_(None),
+                    TextChunk.simhash_bands.overlap(sorted({b for i in idxs for b in rows[i]["simhash_bands"]})),
+                    TextChunk.simhash.in_({rows[i]["simhash"] for i in idxs}),
+                )
+            )
+            seen = {_normalized(t) for t in res.scalars().all()}
+            for i in idxs:
+                key = _normalized(rows[i]["text"])
+                if key in seen:
+                    keep[i] = False
+                else:
+                    seen.add(key)
+        return keep
 
     async def insert_chunks(self, objs: list[TextChunk]) -> None:
         self.session.add_all(objs)
         await self.session.flush()
 
-    async def search_hybrid(self, org_id: uuid.UUID, query_vec: list[float], query_text: str, *, top_k: int = 10, patient_id: uuid.UUID | None = None, source_type: str | None = None) -> list[tuple[TextChunk, float]]:
-        conds = [TextChunk.org_id == org_id, TextChunk.deleted_at.is_(None)]
+    async def bulk_insert_chunks(self, rows: Iterable[dict], *, batch_size: int = 1000) -> int:
+        """
+        Stream chunk rows (dicts keyed by column name) into textchunk in bounded
+        batches. On asyncpg this is a binary COPY with embeddings in pgvector's
+        binary format; other drivers get multi-row INSERTs. Runs inside the
+        session's transaction; the caller commits.
+        """
+        conn = await self.session.connection()
+        driver = (await conn.get_raw_connection()).driver_connection
+        it = iter(rows)
+        total = 0
+        if not hasattr(driver, "copy_records_to_table"):
+            while batch := [_with_defaults(r) for r in islice(it, batch_size)]:
+                await self.session.execute(insert(TextChunk), batch)
+                total += len(batch)
+            return total
+
+        # COPY goes straight to the driver connection; run a statement through
+        # SQLAlchemy first so its transaction is open and the COPY joins it
+        await conn.exec_driver_sql("SELECT 1")
+        await register_binary_codecs(driver)
+        try:
+            while batch := list(islice(it, batch_size)):
+                records = []
+                for r in batch:
+                    r = _with_defaults(r)
+                    r["locator"] = json.dumps(r["locator"]) if r.get("locator") is not None else None
+                    records.append(tuple(r.get(c) for c in _COPY_COLUMNS))
+                await driver.copy_records_to_table("textchunk", records=records, columns=list(_COPY_COLUMNS))
+                total += len(records)
+        finally:
+            await reset_binary_codecs(driver)
+        return total
+
+    async def search_hybrid(self, org_id: uuid.UUID, query_vec: list[float], query_text: str, *, top_k: int = 10, patient_id: uuid.UUID | None = None, source_type: str | None = None, candidates: int | None = None, fusion: str | None = None, recall: str | None = None) -> list[tuple[TextChunk, float]]:
+        """
+        Two-stage retrieval: take the top-N by vector distance (ivfflat) and the
+        top-N by FTS rank (GIN) independently, fuse the two lists, then cut to top_k.
+        Each stage is an ORDER BY ... LIMIT the indexes can serve, so cost tracks
+        the candidate pool instead of the org's corpus size. `recall` (fast |
+        balanced | high) sets ivfflat.probes / hnsw.ef_search for this transaction.
+        With a halfvec / binary index in place the vector stage goes through it
+        and re-ranks on the full vectors (see vector_candidates).
+
+        Patient-scoped searches whose scope holds at most
+        VECTOR_EXACT_SCOPE_MAX_ROWS chunks skip the ANN index: the scope is
+        read through the (org_id, patient_id) btree and ranked exactly.
+
+        Only rows of the active embedding model are searched, through that
+        model's partial index, so re-embedding into another model does not
+        grow the index the query scans. A sample of ANN searches is re-checked
+        against exact KNN in the background (see vector/recall.py).
+        """
+        conds = [TextChunk.org_id == org_id, TextChunk.deleted_at.is_(None), model_filter()]
         if patient_id:
             conds.append(TextChunk.patient_id == patient_id)
         if source_type:
             conds.append(TextChunk.source_type == source_type)
+        n = max(top_k, candidates or settings.VECTOR_SEARCH_CANDIDATES)
+        # org_id equality prunes to one partition; use that partition's index plan
+        plan = await index_manager.plan_for_org(self.session, org_id)
+        storage = plan.storage if plan else "full"
 
         # vector distance (smaller is closer)
-        dist = TextChunk.embedding.l2_distance(query_vec).label("dist")
-
-        # FTS rank
-        tsvec = func.to_tsvector(literal("simple"), TextChunk.text)
-        tsq = func.plainto_tsquery(literal("simple"), query_text)
-        rank = func.ts_rank_cd(tsvec, tsq).label("rank")
-
-        # Hybrid score: sim from dist + weighted FTS rank
-        sim = (1.0 / (1.0 + dist)).label("sim")
-        score = (sim + (rank * 0.3)).label("score")
-
-        q = (
-            select(TextChunk, score)
-            .where(and_(*conds))
-            .order_by(desc(score))
-            .limit(top_k)
+        dist = TextChunk.embedding.l2_distance(query_vec)
+
+        # FTS; expression must match textchunk_fts_idx for the GIN index to apply
+        tsvec = func.to_tsvector(_FTS_CONFIG, TextChunk.text)
+        tsq = func.plainto_tsquery(_FTS_CONFIG, query_text)
+        rank = func.ts_rank_cd(tsvec, tsq)
+
+        # Stage 1: independent candidate lists
+        if patient_id and await self._scope_is_small(conds):
+            vec_ids, fts_ids = await self._exact_candidates(conds, dist, tsvec, tsq, rank, n)
+        else:
+            await self._apply_ann_settings(recall, compact_candidates(n, storage), plan)
+            started = time.perf_counter()
+            res = await self.session.execute(vector_candidates(conds, query_vec, n, storage))
+            vec_ids = list(res.scalars().all())
+            if recall_monitor.should_sample():
+                ann_ms = (time.perf_counter() - started) * 1000
+                partition = await index_manager.partition_for(self.session, org_id) or "textchunk"
+                recall_monitor.submit(_measure_recall(partition, plan, conds, query_vec, vec_ids, top_k=top_k, ann_ms=ann_ms))
+            res = await self.session.execute(
+                select(TextChunk.id).where(and_(*conds), tsvec.op("@@")(tsq)).order_by(desc(rank)).limit(n)
+            )
+            fts_ids = list(res.scalars().all())
+
+        ids = list(dict.fromkeys(vec_ids + fts_ids))
+        if not ids:
+            return []
+
+        # Stage 2: score only the union of candidates (primary key lookups)
+        res = await self.session.execute(
+            select(TextChunk, dist.label("dist"), rank.label("rank")).where(TextChunk.org_id == org_id, TextChunk.id.in_(ids))
         )
-        res = await self.session.execute(q)
-        rows = res.all()
-        return [(row[0], float(row[1])) for row in rows]
\ No newline at end of file
+        rows = {row[0].id: (row[0], float(row[1]), float(row[2])) for row in res.all()}
+
+        if (fusion or settings.VECTOR_SEARCH_FUSION) == "rrf":
+            scores = _rrf_scores([vec_ids, fts_ids])
+        else:
+            scores = {cid: _weighted_score(d, r) for cid, (_, d, r) in rows.items()}
+        ranked = sorted(rows, key=lambda cid: scores.get(cid, 0.0), reverse=True)
+        if settings.VECTOR_DEDUP_ENABLED:
+            ranked = _collapse_near_duplicates([rows[cid][0] for cid in ranked], top_k)
+        return [(rows[cid][0], scores.get(cid, 0.0)) for cid in ranked[:top_k]]
+
+
+    async def _scope_is_small(self, conds: list) -> bool:
+        # bounded count: stops after VECTOR_EXACT_SCOPE_MAX_ROWS + 1 index entries
+        limit = settings.VECTOR_EXACT_SCOPE_MAX_ROWS
+        if limit <= 0:
+            return False
+        scope = select(TextChunk.id).where(and_(*conds)).limit(limit + 1).subquery()
+        count = (await self.session.execute(select(func.count()).select_from(scope))).scalar() or 0
+        return count <= limit
+
+    async def _exact_candidates(self, conds: list, dist, tsvec, tsq, rank, n: int) -> tuple[list[uuid.UUID], list[uuid.UUID]]:
+        """
+        Exact top-n by distance and by FTS rank over a small scope. Scores come
+        back unsorted and are ranked here, so the planner has no ORDER BY
+        distance to hand to the ANN index and reads the scope via the btree.
+        """
+        res = await self.session.execute(
+            select(TextChunk.id, dist.label("dist"), tsvec.op("@@")(tsq).label("match"), rank.label("rank")).where(and_(*conds))
+        )
+        scored = res.all()
+        vec_ids = [r.id for r in sorted(scored, key=lambda r: r.dist)[:n]]
+        fts_ids = [r.id for r in sorted((r for r in scored if r.match), key=lambda r: r.rank, reverse=True)[:n]]
+        return vec_ids, fts_ids
+
+    async def _apply_ann_settings(self, recall: str | None, n: int, plan) -> None:
+        for name, value in index_manager.search_settings(recall, plan).items():
+            if name == "hnsw.ef_search":
+                value = max(value, n)  # HNSW returns at most ef_search rows
+            # transaction-local, like SET LOCAL
+            await self.session.execute(select(func.set_config(name, str(value), True)))
+
+    # ---- storage footprint / tradeoffs ----
+    async def storage_report(self) -> dict:
+        """Heap and vector index footprint per partition, against shared_buffers, plus per-mode vector sizes."""
+        dim = settings.EMBEDDINGS_DIM
+        shared_buffers = (await self.session.execute(text("SELECT pg_size_bytes(current_setting('shared_buffers'))"))).scalar()
+        avg_vector_bytes = (await self.session.execute(text(
+            "SELECT avg(pg_column_size(embedding))::int FROM (SELECT embedding FROM textchunk LIMIT 1000) s"
+        ))).scalar()
+        res = await self.session.execute(text("""
+            SELECT c.relname, GREATEST(c.reltuples, 0)::bigint, pg_table_size(c.oid), i.relname, pg_relation_size(i.oid)
+            FROM pg_partition_tree('textchunk'::regclass) t
+            JOIN pg_class c ON c.oid = t.relid
+            LEFT JOIN pg_index x ON x.indrelid = c.oid
+                AND x.indexrelid IN (SELECT ic.oid FROM pg_class ic JOIN pg_am am ON am.oid = ic.relam WHERE am.amname IN ('ivfflat', 'hnsw'))
+            LEFT JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE t.isleaf
+            ORDER BY c.relname
+        """))
+        partitions: dict[str, dict] = {}
+        for name, rows, heap, idx, idx_bytes in res.all():
+            part = partitions.setdefault(name, {"partition": name, "rows": rows, "heap_bytes": heap, "indexes": []})
+            if idx:
+                part["indexes"].append({"name": idx, "bytes": idx_bytes})
+        for name, part in partitions.items():
+            plan = index_manager.current_plan(name)
+            part["plan"] = asdict(plan) if plan else None
+        index_bytes = sum(i["bytes"] for p in partitions.values() for i in p["indexes"])
+        largest = max((i["bytes"] for p in partitions.values() for i in p["indexes"]), default=0)
+        return {
+            "rows": sum(p["rows"] for p in partitions.values()),
+            "heap_bytes": sum(p["heap_bytes"] for p in partitions.values()),
+            "vector_index_bytes": index_bytes,
+            "largest_vector_index_bytes": largest,
+            "shared_buffers_bytes": shared_buffers,
+            "largest_index_fits_shared_buffers": largest <= (shared_buffers or 0),
+            "avg_embedding_bytes": avg_vector_bytes,
+            "configured_storage_mode": settings.VECTOR_STORAGE_MODE,
+            "partitions": list(partitions.values()),
+            # varlena header + payload per indexed vector
+            "vector_bytes_by_mode": {"full": 8 + 4 * dim, "halfvec": 8 + 2 * dim, "binary": 8 + math.ceil(dim / 8)},
+        }
+
+    async def evaluate_storage(self, org_id: uuid.UUID, *, samples: int = 20, top_k: int = 10, recall: str | None = None) -> list[dict]:
+        """
+        Recall@k and latency of the vector stage per storage mode, using random
+        live chunks of the org as queries and exact (seq scan) KNN as truth.
+        Only the mode matching the current index is index-backed; the others
+        are reported with indexed=False.
+        """
+        res = await self.session.execute(
+            select(TextChunk.id, TextChunk.embedding)
+            .where(TextChunk.org_id == org_id, TextChunk.deleted_at.is_(None), model_filter())
+            .order_by(func.random()).limit(samples)
+        )
+        queries = res.all()
+        plan = await index_manager.plan_for_org(self.session, org_id)
+        current = plan.storage if plan else None
+        truth = []
+        await self._set_local({"enable_indexscan": "off", "enable_bitmapscan": "off"})
+        for qid, vec in queries:
+            conds = _eval_conds(org_id, qid)
+            truth.append(set((await self.session.execute(vector_candidates(conds, vec, top_k, "full"))).scalars().all()))
+        await self._set_local({"enable_indexscan": "on", "enable_bitmapscan": "on"})
+
+        report = []
+        for storage in ("full", "halfvec", "binary"):
+            await self._apply_ann_settings(recall, compact_candidates(top_k, storage), plan)
+            latencies, recalls = [], []
+            for (qid, vec), expected in zip(queries, truth):
+                started = time.perf_counter()
+                found = (await self.session.execute(vector_candidates(_eval_conds(org_id, qid), vec, top_k, storage))).scalars().all()
+                latencies.append((time.perf_counter() - started) * 1000)
+                recalls.append(len(expected & set(found)) / max(len(expected), 1))
+            report.append({
+                "storage": storage,
+                "indexed": storage == current,
+                "candidates": compact_candidates(top_k, storage),
+                "recall_at_k": round(float(np.mean(recalls)), 4) if recalls else None,
+                "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3) if latencies else None,
+                "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3) if latencies else None,
+            })
+        return report
+
+    async def _set_local(self, gucs: dict[str, str]) -> None:
+        for name, value in gucs.items():
+            await self.session.execute(select(func.set_config(name, value, True)))
+
+
+def model_filter(model: str | None = None):
+    """
+    embedding_model = <model> (default: the one searches use, normally the
+    active one) as an inlined literal; a bind parameter would keep the planner
+    from matching the partial vector index. Model ids are validated in settings.
+    """
+    return TextChunk.embedding_model == literal_column(f"'{model or registry.search_model()}'")
+
+def compact_candidates(n: int, storage: str) -> int:
+    # rows pulled from a compact index before re-ranking on the full vectors
+    if storage == "full":
+        return n
+    return max(n, math.ceil(n * settings.VECTOR_STORAGE_RERANK_FACTOR))
+
+def vector_candidates(conds: list, query_vec, n: int, storage: str = "full"):
+    """
+    Ids of the n nearest chunks by L2. For halfvec / binary storage the ORDER BY
+    uses the indexed compact expression (halfvec L2 / Hamming over the
+    binary-quantized vector) to pick n * VECTOR_STORAGE_RERANK_FACTOR
+    candidates, which are then re-ranked by exact distance on `embedding`.
+    """
+    if storage == "full":
+        return select(TextChunk.id).where(and_(*conds)).order_by(TextChunk.embedding.l2_distance(query_vec)).limit(n)
+    dim = settings.EMBEDDINGS_DIM
+    q = literal(query_vec, TextChunk.embedding.type)
+    if storage == "halfvec":
+        compact = cast(TextChunk.embedding, HALFVEC(dim)).op("<->", return_type=Float)(cast(q, HALFVEC(dim)))
+    else:
+        compact = cast(func.binary_quantize(TextChunk.embedding), BIT(dim)).op("<~>", return_type=Float)(
+            cast(func.binary_quantize(q), BIT(dim))
+        )
+    pool = (
+        select(TextChunk.id, TextChunk.embedding).where(and_(*conds))
+        .order_by(compact).limit(compact_candidates(n, storage)).subquery()
+    )
+    return select(pool.c.id).order_by(pool.c.embedding.l2_distance(query_vec)).limit(n)
+
+async def _measure_recall(partition: str, plan, conds: list, query_vec, ann_ids: list, *, top_k: int, ann_ms: float) -> None:
+    # exact KNN over the same scope, on its own connection, after the request
+    async with SessionLocal() as session:
+        await VectorRepository(session)._set_local({
+            "enable_indexscan": "off",
+            "enable_bitmapscan": "off",
+            "statement_timeout": str(settings.VECTOR_RECALL_TIMEOUT_MS),
+        })
+        started = time.perf_counter()
+        res = await session.execute(vector_candidates(conds, query_vec, len(ann_ids) or top_k, "full"))
+        exact_ids = list(res.scalars().all())
+        exact_ms = (time.perf_counter() - started) * 1000
+    recall_monitor.record(partition, plan, top_k=top_k, ann_ids=ann_ids, exact_ids=exact_ids, ann_ms=ann_ms, exact_ms=exact_ms)
+
+def _eval_conds(org_id: uuid.UUID, exclude_id: uuid.UUID) -> list:
+    # the sampled chunk itself would be every mode's trivial first hit
+    return [TextChunk.org_id == org_id, TextChunk.deleted_at.is_(None), model_filter(), TextChunk.id != exclude_id]
+
+def _collapse_near_duplicates(chunks: list[TextChunk], top_k: int) -> list[uuid.UUID]:
+    # keep the best-ranked chunk of each near-duplicate group (same patient only,
+    # so consent filtering sees the same outcome for the survivor; same numbers
+    # and negations, so an updated dose is never hidden behind the old one)
+    k = settings.VECTOR_DEDUP_MAX_HAMMING
+    kept: list[TextChunk] = []
+    for c in chunks:
+        if c.simhash is not None and any(
+            o.simhash is not None and o.patient_id == c.patient_id and hamming(c.simhash, o.simhash) <= k
+            and same_facts(c.text, o.text)
+            for o in kept
+        ):
+            continue
+        kept.append(c)
+        if len(kept) >= top_k:
+            break
+    return [c.id for c in kept]
+
+def _normalized(text: str) -> str:
+    return " ".join((text or "").lower().split())
+
+def _with_defaults(row: dict) -> dict:
+    # COPY bypasses ORM-side defaults for the primary key, version counter and model
+    row = dict(row)
+    row.setdefault("id", uuid.uuid4())
+    row.setdefault("version", 1)
+    row.setdefault("embedding_model", settings.EMBEDDINGS_MODEL)
+    return row
+
+def _weighted_score(dist: float, rank: float) -> float:
+    # Hybrid score: sim from dist + weighted FTS rank
+    return 1.0 / (1.0 + dist) + rank * 0.3
+
+def _rrf_scores(ranked_lists: list[list[uuid.UUID]], k: int = 60) -> dict[uuid.UUID, float]:
+    # Reciprocal-rank fusion: sum of 1 / (k + rank) over the lists an id appears in
+    scores: dict[uuid.UUID, float] = {}
+    for ids in ranked_lists:
+        for pos, cid in enumerate(ids, start=1):
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + pos)
+    return scores
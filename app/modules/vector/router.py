@@ -1,8 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import shutil
+import tempfile
+from dataclasses import asdict
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.db import SessionLocal
 from app.core.security import get_principal, Principal, require_scopes
+from app.platform.provider_registry import registry
+from app.platform.adapters.embeddings_batch import MicroBatchingEmbeddings
 from app.modules.vector.service import VectorService
+from app.modules.vector.indexer import auto_indexer
+from app.modules.vector.setup import index_manager
+from app.modules.vector.reembed import migration_status
+from app.modules.vector.recall import recall_monitor
+from app.modules.vector import bulk
 from app.modules.vector.schemas import (
     IngestTranscriptsByConversation, IngestMessageTranscript, IngestTicketNotes, IngestKnowledge,
     SearchQuery, ChunkOut
@@ -21,9 +32,14 @@ def svc(session: AsyncSession = Depends(get_session)) -> VectorService:
 @router.post("/search/ingest/conversation")
 async def ingest_conversation(
     payload: IngestTranscriptsByConversation,
+    defer: bool = Query(False, description="Queue for the background auto-indexer instead of embedding inline"),
     principal: Principal = Depends(get_principal),
     service: VectorService = Depends(svc),
 ):
+    if defer:
+        await auto_indexer.enqueue_conversation(service.session, principal.org_id, payload.conversation_id)
+        await service.session.commit()
+        return {"queued": True}
     return await service.ingest_conversation(principal.org_id, payload)
 
 @router.post("/search/ingest/message")
@@ -37,9 +53,14 @@ async def ingest_message(
 @router.post("/search/ingest/ticket")
 async def ingest_ticket_notes(
     payload: IngestTicketNotes,
+    defer: bool = Query(False, description="Queue for the background auto-indexer instead of embedding inline"),
     principal: Principal = Depends(get_principal),
     service: VectorService = Depends(svc),
 ):
+    if defer:
+        await auto_indexer.enqueue_ticket(service.session, principal.org_id, payload.ticket_id)
+        await service.session.commit()
+        return {"queued": True}
     return await service.ingest_ticket(principal.org_id, payload)
 
 @router.post("/search/ingest/knowledge")
@@ -50,6 +71,36 @@ async def ingest_knowledge(
 ):
     return await service.ingest_knowledge(principal.org_id, payload)
 
+_BULK_SUFFIXES = (".ndjson", ".jsonl", ".zip", ".tar", ".tar.gz", ".tgz")
+
+def _spool_upload(src) -> str:
+    # blocking; run in a thread
+    with tempfile.NamedTemporaryFile(prefix="kb-bulk-", delete=False) as tmp:
+        shutil.copyfileobj(src, tmp, 1 << 20)
+    return tmp.name
+
+@router.post("/search/ingest/knowledge/bulk", status_code=status.HTTP_202_ACCEPTED)
+async def ingest_knowledge_bulk(
+    file: UploadFile = File(..., description="NDJSON ({title, text, patient_id?} per line) or a zip/tar of text files"),
+    chunk_chars: int = Query(800, ge=200, le=4000),
+    overlap: int = Query(120, ge=0, le=1000),
+    principal: Principal = Depends(get_principal),
+):
+    filename = file.filename or "upload.ndjson"
+    if not filename.lower().endswith(_BULK_SUFFIXES):
+        raise HTTPException(status_code=400, detail="Unsupported format; expected .ndjson/.jsonl, .zip or .tar[.gz]")
+    # copy out of the request's spool (the job outlives the request), off the event loop
+    path = await asyncio.to_thread(_spool_upload, file.file)
+    job = await bulk.start_job(principal.org_id, path, filename, chunk_chars=chunk_chars, overlap=overlap)
+    return job.as_dict()
+
+@router.get("/search/ingest/jobs/{job_id}")
+async def ingest_job_status(job_id: str, principal: Principal = Depends(get_principal)):
+    job = bulk.get_job(job_id)
+    if job is None or job.org_id != principal.org_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.as_dict()
+
 # ---- Search ----
 @router.post("/search", response_model=list[ChunkOut], dependencies=[Depends(require_scopes("search:read"))])
 async def search(
@@ -57,4 +108,58 @@ async def search(
     principal: Principal = Depends(get_principal),
     service: VectorService = Depends(svc),
 ):
-    return await service.search(principal.org_id, payload)
\ No newline at end of file
+    return await service.search(principal.org_id, payload)
+
+# ---- Admin ----
+@router.get("/search/admin/embeddings-cache", dependencies=[Depends(require_scopes("admin:read"))])
+async def embeddings_cache_stats():
+    emb = registry.embeddings()
+    stats = getattr(emb, "stats", None)
+    out = stats() if stats else {"enabled": False}
+    inner = getattr(emb, "inner", None)
+    if isinstance(inner, MicroBatchingEmbeddings):
+        out["batching"] = inner.stats()
+    return out
+
+@router.get("/search/admin/storage", dependencies=[Depends(require_scopes("admin:read"))])
+async def vector_storage_report(service: VectorService = Depends(svc)):
+    return await service.repo.storage_report()
+
+@router.get("/search/admin/storage/evaluate", dependencies=[Depends(require_scopes("admin:read"))])
+async def vector_storage_evaluate(
+    samples: int = Query(20, ge=1, le=200),
+    top_k: int = Query(10, ge=1, le=100),
+    recall: str | None = Query(None, pattern="^(fast|balanced|high)$"),
+    principal: Principal = Depends(get_principal),
+    service: VectorService = Depends(svc),
+):
+    return await service.repo.evaluate_storage(principal.org_id, samples=samples, top_k=top_k, recall=recall)
+
+@router.get("/search/admin/recall", dependencies=[Depends(require_scopes("admin:read"))])
+async def vector_recall_report():
+    """Rolling recall@k of sampled live searches against exact KNN, per partition (this process)."""
+    return recall_monitor.report()
+
+@router.get("/search/admin/partitions", dependencies=[Depends(require_scopes("admin:read"))])
+async def vector_partitions():
+    return [
+        {
+            **asdict(p),
+            "index_plan": asdict(plan) if (plan := index_manager.current_plan(p.name)) else None,
+            "index_plans": [asdict(pl) for (name, _), pl in index_manager.plans.items() if name == p.name],
+        }
+        for p in index_manager.partitions.values()
+    ]
+
+@router.post("/search/admin/partitions/promote", dependencies=[Depends(require_scopes("admin:write"))])
+async def promote_vector_partition(principal: Principal = Depends(get_principal)):
+    """Move the caller's org into a dedicated textchunk partition with its own vector index."""
+    return {"partition": await index_manager.promote(principal.org_id)}
+
+@router.get("/search/admin/embedding-migration", dependencies=[Depends(require_scopes("admin:read"))])
+async def embedding_migration_status():
+    return await migration_status()
+
+@router.get("/search/admin/auto-indexer", dependencies=[Depends(require_scopes("admin:read"))])
+async def auto_indexer_stats():
+    return {**auto_indexer.stats, "pending": await auto_indexer.pending()}
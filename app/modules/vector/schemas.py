@@ -28,6 +28,7 @@ class SearchQuery(BaseModel):
     top_k: int = Field(default=10, ge=1, le=50)
     patient_id: uuid.UUID | None = None
     source_type: str | None = Field(default=None, pattern="^(transcript|ticket_note|knowledge)$")
+    recall: str | None = Field(default=None, pattern="^(fast|balanced|high)$")  # ANN speed/recall tradeoff
 
 class ChunkOut(BaseModel):
     id: uuid.UUID
@@ -1,10 +1,17 @@
 import uuid
+import hashlib
 from dataclasses import asdict, dataclass
+from typing import Iterable
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from app.core.config import settings
 from app.platform.provider_registry import registry
 from app.modules.vector.repository import VectorRepository
 from app.modules.vector.models import TextChunk
+from app.modules.vector.cache import search_cache
+from app.modules.vector.reembed import refresh_migration_state
+from app.modules.vector.chunking import batched, iter_chunks, iter_pieces
+from app.modules.vector.simhash import signature
 from app.modules.vector.schemas import (
     IngestTranscriptsByConversation, IngestMessageTranscript, IngestTicketNotes, IngestKnowledge, SearchQuery
 )
@@ -13,11 +20,50 @@ from app.modules.conversations.models import Conversation, Message
 from app.modules.tickets.models import TicketNote
 from app.modules.consent.service import ConsentService
 
+# Search over-fetch: start at top_k * factor candidates, double up to the cap
+_SEARCH_OVERFETCH = 2
+_SEARCH_MAX_CANDIDATES = 400
+# Knowledge chunks embedded + written per round trip
+_KNOWLEDGE_BATCH = 256
+
 @dataclass
-class ChunkSpec:
+class SourcePart:
+    """One independently indexed record of a source (a transcript, a ticket note)."""
+    part_id: str
     text: str
     locator: dict
 
+@dataclass
+class SyncPlan:
+    """Pending chunk rows (not yet embedded) plus bookkeeping for one source."""
+    org_id: uuid.UUID
+    rows: list[dict]
+    unchanged: int
+    removed: int
+
+def _content_hash(text: str, chunk_chars: int, overlap: int) -> str:
+    # chunking params are part of the hash so re-chunking forces a re-index
+    return hashlib.sha256(f"{chunk_chars}:{overlap}:{text or ''}".encode("utf-8")).hexdigest()
+
+async def embed_rows(rows: list[dict], active_vectors=None) -> list[dict]:
+    """
+    Embedded copies of pending chunk rows, one per model in
+    registry.write_models(): during a model migration new chunks are written
+    for both the active model and the target. `active_vectors`, when given,
+    are the active model's embeddings already computed for the rows.
+    """
+    if not rows:
+        return []
+    await refresh_migration_state()
+    out = []
+    for model in registry.write_models():
+        if model == settings.EMBEDDINGS_MODEL and active_vectors is not None:
+            vectors = active_vectors
+        else:
+            vectors = await registry.embeddings_for(model).embed([r["text"] for r in rows])
+        out.extend({**r, "embedding": vectors[i], "embedding_model": model} for i, r in enumerate(rows))
+    return out
+
 class VectorService:
     def __init__(self, session: AsyncSession):
         self.session = session
@@ -26,18 +72,111 @@ class VectorService:
 
     # ---------- Chunking ----------
     def _chunk_text(self, text: str, chunk_chars: int, overlap: int) -> list[str]:
-        text = text or ""
-        if len(text) <= chunk_chars:
-            return [text]
-        chunks: list[str] = []
-        i = 0
-        while i < len(text):
-            chunk = text[i:i + chunk_chars]
-            chunks.append(chunk)
-            if i + chunk_chars >= len(text):
-                break
-            i += max(1, (chunk_chars - overlap))
-        return chunks
+        return list(iter_chunks([text or ""], chunk_chars, overlap))
+
+    async def plan_parts(self, org_id: uuid.UUID, source_type: str, source_id: str, patient_id: uuid.UUID | None, parts: list[SourcePart], chunk_chars: int, overlap: int, *, prune: bool) -> SyncPlan:
+        """
+        Work out an incremental (re)index of the given parts of a source. Parts
+        whose text and chunking params are unchanged are left alone; new or
+        changed parts are chunked into pending rows. With prune=True, parts no
+        longer present have their chunks removed, and so do chunks written
+        before part tracking existed (they cannot be matched to a part, so
+        `parts` must then be the whole source). With prune=False those legacy
+        chunks are left alone. Deletes are issued in the session; nothing is
+        embedded or committed until write_plans.
+        """
+        indexed = await self.repo.part_hashes(org_id, source_type, source_id)
+        stale: list[str | None] = [None] if prune and None in indexed else []
+        fresh: list[tuple[SourcePart, str]] = []
+        for p in parts:
+            h = _content_hash(p.text, chunk_chars, overlap)
+            if indexed.get(p.part_id) == h:
+                continue
+            if p.part_id in indexed:
+                stale.append(p.part_id)
+            fresh.append((p, h))
+        if prune:
+            present = {p.part_id for p in parts}
+            stale.extend(pid for pid in indexed if pid is not None and pid not in present)
+
+        removed = await self.repo.delete_by_parts(org_id, source_type, source_id, stale)
+
+        rows = []
+        for p, h in fresh:
+            for idx, ch in enumerate(self._chunk_text(p.text, chunk_chars, overlap)):
+                rows.append({
+                    "org_id": org_id,
+                    "source_type": source_type,
+                    "source_id": source_id,
+                    "part_id": p.part_id,
+                    "content_hash": h,
+                    "patient_id": patient_id,
+                    "locator": p.locator,
+                    "text": ch,
+                    "chunk_index": idx,
+                    **signature(ch),
+                })
+        return SyncPlan(org_id=org_id, rows=rows, unchanged=len(parts) - len(fresh), removed=removed)
+
+    async def write_plans(self, plans: list[SyncPlan]) -> list[dict]:
+        """
+        Drop exact duplicates of live chunks (before paying for their embeddings),
+        embed the remaining rows of all plans in one batch per model, bulk-insert
+        them and commit.
+        """
+        rows = [r for plan in plans for r in plan.rows]
+        keep = await self.repo.duplicate_mask(rows)
+        kept = [r for r, k in zip(rows, keep) if k]
+        if kept:
+            await self.repo.bulk_insert_chunks(await embed_rows(kept))
+        await self.session.commit()
+        for org_id in {plan.org_id for plan in plans if plan.rows or plan.removed}:
+            await search_cache.bump(org_id)
+        summaries, pos = [], 0
+        for plan in plans:
+            written = sum(keep[pos:pos + len(plan.rows)])
+            pos += len(plan.rows)
+            summaries.append({"indexed": written, "duplicates": len(plan.rows) - written, "unchanged": plan.unchanged, "removed": plan.removed})
+        return summaries
+
+    async def sync_parts(self, org_id: uuid.UUID, source_type: str, source_id: str, patient_id: uuid.UUID | None, parts: list[SourcePart], chunk_chars: int, overlap: int, *, prune: bool) -> dict:
+        plan = await self.plan_parts(org_id, source_type, source_id, patient_id, parts, chunk_chars, overlap, prune=prune)
+        return (await self.write_plans([plan]))[0]
+
+    # ---------- Source loading ----------
+    async def conversation_parts(self, org_id: uuid.UUID, conversation_ids: set[uuid.UUID]) -> dict[uuid.UUID, list[SourcePart]]:
+        # transcripts of the given conversations, one part per transcript
+        tx = await self.session.execute(
+            select(Transcript, Message.id.label("message_id"), Message.conversation_id)
+            .join(Message, Transcript.message_id == Message.id)
+            .where(
+                Transcript.org_id == org_id,
+                Transcript.deleted_at.is_(None),
+                Message.conversation_id.in_(conversation_ids),
+            )
+        )
+        out: dict[uuid.UUID, list[SourcePart]] = {cid: [] for cid in conversation_ids}
+        for t, message_id, conversation_id in tx.all():
+            out[conversation_id].append(SourcePart(part_id=str(t.id), text=t.text, locator={
+                "conversation_id": str(conversation_id),
+                "message_id": str(message_id),
+                "transcript_id": str(t.id)
+            }))
+        return out
+
+    async def ticket_parts(self, org_id: uuid.UUID, ticket_ids: set[uuid.UUID]) -> dict[uuid.UUID, list[SourcePart]]:
+        # notes of the given tickets, one part per note
+        res = await self.session.execute(
+            select(TicketNote).where(
+                TicketNote.org_id == org_id,
+                TicketNote.deleted_at.is_(None),
+                TicketNote.ticket_id.in_(ticket_ids)
+            ).order_by(TicketNote.created_at.asc())
+        )
+        out: dict[uuid.UUID, list[SourcePart]] = {tid: [] for tid in ticket_ids}
+        for n in res.scalars().all():
+            out[n.ticket_id].append(SourcePart(part_id=str(n.id), text=n.body, locator={"ticket_id": str(n.ticket_id), "note_id": str(n.id)}))
+        return out
 
     # ---------- Ingest sources ----------
     async def ingest_conversation(self, org_id: uuid.UUID, payload: IngestTranscriptsByConversation) -> dict:
@@ -55,46 +194,9 @@ class VectorService:
             if not allowed:
                 return {"indexed": 0, "skipped": "consent_required"}
 
-        tx = await self.session.execute(
-            select(Transcript, Message.id.label("message_id"))
-            .join(Message, Transcript.message_id == Message.id, isouter=True)
-            .where(
-                Transcript.org_id == org_id,
-                Transcript.deleted_at.is_(None),
-                (Transcript.message_id == Message.id) & (Message.conversation_id == payload.conversation_id)
-            )
-        )
-        rows = tx.all()
-        specs: list[ChunkSpec] = []
-        for t, message_id in rows:
-            for idx, ch in enumerate(self._chunk_text(t.text, payload.chunk_chars, payload.overlap)):
-                specs.append(ChunkSpec(text=ch, locator={
-                    "conversation_id": str(payload.conversation_id),
-                    "message_id": str(message_id) if message_id else None,
-                    "transcript_id": str(t.id)
-                }))
-
-        # delete previous chunks for this source
-        await self.repo.delete_by_source(org_id, "transcript", str(payload.conversation_id))
-
-        if not specs:
-            return {"indexed": 0}
-        vectors = await self.embedder.embed([s.text for s in specs])
-        objs = []
-        for i, s in enumerate(specs):
-            objs.append(TextChunk(
-                org_id=org_id,
-                source_type="transcript",
-                source_id=str(payload.conversation_id),
-                patient_id=conv.patient_id,
-                locator=s.locator,
-                text=s.text,
-                chunk_index=i,
-                embedding=vectors[i],
-            ))
-        await self.repo.insert_chunks(objs)
-        await self.session.commit()
-        return {"indexed": len(objs)}
+        parts = (await self.conversation_parts(org_id, {payload.conversation_id}))[payload.conversation_id]
+        # transcripts deleted since the last run lose their chunks
+        return await self.sync_parts(org_id, "transcript", str(payload.conversation_id), conv.patient_id, parts, payload.chunk_chars, payload.overlap, prune=True)
 
     async def ingest_message(self, org_id: uuid.UUID, payload: IngestMessageTranscript) -> dict:
         # load transcript by message
@@ -120,114 +222,107 @@ class VectorService:
             if not allowed:
                 return {"indexed": 0, "skipped": "consent_required"}
 
-        specs = [ChunkSpec(text=ch, locator={
-            "conversation_id": str(msg.conversation_id),
+        source_id = str(msg.conversation_id)
+        if None in await self.repo.part_hashes(org_id, "transcript", source_id):
+            # indexed before part tracking: the legacy chunks cover the whole
+            # conversation, so replace them by re-planning every transcript
+            parts = (await self.conversation_parts(org_id, {msg.conversation_id}))[msg.conversation_id]
+            return await self.sync_parts(org_id, "transcript", source_id, patient_id, parts, payload.chunk_chars, payload.overlap, prune=True)
+
+        part = SourcePart(part_id=str(t.id), text=t.text, locator={
+            "conversation_id": source_id,
             "message_id": str(msg.id),
             "transcript_id": str(t.id),
-        }) for ch in self._chunk_text(t.text, payload.chunk_chars, payload.overlap)]
-
-        await self.repo.delete_by_source(org_id, "transcript", str(msg.conversation_id))
-        if not specs:
-            return {"indexed": 0}
-        vectors = await self.embedder.embed([s.text for s in specs])
-        objs = []
-        for i, s in enumerate(specs):
-            objs.append(TextChunk(
-                org_id=org_id,
-                source_type="transcript",
-                source_id=str(msg.conversation_id),
-                patient_id=patient_id,
-                locator=s.locator,
-                text=s.text,
-                chunk_index=i,
-                embedding=vectors[i],
-            ))
-        await self.repo.insert_chunks(objs)
-        await self.session.commit()
-        return {"indexed": len(objs)}
+        })
+        # only this transcript's chunks are touched; the rest of the conversation stays indexed
+        return await self.sync_parts(org_id, "transcript", source_id, patient_id, [part], payload.chunk_chars, payload.overlap, prune=False)
 
     async def ingest_ticket(self, org_id: uuid.UUID, payload: IngestTicketNotes) -> dict:
-        # gather notes for ticket
-        res = await self.session.execute(
-            select(TicketNote).where(
-                TicketNote.org_id == org_id,
-                TicketNote.deleted_at.is_(None),
-                TicketNote.ticket_id == payload.ticket_id
-            ).order_by(TicketNote.created_at.asc())
-        )
-        notes = res.scalars().all()
-        if not notes:
+        parts = (await self.ticket_parts(org_id, {payload.ticket_id}))[payload.ticket_id]
+        if not parts:
             return {"indexed": 0}
-        # delete previous chunks for this ticket
-        await self.repo.delete_by_source(org_id, "ticket_note", str(payload.ticket_id))
-
-        specs: list[ChunkSpec] = []
-        for n in notes:
-            for idx, ch in enumerate(self._chunk_text(n.body, payload.chunk_chars, payload.overlap)):
-                specs.append(ChunkSpec(text=ch, locator={"ticket_id": str(payload.ticket_id), "note_id": str(n.id)}))
-
-        vectors = await self.embedder.embed([s.text for s in specs])
-        objs = []
-        for i, s in enumerate(specs):
-            objs.append(TextChunk(
-                org_id=org_id,
-                source_type="ticket_note",
-                source_id=str(payload.ticket_id),
-                patient_id=None,
-                locator=s.locator,
-                text=s.text,
-                chunk_index=i,
-                embedding=vectors[i],
-            ))
-        await self.repo.insert_chunks(objs)
-        await self.session.commit()
-        return {"indexed": len(objs)}
+        return await self.sync_parts(org_id, "ticket_note", str(payload.ticket_id), None, parts, payload.chunk_chars, payload.overlap, prune=True)
 
     async def ingest_knowledge(self, org_id: uuid.UUID, payload: IngestKnowledge) -> dict:
-        # free text knowledge document; generate a synthetic source_id
-        import uuid as uuidlib
-        source_id = str(uuidlib.uuid4())
-        specs = [ChunkSpec(text=ch, locator={"title": payload.title}) for ch in self._chunk_text(payload.text, payload.chunk_chars, payload.overlap)]
-        vectors = await self.embedder.embed([s.text for s in specs])
-        objs = []
-        for i, s in enumerate(specs):
-            objs.append(TextChunk(
-                org_id=org_id,
-                source_type="knowledge",
-                source_id=source_id,
-                patient_id=payload.patient_id,
-                locator=s.locator,
-                text=s.text,
-                chunk_index=i,
-                embedding=vectors[i],
-            ))
-        await self.repo.insert_chunks(objs)
+        return await self.ingest_knowledge_stream(org_id, iter_pieces(payload.text), title=payload.title, patient_id=payload.patient_id, chunk_chars=payload.chunk_chars, overlap=payload.overlap)
+
+    async def ingest_knowledge_stream(self, org_id: uuid.UUID, pieces: Iterable[str], *, title: str | None, patient_id: uuid.UUID | None, chunk_chars: int, overlap: int) -> dict:
+        """
+        Free text knowledge document, consumed incrementally: chunks are embedded
+        and written in bounded batches, so memory stays flat however large the
+        document is. Duplicate chunks are skipped (VECTOR_DEDUP_INGEST). Committed once at the end.
+        """
+        # generate a synthetic source_id
+        source_id = str(uuid.uuid4())
+        position = written = 0
+        for batch in batched(iter_chunks(pieces, chunk_chars, overlap), _KNOWLEDGE_BATCH):
+            rows = [{
+                "org_id": org_id,
+                "source_type": "knowledge",
+                "source_id": source_id,
+                "patient_id": patient_id,
+                "locator": {"title": title},
+                "text": ch,
+                "chunk_index": position + i,
+                **signature(ch),
+            } for i, ch in enumerate(batch)]
+            position += len(rows)
+            rows = [r for r, k in zip(rows, await self.repo.duplicate_mask(rows)) if k]
+            if not rows:
+                continue
+            await self.repo.bulk_insert_chunks(await embed_rows(rows))
+            written += len(rows)
         await self.session.commit()
-        return {"indexed": len(objs), "source_id": source_id}
+        await search_cache.bump(org_id)
+        return {"indexed": written, "duplicates": position - written, "source_id": source_id}
 
     # ---------- Search ----------
     async def search(self, org_id: uuid.UUID, payload: SearchQuery):
-        vectors = await self.embedder.embed([payload.q])
-        hits = await self.repo.search_hybrid(org_id, vectors[0], payload.q, top_k=payload.top_k, patient_id=payload.patient_id, source_type=payload.source_type)
-
-        # Consent check at retrieval (if chunk tied to patient)
-        result = []
         consent = ConsentService(self.session)
-        for chunk, score in hits:
-            if chunk.patient_id:
-                allowed = await consent.is_allowed(org_id, chunk.patient_id, "data_processing")
-                if not allowed:
-                    continue
-            # package
-            result.append({
-                "id": str(chunk.id),
-                "org_id": str(chunk.org_id),
-                "source_type": chunk.source_type,
-                "source_id": chunk.source_id,
-                "patient_id": str(chunk.patient_id) if chunk.patient_id else None,
-                "locator": chunk.locator,
-                "text": chunk.text,
-                "chunk_index": chunk.chunk_index,
-                "score": round(score, 6),
-            })
-        return result
\ No newline at end of file
+        # the active model, or its migration source while it is still being backfilled
+        await refresh_migration_state()
+        model = registry.search_model()
+        cache_key = search_cache.key(payload.q, payload.top_k, payload.patient_id, payload.source_type, payload.recall, model)
+        generation, cached = await search_cache.get(org_id, cache_key)
+        if cached is not None:
+            # cached candidates are pre-consent; filter on every read
+            patients = {uuid.UUID(h["patient_id"]) for h in cached if h["patient_id"]}
+            allowed = await consent.allowed_patients(org_id, patients, "data_processing")
+            return [h for h in cached if not h["patient_id"] or uuid.UUID(h["patient_id"]) in allowed][:payload.top_k]
+
+        vectors = await registry.embeddings_for(model).embed([payload.q])
+
+        # Consent check at retrieval (if chunk tied to patient), resolved in one
+        # query per round. Over-fetch so filtering still leaves top_k results,
+        # widening the candidate window only when it does not.
+        limit = payload.top_k * _SEARCH_OVERFETCH
+        allowed: set[uuid.UUID] = set()
+        checked: set[uuid.UUID] = set()
+        while True:
+            hits = await self.repo.search_hybrid(org_id, vectors[0], payload.q, top_k=limit, patient_id=payload.patient_id, source_type=payload.source_type, recall=payload.recall)
+            unchecked = {c.patient_id for c, _ in hits if c.patient_id and c.patient_id not in checked}
+            if unchecked:
+                allowed |= await consent.allowed_patients(org_id, unchecked, "data_processing")
+                checked |= unchecked
+            packaged = [self._package(c, score) for c, score in hits]
+            result = [h for (c, _), h in zip(hits, packaged) if not c.patient_id or c.patient_id in allowed]
+            if len(result) >= payload.top_k or len(hits) < limit or limit >= _SEARCH_MAX_CANDIDATES:
+                break
+            limit = min(limit * 2, _SEARCH_MAX_CANDIDATES)
+
+        await search_cache.set(org_id, cache_key, generation, packaged)
+        return result[:payload.top_k]
+
+    @staticmethod
+    def _package(chunk: TextChunk, score: float) -> dict:
+        return {
+            "id": str(chunk.id),
+            "org_id": str(chunk.org_id),
+            "source_type": chunk.source_type,
+            "source_id": chunk.source_id,
+            "patient_id": str(chunk.patient_id) if chunk.patient_id else None,
+            "locator": chunk.locator,
+            "text": chunk.text,
+            "chunk_index": chunk.chunk_index,
+            "score": round(score, 6),
+        }
@@ -1,15 +1,358 @@
+import asyncio
+import json
+import logging
+import math
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, replace
 from sqlalchemy import text
+from app.core.config import settings
 from app.core.db import engine
+from app.platform.provider_registry import registry
+from app.modules.vector.recall import recall_monitor
+from app.modules.vector.partitions import (
+    Partition, ensure_partitions, hash_bucket_for, large_tenants, list_partitions,
+    move_tenant, vector_index_name,
+)
+
+log = logging.getLogger("vector.index")
+
+# one rebuild per partition at a time, across processes
+_REBUILD_LOCK = "SELECT pg_try_advisory_lock(hashtext('textchunk_embedding_rebuild:' || :p))"
+_REBUILD_UNLOCK = "SELECT pg_advisory_unlock(hashtext('textchunk_embedding_rebuild:' || :p))"
+# partitions up to this size get their missing vector index inline at startup;
+# larger ones are built concurrently by the background manager
+_INLINE_BUILD_MAX_ROWS = 100_000
+_ORG_CACHE_SIZE = 10_000
+# a recall-triggered rebuild needs the partition to have grown this much since
+# its index was built (or the plan to change); otherwise it would rebuild the same index
+_RECALL_REBUILD_GROWTH = 1.1
+
+# recall knob -> multiplier on sqrt(lists) (ivfflat) / ef_search (hnsw)
+_PROBE_FACTORS = {"fast": 0.5, "balanced": 1.0, "high": 4.0}
+_EF_SEARCH = {"fast": 20, "balanced": 40, "high": 200}
+
+@dataclass
+class IndexPlan:
+    """Parameters of the vector index; persisted as the index's COMMENT."""
+    type: str  # ivfflat | hnsw
+    rows: int  # table size the index was built for
+    lists: int | None = None
+    m: int | None = None
+    ef_construction: int | None = None
+    storage: str = "full"  # full | halfvec | binary
+    model: str | None = None  # embedding model the index is restricted to; None = all rows
+
+    def ddl(self, name: str, *, table: str = "textchunk", concurrently: bool = False) -> str:
+        conc = "CONCURRENTLY " if concurrently else ""
+        if self.type == "hnsw":
+            opts = f"m = {self.m}, ef_construction = {self.ef_construction}"
+        else:
+            opts = f"lists = {self.lists}"
+        where = f" WHERE embedding_model = '{self.model}'" if self.model else ""
+        return f"CREATE INDEX {conc}IF NOT EXISTS {name} ON {table} USING {self.type} ({index_expression(self.storage)}) WITH ({opts}){where}"
+
+def index_expression(storage: str) -> str:
+    """
+    Indexed expression + opclass per storage mode. halfvec / binary index a
+    compact copy computed from `embedding` (2 bytes / 1 bit per dimension);
+    the float32 column stays the source of truth for re-ranking.
+    """
+    dim = settings.EMBEDDINGS_DIM
+    if storage == "halfvec":
+        return f"(embedding::halfvec({dim})) halfvec_l2_ops"
+    if storage == "binary":
+        return f"(binary_quantize(embedding)::bit({dim})) bit_hamming_ops"
+    return "embedding vector_l2_ops"
+
+def plan_for(rows: int, kind: str | None = None, model: str | None = None) -> IndexPlan:
+    """
+    pgvector's sizing guidance: ivfflat lists = rows/1000 up to 1M rows and
+    sqrt(rows) beyond; HNSW (better recall/latency, slower builds) once the
+    corpus passes VECTOR_INDEX_HNSW_MIN_ROWS when the type is "auto".
+    `kind` overrides VECTOR_INDEX_TYPE; `model` makes it a partial index over
+    that embedding model's rows.
+    """
+    rows = max(0, int(rows))
+    kind = kind or settings.VECTOR_INDEX_TYPE
+    if kind == "auto":
+        kind = "hnsw" if rows >= settings.VECTOR_INDEX_HNSW_MIN_ROWS else "ivfflat"
+    storage = settings.VECTOR_STORAGE_MODE
+    if kind == "hnsw":
+        return IndexPlan(type="hnsw", rows=rows, m=16, ef_construction=64 if rows < 5_000_000 else 128, storage=storage, model=model)
+    lists = rows // 1000 if rows <= 1_000_000 else int(math.sqrt(rows))
+    return IndexPlan(type="ivfflat", rows=rows, lists=min(max(lists, 10), 32768), storage=storage, model=model)
+
+class VectorIndexManager:
+    """
+    Per-partition vector indexes: picks type and parameters from each leaf's
+    size, rebuilds concurrently when a leaf grows by VECTOR_INDEX_REBUILD_GROWTH
+    or VECTOR_STORAGE_MODE changes, promotes tenants that outgrow their hash
+    bucket into a dedicated partition (when VECTOR_PARTITION_PROMOTE_ROWS is
+    set), and maps the per-query recall knob to
+    ivfflat.probes / hnsw.ef_search for the index of the partition an org's
+    queries prune to.
+
+    Plans are keyed by (partition, model). Indexes are partial, one per
+    embedding model in use, so during a model migration each model's queries
+    scan an index of that model's rows only. A pre-migration index covering
+    all rows is keyed with model None and serves the active model until that
+    model has an index of its own.
+    """
+    def __init__(self):
+        self.partitions: dict[str, Partition] = {}
+        self.plans: dict[tuple[str, str | None], IndexPlan] = {}
+        self.tenants: dict[uuid.UUID, str] = {}
+        self._buckets: OrderedDict[uuid.UUID, str] = OrderedDict()
+        # partition -> monotonic time of its last recall-triggered rebuild
+        self._recall_rebuilt: dict[str, float] = {}
+
+    async def load(self, conn) -> dict[tuple[str, str | None], IndexPlan]:
+        parts = await list_partitions(conn)
+        res = await conn.execute(text("""
+            SELECT c.relname, i.relname, obj_description(i.oid, 'pg_class')
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            JOIN pg_class c ON c.oid = x.indrelid
+            JOIN pg_am am ON am.oid = i.relam
+            WHERE c.relname = ANY(:parts) AND am.amname IN ('ivfflat', 'hnsw') AND i.relname NOT LIKE '%\\_next'
+        """), {"parts": [p.name for p in parts]})
+        plans = {}
+        for partition, idx, comment in res.all():
+            if comment:
+                plan = IndexPlan(**json.loads(comment))
+            elif idx == vector_index_name(partition):
+                # built before the manager existed (fixed lists=100); size unknown
+                plan = IndexPlan(type="ivfflat", rows=0, lists=100)
+            else:
+                continue
+            if idx == vector_index_name(partition, plan.model):
+                plans[(partition, plan.model)] = plan
+        if set(self.partitions) != {p.name for p in parts}:
+            self._buckets.clear()
+        self.partitions = {p.name: p for p in parts}
+        self.tenants = {p.org_id: p.name for p in parts if p.kind == "tenant"}
+        self.plans = plans
+        return plans
+
+    async def ensure(self) -> dict[tuple[str, str | None], IndexPlan]:
+        # Startup path: partitions, then a vector index for every small leaf missing one
+        active = settings.EMBEDDINGS_MODEL
+        async with engine.begin() as conn:
+            await ensure_partitions(conn)
+            await self.load(conn)
+            for p in self.partitions.values():
+                if self.current_plan(p.name, active) or p.rows > _INLINE_BUILD_MAX_ROWS:
+                    continue
+                plan = plan_for(p.rows, model=active)
+                idx = vector_index_name(p.name, active)
+                await conn.exec_driver_sql(plan.ddl(idx, table=p.name))
+                await conn.exec_driver_sql(f"COMMENT ON INDEX {idx} IS '{json.dumps(asdict(plan))}'")
+                self.plans[(p.name, active)] = plan
+        return self.plans
+
+    def current_plan(self, partition: str, model: str | None = None) -> IndexPlan | None:
+        """Index serving a model's queries on a partition (its own, else the all-rows one)."""
+        model = model or settings.EMBEDDINGS_MODEL
+        return self.plans.get((partition, model)) or self.plans.get((partition, None))
+
+    def needs_rebuild(self, partition: str, rows: int, model: str | None = None) -> bool:
+        model = model or settings.EMBEDDINGS_MODEL
+        current = self.plans.get((partition, model))
+        if current is None and not settings.EMBEDDINGS_MIGRATION_TARGET:
+            # outside a migration the all-rows index only holds this model anyway
+            current = self.plans.get((partition, None))
+        if current is None:
+            return True
+        target = plan_for(rows, model=model)
+        if (target.type, target.storage) != (current.type, current.storage):
+            return True
+        return rows >= max(current.rows * settings.VECTOR_INDEX_REBUILD_GROWTH, 1000)
+
+    async def maybe_rebuild(self) -> int:
+        """
+        Promote outgrown tenants, then rebuild every leaf index that needs it:
+        grown past its plan, a storage / type change, or measured recall below
+        VECTOR_RECALL_REBUILD_BELOW.
+        """
+        from app.modules.vector.reembed import refresh_migration_state  # reembed imports this module
+        await refresh_migration_state()
+        async with engine.connect() as conn:
+            await self.load(conn)
+        threshold = settings.VECTOR_PARTITION_PROMOTE_ROWS
+        if threshold:
+            for p in list(self.partitions.values()):
+                if p.kind != "hash" or p.rows < threshold:
+                    continue
+                async with engine.connect() as conn:
+                    big = await large_tenants(conn, p.name, threshold)
+                for org_id, n in big:
+                    log.info("Org %s has %s chunks in %s; promoting to its own partition", org_id, n, p.name)
+                    await self.promote(org_id)
+        rebuilt = 0
+        for p in list(self.partitions.values()):
+            # the migration target's indexes are first built by the re-embed
+            # job once its rows exist, then kept up like the active model's
+            for model in registry.write_models():
+                if model != settings.EMBEDDINGS_MODEL and (p.name, model) not in self.plans:
+                    continue
+                if self.needs_rebuild(p.name, p.rows, model) and await self.rebuild(p.name, p.rows, model=model):
+                    rebuilt += 1
+        threshold = settings.VECTOR_RECALL_REBUILD_BELOW
+        if threshold:
+            # measured recall has drifted (e.g. ivfflat centroids no longer fit the data)
+            model = registry.search_model()
+            for partition in recall_monitor.degraded(threshold, settings.VECTOR_RECALL_REBUILD_MIN_SAMPLES):
+                p = self.partitions.get(partition)
+                if p is None:
+                    continue
+                value = recall_monitor.recall(partition)[0]
+                if not self._recall_rebuild_due(p, model):
+                    log.warning("Recall@k on %s is %.3f, below %s, but a rebuild would not change its index; raise probes / ef_search", partition, value, threshold)
+                    continue
+                log.info("Recall@k on %s is %.3f, below %s; rebuilding its vector index", partition, value, threshold)
+                if await self.rebuild(p.name, p.rows, model=model):
+                    self._recall_rebuilt[partition] = time.monotonic()
+                    recall_monitor.reset(partition)
+                    rebuilt += 1
+        await self.drop_retired()
+        return rebuilt
+
+    def _recall_rebuild_due(self, p: Partition, model: str) -> bool:
+        """Rebuilding for low recall only helps when the data moved on since the build; at most once per interval."""
+        last = self._recall_rebuilt.get(p.name)
+        if last is not None and time.monotonic() - last < settings.VECTOR_RECALL_REBUILD_MIN_INTERVAL_SECONDS:
+            return False
+        current = self.current_plan(p.name, model)
+        if current is None:
+            return True
+        target = plan_for(p.rows, model=model)
+        if replace(target, rows=current.rows) != current:
+            return True
+        return p.rows >= current.rows * _RECALL_REBUILD_GROWTH
+
+    async def rebuild(self, partition: str, rows: int | None = None, *, model: str | None = None) -> bool:
+        """
+        Build a replacement index for one model on one partition concurrently,
+        then swap it in under the canonical name. Replaces the all-rows index
+        once the active model has its own.
+        """
+        model = model or settings.EMBEDDINGS_MODEL
+        idx = vector_index_name(partition, model)
+        lock = f"{partition}:{model}"
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            if not (await conn.execute(text(_REBUILD_LOCK), {"p": lock})).scalar():
+                return False
+            try:
+                if rows is None:
+                    rows = next((p.rows for p in await list_partitions(conn) if p.name == partition), 0)
+                plan = plan_for(rows, model=model)
+                tmp = f"{idx}_next"
+                log.info("Rebuilding vector index on %s: %s", partition, asdict(plan))
+                await conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {tmp}")  # leftover from a failed run
+                await conn.exec_driver_sql(plan.ddl(tmp, table=partition, concurrently=True))
+                await conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {idx}")
+                await conn.exec_driver_sql(f"ALTER INDEX {tmp} RENAME TO {idx}")
+                await conn.exec_driver_sql(f"COMMENT ON INDEX {idx} IS '{json.dumps(asdict(plan))}'")
+                await conn.exec_driver_sql(f"ANALYZE {partition}")
+                self.plans[(partition, model)] = plan
+                # the all-rows index goes once the active model has its own, unless
+                # searches are still on the previous model (see reembed.refresh_migration_state)
+                if model == registry.search_model() and self.plans.pop((partition, None), None):
+                    await conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {vector_index_name(partition)}")
+                return True
+            finally:
+                await conn.execute(text(_REBUILD_UNLOCK), {"p": lock})
+
+    async def drop_retired(self) -> list[str]:
+        """Drop vector indexes of models that are neither active nor being migrated to."""
+        keep = set(registry.write_models())
+        dropped = []
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            for partition, model in list(self.plans):
+                if model is None or model in keep:
+                    continue
+                idx = vector_index_name(partition, model)
+                await conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {idx}")
+                del self.plans[(partition, model)]
+                dropped.append(idx)
+        if dropped:
+            log.info("Dropped vector indexes of retired embedding models: %s", dropped)
+        return dropped
+
+    async def promote(self, org_id: uuid.UUID) -> str:
+        """Give an org a dedicated partition and a vector index trained on its data alone."""
+        if org_id in self.tenants:
+            return self.tenants[org_id]
+        async with engine.begin() as conn:
+            name = await move_tenant(conn, org_id)
+        async with engine.connect() as conn:
+            await self.load(conn)
+        await self.rebuild(name)
+        return name
+
+    async def partition_for(self, session, org_id: uuid.UUID) -> str | None:
+        """Leaf partition an org's rows (and its queries) go to."""
+        if org_id in self.tenants:
+            return self.tenants[org_id]
+        buckets = [p for p in self.partitions.values() if p.kind == "hash"]
+        if not buckets:
+            # unpartitioned table: a single leaf
+            return next(iter(self.partitions), None)
+        if org_id not in self._buckets:
+            bucket = await hash_bucket_for(session, org_id, buckets[0].modulus)
+            if bucket is None:
+                return None
+            self._buckets[org_id] = bucket
+            while len(self._buckets) > _ORG_CACHE_SIZE:
+                self._buckets.popitem(last=False)
+        return self._buckets[org_id]
+
+    async def plan_for_org(self, session, org_id: uuid.UUID, model: str | None = None) -> IndexPlan | None:
+        partition = await self.partition_for(session, org_id)
+        return self.current_plan(partition, model or registry.search_model()) if partition else None
+
+    def search_settings(self, recall: str | None, plan: IndexPlan | None) -> dict[str, int]:
+        """GUCs to SET LOCAL before an ANN query for the requested speed/recall tradeoff."""
+        if plan is None:
+            return {}
+        level = recall or "balanced"
+        if plan.type == "hnsw":
+            return {"hnsw.ef_search": _EF_SEARCH[level]}
+        probes = round(math.sqrt(plan.lists or 100) * _PROBE_FACTORS[level])
+        return {"ivfflat.probes": min(max(probes, 1), plan.lists or 100)}
+
+index_manager = VectorIndexManager()
 
 async def ensure_vector_indexes():
-    # Create FTS + IVFFLAT indexes for TextChunk
-    # Note: IVFFLAT requires ANALYZE after substantial inserts to be effective.
+    # Create FTS + vector indexes for TextChunk. On the partitioned table the
+    # FTS and deleted_at indexes are partitioned indexes (cascade to every
+    # partition, including ones attached later); vector indexes are per leaf.
     async with engine.begin() as conn:
         # FTS index on to_tsvector('simple', text)
         await conn.exec_driver_sql(
             "CREATE INDEX IF NOT EXISTS textchunk_fts_idx ON textchunk USING gin (to_tsvector('simple', text))"
         )
-        # Vector index (L2 distance)
+        # Partial index the compaction job uses to find purgeable soft-deleted rows
         await conn.exec_driver_sql(
-            "CREATE INDEX IF NOT EXISTS textchunk_embedding_idx ON textchunk USING ivfflat (embedding vector_l2_ops) WITH (lists=100)"
-        )
\ No newline at end of file
+            "CREATE INDEX IF NOT EXISTS textchunk_deleted_at_idx ON textchunk (deleted_at) WHERE deleted_at IS NOT NULL"
+        )
+    # Vector indexes (L2 distance), type and parameters sized to each partition
+    await index_manager.ensure()
+
+async def run_vector_index_manager(interval_seconds: float | None = None):
+    interval = interval_seconds or settings.VECTOR_INDEX_CHECK_INTERVAL_SECONDS
+    log.info("Vector index manager started (every %ss)", interval)
+    try:
+        while True:
+            try:
+                await index_manager.maybe_rebuild()
+            except Exception:
+                log.exception("Vector index check failed")
+            await asyncio.sleep(interval)
+    except asyncio.CancelledError:
+        log.info("Vector index manager cancelled; shutting down")
+        raise
@@ -0,0 +1,62 @@
+"""
+64-bit SimHash signatures for near-duplicate chunk detection.
+
+Features are the lowercased alphanumeric tokens. Word shingles were tried, but
+on chunk-sized text a templated reply that differs only in a name and a time
+then lands far apart; single tokens keep those within a few bits while real
+clinical notes stay well separated. Two texts whose signatures differ in at
+most k bits are treated as near-duplicates, but only when they also carry the
+same numbers and negations (see same_facts): "lisinopril 10 mg" and "40 mg"
+are a few bits apart yet must not stand in for each other.
+
+Signatures are split into BANDS 16-bit bands: by pigeonhole, any pair within
+Hamming distance < BANDS shares at least one band exactly, so a GIN lookup on
+the band array finds every candidate without scanning.
+"""
+import hashlib
+import re
+import numpy as np
+
+BANDS = 4  # mirrored by config.SIMHASH_BANDS, which bounds VECTOR_DEDUP_MAX_HAMMING
+_BAND_BITS = 64 // BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+_MASK64 = (1 << 64) - 1
+_TOKEN_SPLIT = re.compile(r"[^a-z0-9]+")
+_NEGATIONS = frozenset({"no", "not", "non", "nor", "never", "none", "without", "denies", "denied", "negative"})
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+def _features(text: str) -> list[str]:
+    return [t for t in _TOKEN_SPLIT.split((text or "").lower()) if t]
+
+def simhash64(text: str) -> int:
+    """Signature as a signed 64-bit int (fits a Postgres BIGINT)."""
+    feats = _features(text)
+    if not feats:
+        return 0
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "big") for f in feats),
+        dtype=np.uint64, count=len(feats),
+    )
+    bits = ((hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)).astype(np.int32)
+    votes = bits.sum(axis=0) * 2 - len(feats)
+    sig = int(np.packbits((votes > 0)[::-1]).view(">u8")[0])
+    return sig - (1 << 64) if sig >= 1 << 63 else sig
+
+def bands(sig: int) -> list[int]:
+    # band position is folded in so equal values in different bands don't match
+    u = sig & _MASK64
+    return [(i << _BAND_BITS) | ((u >> (i * _BAND_BITS)) & _BAND_MASK) for i in range(BANDS)]
+
+def hamming(a: int, b: int) -> int:
+    return ((a ^ b) & _MASK64).bit_count()
+
+def same_facts(a: str, b: str) -> bool:
+    """True when both texts have the same tokens with digits and the same negations, in order."""
+    def facts(text: str) -> list[str]:
+        return [t for t in _features(text) if t in _NEGATIONS or any(c.isdigit() for c in t)]
+    return facts(a) == facts(b)
+
+def signature(text: str) -> dict:
+    """TextChunk column values for a chunk's text."""
+    sig = simhash64(text)
+    return {"simhash": sig, "simhash_bands": bands(sig)}
@@ -1,9 +1,15 @@
 import json
 import logging
-from app.platform.ports.event_bus import EventBusPort
+from typing import Sequence
+from app.platform.ports.event_bus import EventBusPort, BusMessage
 
 log = logging.getLogger("bus.noop")
 
 class NoopEventBus(EventBusPort):
     async def publish(self, topic: str, key: str, value: dict, headers: dict | None = None) -> None:
-        log.info(f"[NOOP BUS] topic={topic} key={key} value={json.dumps(value)} headers={headers or {}}")
\ No newline at end of file
+        log.info(f"[NOOP BUS] topic={topic} key={key} value={json.dumps(value)} headers={headers or {}}")
+
+    async def publish_many(self, messages: Sequence[BusMessage]) -> list[Exception | None]:
+        for m in messages:
+            await self.publish(m.topic, m.key, m.value, m.headers)
+        return [None] * len(messages)
\ No newline at end of file
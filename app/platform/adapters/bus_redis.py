@@ -1,25 +1,91 @@
 import asyncio
 import json
 import logging
+from typing import Sequence
 from redis.asyncio import from_url as redis_from_url
-from app.platform.ports.event_bus import EventBusPort
+from app.platform.ports.event_bus import EventBusPort, BusMessage
 from app.core.config import settings
 
 log = logging.getLogger("bus.redis")
 
+def _fields(topic: str, key: str, value: dict, headers: dict | None) -> dict:
+    return {
+        "topic": topic,
+        "key": key,
+        "value": json.dumps(value),
+        "headers": json.dumps(headers or {}),
+    }
+
+class StreamRouter:
+    """
+    Maps an event to its stream and length cap, per REDIS_STREAM_ROUTE_BY:
+
+      none            prm.events
+      event_type      prm.events.<slice>
+      org             prm.events.org.<org_id>
+      event_type_org  prm.events.<slice>.org.<org_id>
+
+    A slice is the REDIS_STREAM_ROUTES value of the longest event-type prefix
+    that matches, else the event's subject type (appointment, ticket, ...).
+    Events missing the fields a mode needs go to the base stream. Each stream
+    is trimmed (MAXLEN ~) to its slice's REDIS_STREAM_MAXLENS entry, else
+    REDIS_STREAM_ORG_MAXLEN for per-org streams, else REDIS_STREAM_MAXLEN.
+    """
+    def __init__(self, base: str, mode: str, routes: dict[str, str], maxlens: dict[str, int]):
+        self.base = base
+        self.mode = mode
+        self._routes = sorted(routes.items(), key=lambda kv: len(kv[0]), reverse=True)
+        self._maxlens = maxlens
+
+    def slice_for(self, event_type: str | None, subject_type: str | None = None) -> str | None:
+        for prefix, name in self._routes:
+            if event_type and event_type.startswith(prefix):
+                return name
+        return subject_type.lower() if subject_type else None
+
+    def stream_name(self, slice_: str | None = None, org_id: str | None = None) -> str:
+        parts = [self.base]
+        if slice_ and self.mode in ("event_type", "event_type_org"):
+            parts.append(slice_)
+        if org_id and self.mode in ("org", "event_type_org"):
+            parts += ["org", org_id]
+        return ".".join(parts)
+
+    def route(self, value: dict) -> tuple[str, int]:
+        slice_ = self.slice_for(value.get("event_type"), (value.get("subject") or {}).get("type"))
+        org_id = value.get("org_id")
+        stream = self.stream_name(slice_, org_id)
+        if slice_ in self._maxlens and self.mode in ("event_type", "event_type_org"):
+            return stream, self._maxlens[slice_]
+        if org_id and self.mode in ("org", "event_type_org"):
+            return stream, settings.REDIS_STREAM_ORG_MAXLEN
+        return stream, settings.REDIS_STREAM_MAXLEN
+
 class RedisEventBus(EventBusPort):
     def __init__(self):
         if not settings.REDIS_URL:
             raise RuntimeError("REDIS_URL not configured")
         self.redis = redis_from_url(settings.REDIS_URL, encoding="utf-8", decode_responses=True)
         self.stream = settings.REDIS_STREAM or "prm.events"
+        self.router = StreamRouter(self.stream, settings.REDIS_STREAM_ROUTE_BY, settings.REDIS_STREAM_ROUTES, settings.REDIS_STREAM_MAXLENS)
 
     async def publish(self, topic: str, key: str, value: dict, headers: dict | None = None) -> None:
-        payload = {
-            "topic": topic,
-            "key": key,
-            "value": json.dumps(value),
-            "headers": json.dumps(headers or {}),
-        }
-        await self.redis.xadd(self.stream, payload, maxlen=settings.REDIS_STREAM_MAXLEN, approximate=True)
-        log.debug(f"[REDIS BUS] XADD stream={self.stream} topic={topic} key={key}")
\ No newline at end of file
+        payload = _fields(topic, key, value, headers)
+        stream, maxlen = self.router.route(value)
+        await self.redis.xadd(stream, payload, maxlen=maxlen, approximate=True)
+        log.debug(f"[REDIS BUS] XADD stream={stream} topic={topic} key={key}")
+
+    async def publish_many(self, messages: Sequence[BusMessage]) -> list[Exception | None]:
+        # one MULTI/EXEC round trip, applied in order. EXEC does not roll back:
+        # an XADD that fails at run time (e.g. WRONGTYPE) fails alone, so the
+        # results are reported per message.
+        if not messages:
+            return []
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for m in messages:
+                stream, maxlen = self.router.route(m.value)
+                pipe.xadd(stream, _fields(m.topic, m.key, m.value, m.headers), maxlen=maxlen, approximate=True)
+            results = await pipe.execute(raise_on_error=False)
+        errors = [r if isinstance(r, Exception) else None for r in results]
+        log.debug(f"[REDIS BUS] XADD x{len(messages)} base={self.stream} failed={sum(e is not None for e in errors)}")
+        return errors
\ No newline at end of file
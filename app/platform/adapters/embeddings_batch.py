@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from app.platform.ports.embeddings import EmbeddingsPort
+
+log = logging.getLogger("embeddings.batch")
+
+class MicroBatchingEmbeddings(EmbeddingsPort):
+    """
+    Coalesces concurrent small embed() calls into one call on the wrapped
+    provider.
+
+    Texts are collected until max_batch texts are pending or max_wait_ms has
+    passed since the first of them arrived, then embedded together (identical
+    texts once, at most max_batch per provider call); each caller gets back
+    its own slice. Calls that are already
+    max_batch texts or larger go straight to the provider. A provider error
+    fails every caller of that batch, and so does cancelling the batch (e.g.
+    at shutdown). Only worth it for remote providers.
+    """
+    def __init__(self, inner: EmbeddingsPort, *, max_batch: int = 64, max_wait_ms: float = 2.0):
+        self.inner = inner
+        self._max_batch = max(1, int(max_batch))
+        self._max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self._pending: list[tuple[list[str], asyncio.Future]] = []
+        self._pending_texts = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.batches = 0
+        self.batched_calls = 0
+        self.batched_texts = 0
+        self.direct_calls = 0
+
+    def dim(self) -> int:
+        return self.inner.dim()
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        if len(texts) >= self._max_batch:
+            self.direct_calls += 1
+            return await self.inner.embed(texts)
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((list(texts), fut))
+        self._pending_texts += len(texts)
+        if self._pending_texts >= self._max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._max_wait, self._flush)
+        return await fut
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "batched_calls": self.batched_calls,
+            "batched_texts": self.batched_texts,
+            "avg_calls_per_batch": round(self.batched_calls / self.batches, 2) if self.batches else 0.0,
+            "direct_calls": self.direct_calls,
+            "max_batch": self._max_batch,
+            "max_wait_ms": self._max_wait * 1000,
+        }
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_texts = self._pending, [], 0
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[list[str], asyncio.Future]]) -> None:
+        # callers cancelled while waiting are dropped from the batch
+        batch = [(texts, fut) for texts, fut in batch if not fut.done()]
+        if not batch:
+            return
+        unique: dict[str, int] = {}
+        for texts, _ in batch:
+            for t in texts:
+                unique.setdefault(t, len(unique))
+        self.batches += 1
+        self.batched_calls += len(batch)
+        self.batched_texts += len(unique)
+        try:
+            ordered = list(unique)
+            # the call that filled the batch can take it past max_batch
+            parts = await asyncio.gather(*(
+                self.inner.embed(ordered[i:i + self._max_batch]) for i in range(0, len(ordered), self._max_batch)
+            ))
+            vectors = [v for part in parts for v in part]
+            for texts, fut in batch:
+                if not fut.done():
+                    fut.set_result([vectors[unique[t]] for t in texts])
+        except BaseException as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e if isinstance(e, Exception) else RuntimeError("embedding batch cancelled"))
+            if not isinstance(e, Exception):
+                raise
@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from redis.asyncio import from_url as redis_from_url
+from app.platform.ports.embeddings import EmbeddingsPort
+
+log = logging.getLogger("embeddings.cache")
+
+def normalize_text(text: str) -> str:
+    # NFC + collapsed whitespace; texts equal after this share one vector
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+class CachedEmbeddings(EmbeddingsPort):
+    """
+    Content-addressed cache in front of another EmbeddingsPort.
+
+    Keys are (provider, dim, sha256 of normalized text). Lookups go through a
+    bounded in-process LRU, then an optional Redis tier with TTL; whatever is
+    still missing is sent to the wrapped provider in a single embed() call.
+    """
+    def __init__(self, inner: EmbeddingsPort, *, provider: str, max_entries: int = 20000, redis_url: str | None = None, ttl_seconds: int = 7 * 24 * 3600):
+        self.inner = inner
+        self._prefix = f"emb:{provider}:{inner.dim()}:"
+        self._max = max(0, int(max_entries))
+        self._lru: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._redis = redis_from_url(redis_url, decode_responses=False) if redis_url else None
+        self._ttl = int(ttl_seconds)
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def dim(self) -> int:
+        return self.inner.dim()
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        normalized = [normalize_text(t) for t in texts]
+        keys = [hashlib.sha256(t.encode("utf-8")).hexdigest() for t in normalized]
+        out: list[np.ndarray | None] = [None] * len(texts)
+
+        # key -> positions in `texts` still waiting for a vector
+        pending: dict[str, list[int]] = {}
+        for i, k in enumerate(keys):
+            v = self._lru.get(k)
+            if v is not None:
+                self._lru.move_to_end(k)
+                out[i] = v
+                self.hits += 1
+            else:
+                pending.setdefault(k, []).append(i)
+
+        if pending and self._redis is not None:
+            for k, v in (await self._redis_get(list(pending))).items():
+                self._remember(k, v)
+                for i in pending.pop(k):
+                    out[i] = v
+                    self.redis_hits += 1
+
+        if pending:
+            miss_keys = list(pending)
+            vectors = await self.inner.embed([normalized[pending[k][0]] for k in miss_keys])
+            fresh: dict[str, np.ndarray] = {}
+            for k, vec in zip(miss_keys, vectors):
+                v = np.asarray(vec, dtype=np.float32)
+                fresh[k] = v
+                self._remember(k, v)
+                for i in pending[k]:
+                    out[i] = v
+                    self.misses += 1
+            if self._redis is not None:
+                await self._redis_set(fresh)
+
+        return [v.tolist() for v in out]
+
+    def stats(self) -> dict:
+        total = self.hits + self.redis_hits + self.misses
+        return {
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.redis_hits) / total, 4) if total else 0.0,
+            "entries": len(self._lru),
+            "max_entries": self._max,
+            "redis": self._redis is not None,
+        }
+
+    def _remember(self, key: str, v: np.ndarray) -> None:
+        if not self._max:
+            return
+        self._lru[key] = v
+        self._lru.move_to_end(key)
+        while len(self._lru) > self._max:
+            self._lru.popitem(last=False)
+
+    async def _redis_get(self, keys: list[str]) -> dict[str, np.ndarray]:
+        try:
+            raw = await self._redis.mget([self._prefix + k for k in keys])
+        except Exception:
+            # the Redis tier is an optimization; treat outages as misses
+            log.warning("Embedding cache redis read failed", exc_info=True)
+            return {}
+        return {k: np.frombuffer(b, dtype="<f4").copy() for k, b in zip(keys, raw) if b}
+
+    async def _redis_set(self, vectors: dict[str, np.ndarray]) -> None:
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for k, v in vectors.items():
+                pipe.set(self._prefix + k, v.astype("<f4").tobytes(), ex=self._ttl)
+            await pipe.execute()
+        except Exception:
+            log.warning("Embedding cache redis write failed", exc_info=True)
@@ -1,11 +1,24 @@
 import hashlib
-import math
+import re
+from functools import lru_cache
+import numpy as np
 from app.platform.ports.embeddings import EmbeddingsPort
 
+_TOKEN_SPLIT = re.compile(r"[^a-z0-9]+")
+
+@lru_cache(maxsize=262144)
+def _token_bucket(tok: str, d: int) -> int:
+    # Bucket assignment must stay md5-based so vectors already stored in
+    # textchunk remain comparable; the cache makes repeat tokens ~free.
+    return int.from_bytes(hashlib.md5(tok.encode("utf-8")).digest(), "big") % d
+
 class HashingEmbeddings(EmbeddingsPort):
     """
     Deterministic, lightweight embeddings via feature hashing.
     Not semantically strong, but production-safe and swappable.
+
+    The whole batch is accumulated into one float32 matrix (a row per text)
+    and L2-normalized in a single vectorized step.
     """
     def __init__(self, d: int = 384):
         self._d = int(d)
@@ -14,23 +27,23 @@ class HashingEmbeddings(EmbeddingsPort):
         return self._d
 
     async def embed(self, texts: list[str]) -> list[list[float]]:
-        out: list[list[float]] = []
-        for t in texts:
-            v = [0.0] * self._d
-            for tok in self._tokenize(t):
-                h = int(hashlib.md5(tok.encode("utf-8")).hexdigest(), 16)
-                idx = h % self._d
-                v[idx] += 1.0
-            self._l2_normalize(v)
-            out.append(v)
-        return out
+        return self.embed_matrix(texts).tolist()
+
+    def embed_matrix(self, texts: list[str]) -> np.ndarray:
+        """Synchronous batch engine; returns an (len(texts), dim) float32 matrix."""
+        n, d = len(texts), self._d
+        cells: list[int] = []
+        for row, t in enumerate(texts):
+            base = row * d
+            cells.extend(base + _token_bucket(tok, d) for tok in self._tokenize(t))
+        counts = np.bincount(np.asarray(cells, dtype=np.int64), minlength=n * d)
+        m = counts.astype(np.float32).reshape(n, d)
+        # norms in float64 so the rounded result matches what pgvector stored
+        # for vectors produced by the old pure-Python path, bit for bit
+        norms = np.sqrt(np.einsum("ij,ij->i", m, m, dtype=np.float64))[:, None]
+        norms[norms == 0.0] = 1.0
+        return (m / norms).astype(np.float32)
 
     def _tokenize(self, text: str) -> list[str]:
         # simple lowercase + split on non-alnum
-        import re
-        return [x for x in re.split(r"[^a-z0-9]+", (text or "").lower()) if x]
-
-    def _l2_normalize(self, v: list[float]) -> None:
-        s = math.sqrt(sum(x*x for x in v)) or 1.0
-        for i in range(len(v)):
-            v[i] /= s
\ No newline at end of file
+        return [x for x in _TOKEN_SPLIT.split((text or "").lower()) if x]
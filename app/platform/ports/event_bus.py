@@ -1,5 +1,17 @@
-from typing import Protocol, runtime_checkable
+from dataclasses import dataclass
+from typing import Protocol, Sequence, runtime_checkable
+
+@dataclass
+class BusMessage:
+    topic: str
+    key: str
+    value: dict
+    headers: dict | None = None
 
 @runtime_checkable
 class EventBusPort(Protocol):
-    async def publish(self, topic: str, key: str, value: dict, headers: dict | None = None) -> None: ...
\ No newline at end of file
+    async def publish(self, topic: str, key: str, value: dict, headers: dict | None = None) -> None: ...
+    # in order, one round trip where the transport allows it; returns one
+    # entry per message (None if published, else the error) and raises only
+    # when the call as a whole failed
+    async def publish_many(self, messages: Sequence[BusMessage]) -> list[Exception | None]: ...
\ No newline at end of file
@@ -7,11 +7,14 @@ from app.platform.adapters.bus_noop import NoopEventBus
 from app.platform.adapters.bus_redis import RedisEventBus
 from app.platform.ports.embeddings import EmbeddingsPort
 from app.platform.adapters.embeddings_hash import HashingEmbeddings
+from app.platform.adapters.embeddings_cache import CachedEmbeddings
+from app.platform.adapters.embeddings_batch import MicroBatchingEmbeddings
 
 class ProviderRegistry:
     _object_storage: ObjectStoragePort | None = None
     _event_bus: EventBusPort | None = None
-    _embeddings: EmbeddingsPort | None = None
+    _embeddings: dict[str, EmbeddingsPort] = {}
+    _search_fallback: str | None = None
 
     @classmethod
     def object_storage(cls) -> ObjectStoragePort:
@@ -34,13 +37,58 @@ class ProviderRegistry:
 
     @classmethod
     def embeddings(cls) -> EmbeddingsPort:
-        if cls._embeddings is None:
-            prov = (settings.EMBEDDINGS_PROVIDER or "hashing").lower()
+        """Provider of the active model (settings.EMBEDDINGS_MODEL)."""
+        return cls.embeddings_for(settings.EMBEDDINGS_MODEL)
+
+    @classmethod
+    def embeddings_for(cls, model: str) -> EmbeddingsPort:
+        """Provider for a model id "provider:dim:version"."""
+        if model not in cls._embeddings:
+            prov, dim, version = model.split(":")
             if prov == "hashing":
-                cls._embeddings = HashingEmbeddings(d=settings.EMBEDDINGS_DIM)
+                emb: EmbeddingsPort = HashingEmbeddings(d=int(dim))
             else:
                 # For now, only hashing is shipped. Add other adapters here.
-                cls._embeddings = HashingEmbeddings(d=settings.EMBEDDINGS_DIM)
-        return cls._embeddings
+                emb = HashingEmbeddings(d=int(dim))
+            if prov != "hashing" and settings.EMBEDDINGS_BATCH_MAX_WAIT_MS > 0:
+                # remote providers only: batching saves round trips, while the
+                # in-process hashing model would just make callers wait.
+                # Behind the cache: only misses wait for a batch
+                emb = MicroBatchingEmbeddings(
+                    emb,
+                    max_batch=settings.EMBEDDINGS_BATCH_MAX_SIZE,
+                    max_wait_ms=settings.EMBEDDINGS_BATCH_MAX_WAIT_MS,
+                )
+            if settings.EMBEDDINGS_CACHE_SIZE > 0 or settings.EMBEDDINGS_CACHE_REDIS:
+                emb = CachedEmbeddings(
+                    emb,
+                    provider=f"{prov}:{version}",
+                    max_entries=settings.EMBEDDINGS_CACHE_SIZE,
+                    redis_url=settings.REDIS_URL if settings.EMBEDDINGS_CACHE_REDIS else None,
+                    ttl_seconds=settings.EMBEDDINGS_CACHE_TTL_SECONDS,
+                )
+            cls._embeddings[model] = emb
+        return cls._embeddings[model]
+
+    @classmethod
+    def write_models(cls) -> list[str]:
+        """Models every new chunk is embedded with: the active one, plus the migration target."""
+        target = settings.EMBEDDINGS_MIGRATION_TARGET
+        active = settings.EMBEDDINGS_MODEL
+        models = [active, target] if target and target != active else [active]
+        if cls._search_fallback and cls._search_fallback not in models:
+            # switched over before the backfill finished: keep writing the model searches still use
+            models.append(cls._search_fallback)
+        return models
+
+    @classmethod
+    def search_model(cls) -> str:
+        """Model searches query: the active one, unless it is still being backfilled."""
+        return cls._search_fallback or settings.EMBEDDINGS_MODEL
+
+    @classmethod
+    def set_search_fallback(cls, model: str | None) -> None:
+        """Set by vector.reembed: the source of a migration whose target went active mid-backfill."""
+        cls._search_fallback = model if model != settings.EMBEDDINGS_MODEL else None
 
 registry = ProviderRegistry()
\ No newline at end of file
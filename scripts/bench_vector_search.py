@@ -0,0 +1,402 @@
+"""
+Vector retrieval benchmark: latency and recall@k of textchunk search as the
+corpus grows, per vector index configuration and probe / ef_search setting.
+
+Loads a synthetic, topic-clustered corpus embedded with HashingEmbeddings into
+a scratch schema (default "vecbench", dropped afterwards unless --keep), so the
+application's own textchunk is never touched. Ground truth is exact brute-force
+KNN computed in numpy while the corpus is loaded. Results are written as JSON;
+pass --baseline to compare against an earlier run.
+
+    python scripts/bench_vector_search.py --sizes 10000,100000,1000000 \\
+        --index ivfflat --index hnsw --out bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+from sqlalchemy import Column, MetaData, Table, select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+# Add the project root to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.core.config import settings
+from app.platform.adapters.embeddings_hash import HashingEmbeddings
+from app.modules.vector.models import TextChunk
+from app.modules.vector.repository import VectorRepository, vector_candidates, compact_candidates, model_filter
+from app.modules.vector.setup import IndexPlan, plan_for, index_manager
+
+BENCH_INDEX = "bench_embedding_idx"
+_ID_PREFIX = 0xBE7C << 112  # row number lives in the low 64 bits of each chunk id
+_IVF_PROBES = [1, 2, 4, 8, 16, 32, 64, 128]
+_HNSW_EF = [10, 20, 40, 80, 160, 320]
+
+
+class CorpusGenerator:
+    """Deterministic topic-mixture text so nearest neighbours are meaningful."""
+    def __init__(self, seed: int, vocab_size: int = 20000, topics: int = 500, words_per_topic: int = 200):
+        self.rng = np.random.default_rng(seed)
+        self.vocab = np.array([f"w{i}" for i in range(vocab_size)])
+        zipf = 1.0 / np.arange(1, vocab_size + 1)
+        self.background_cdf = np.cumsum(zipf / zipf.sum())
+        self.topic_words = np.stack([self.rng.choice(vocab_size, words_per_topic, replace=False) for _ in range(topics)])
+        w = 1.0 / np.arange(1, words_per_topic + 1)
+        self.topic_cdf = np.cumsum(w / w.sum())
+
+    def _texts(self, lengths: np.ndarray) -> list[str]:
+        # sample every token of the batch at once: 80% from the text's main or
+        # secondary topic (3:1), 20% Zipfian background noise
+        total = int(lengths.sum())
+        owner = np.repeat(np.arange(len(lengths)), lengths)
+        topics = self.rng.integers(len(self.topic_words), size=(len(lengths), 2))
+        which = (self.rng.random(total) >= 0.75).astype(np.int64)
+        picks = np.minimum(np.searchsorted(self.topic_cdf, self.rng.random(total)), self.topic_words.shape[1] - 1)
+        words = self.topic_words[topics[owner, which], picks]
+        noise = np.minimum(np.searchsorted(self.background_cdf, self.rng.random(total)), len(self.vocab) - 1)
+        tokens = self.vocab[np.where(self.rng.random(total) < 0.8, words, noise)]
+        bounds = np.concatenate([[0], np.cumsum(lengths)])
+        return [" ".join(tokens[bounds[i]:bounds[i + 1]]) for i in range(len(lengths))]
+
+    def chunks(self, n: int) -> list[str]:
+        return self._texts(self.rng.integers(40, 120, size=n))
+
+    def queries(self, n: int) -> list[str]:
+        return self._texts(self.rng.integers(6, 12, size=n))
+
+
+class GroundTruth:
+    """Running exact top-k (L2) for a fixed query set, updated batch by batch."""
+    def __init__(self, queries: np.ndarray, k: int):
+        self.q = queries.astype(np.float64)
+        self.qn = np.einsum("ij,ij->i", self.q, self.q)
+        self.k = k
+        self.dist = np.full((len(queries), 0), np.inf)
+        self.rows = np.zeros((len(queries), 0), dtype=np.int64)
+
+    def update(self, batch: np.ndarray, first_row: int) -> None:
+        b = batch.astype(np.float64)
+        d = self.qn[:, None] + np.einsum("ij,ij->i", b, b)[None, :] - 2.0 * (self.q @ b.T)
+        rows = np.broadcast_to(np.arange(first_row, first_row + len(b)), d.shape)
+        d = np.concatenate([self.dist, d], axis=1)
+        rows = np.concatenate([self.rows, rows], axis=1)
+        keep = np.argpartition(d, min(self.k, d.shape[1] - 1), axis=1)[:, :self.k]
+        self.dist = np.take_along_axis(d, keep, axis=1)
+        self.rows = np.take_along_axis(rows, keep, axis=1)
+
+    def recall(self, qi: int, ids: list[uuid.UUID]) -> float:
+        truth = set(self.rows[qi].tolist())
+        found = {u.int & 0xFFFFFFFFFFFFFFFF for u in ids}
+        return len(truth & found) / max(len(truth), 1)
+
+
+def bench_table(schema_md: MetaData) -> Table:
+    # Same columns as TextChunk, minus foreign keys, so the scratch schema
+    # needs no patient table
+    cols = [
+        Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable,
+               server_default=c.server_default.arg if c.server_default is not None else None)
+        for c in TextChunk.__table__.columns
+    ]
+    return Table(TextChunk.__tablename__, schema_md, *cols)
+
+
+def parse_index_spec(spec: str, rows: int) -> IndexPlan:
+    """'ivfflat', 'hnsw', 'ivfflat:lists=500', 'hnsw:m=32,ef_construction=128,storage=binary'."""
+    kind, _, opts = spec.partition(":")
+    plan = plan_for(rows, kind)
+    for kv in filter(None, opts.split(",")):
+        key, _, value = kv.partition("=")
+        value = value.strip()
+        setattr(plan, key.strip(), int(value) if value.isdigit() else value)
+    return plan
+
+
+def index_label(plan: IndexPlan | None) -> str:
+    if plan is None:
+        return "exact"
+    storage = "" if plan.storage == "full" else f",storage={plan.storage}"
+    if plan.type == "hnsw":
+        return f"hnsw(m={plan.m},ef_construction={plan.ef_construction}{storage})"
+    return f"ivfflat(lists={plan.lists}{storage})"
+
+
+def latency_summary(samples_ms: list[float]) -> dict:
+    a = np.asarray(samples_ms)
+    return {
+        "p50": round(float(np.percentile(a, 50)), 3),
+        "p95": round(float(np.percentile(a, 95)), 3),
+        "p99": round(float(np.percentile(a, 99)), 3),
+        "mean": round(float(a.mean()), 3),
+        "max": round(float(a.max()), 3),
+    }
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.org_id = uuid.uuid4()
+        self.engine = create_async_engine(
+            args.dsn, pool_size=2,
+            connect_args={"server_settings": {"search_path": f"{args.schema},public"}},
+        )
+        self.Session = async_sessionmaker(self.engine, expire_on_commit=False, class_=AsyncSession)
+        self.embedder = HashingEmbeddings(d=settings.EMBEDDINGS_DIM)
+        self.gen = CorpusGenerator(args.seed)
+        self.query_texts = self.gen.queries(args.queries)
+        self.query_vecs = self.embedder.embed_matrix(self.query_texts)
+        self.truth = GroundTruth(self.query_vecs, args.top_k)
+        self.loaded = 0
+        self.results: list[dict] = []
+
+    # ---- setup ----
+    async def create_schema(self):
+        schema = self.args.schema
+        async with self.engine.begin() as conn:
+            await conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS vector")
+            await conn.exec_driver_sql(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE')
+            await conn.exec_driver_sql(f'CREATE SCHEMA "{schema}"')
+            md = MetaData()
+            bench_table(md)
+            # checkfirst would find the application's textchunk through search_path
+            await conn.run_sync(lambda c: md.create_all(c, checkfirst=False))
+            await conn.exec_driver_sql(
+                "CREATE INDEX bench_fts_idx ON textchunk USING gin (to_tsvector('simple', text))"
+            )
+
+    async def drop_schema(self):
+        async with self.engine.begin() as conn:
+            await conn.exec_driver_sql(f'DROP SCHEMA IF EXISTS "{self.args.schema}" CASCADE')
+
+    async def load_to(self, target: int):
+        """Grow the corpus to `target` rows; ground truth is updated per batch."""
+        started = time.perf_counter()
+        while self.loaded < target:
+            n = min(self.args.batch_size, target - self.loaded)
+            texts = self.gen.chunks(n)
+            vecs = self.embedder.embed_matrix(texts)
+            self.truth.update(vecs, self.loaded)
+            async with self.Session() as session:
+                await VectorRepository(session).bulk_insert_chunks(
+                    {
+                        "id": uuid.UUID(int=_ID_PREFIX | (self.loaded + i)),
+                        "org_id": self.org_id,
+                        "source_type": "knowledge",
+                        "source_id": f"bench-{(self.loaded + i) // 8}",
+                        "text": t,
+                        "chunk_index": (self.loaded + i) % 8,
+                        "embedding": vecs[i],
+                    }
+                    for i, t in enumerate(texts)
+                )
+                await session.commit()
+            self.loaded += n
+            print(f"  loaded {self.loaded}/{target} rows", end="\r", flush=True)
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.exec_driver_sql("VACUUM ANALYZE textchunk")
+        print(f"  loaded {self.loaded} rows in {time.perf_counter() - started:.1f}s")
+
+    async def build_index(self, plan: IndexPlan | None) -> dict:
+        async with self.engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.exec_driver_sql(f"DROP INDEX IF EXISTS {BENCH_INDEX}")
+            if plan is None:
+                return {"build_seconds": 0.0, "index_bytes": 0}
+            await conn.exec_driver_sql(f"SET maintenance_work_mem = '{self.args.maintenance_work_mem}'")
+            started = time.perf_counter()
+            await conn.exec_driver_sql(plan.ddl(BENCH_INDEX))
+            elapsed = time.perf_counter() - started
+            size = (await conn.exec_driver_sql(f"SELECT pg_relation_size('{BENCH_INDEX}')")).scalar()
+        return {"build_seconds": round(elapsed, 3), "index_bytes": int(size or 0)}
+
+    # ---- measurements ----
+    def _ann_stmt(self, qi: int):
+        # same statement as VectorRepository.search_hybrid's vector stage
+        plan = index_manager.current_plan("textchunk")
+        storage = plan.storage if plan else "full"
+        conds = [TextChunk.org_id == self.org_id, TextChunk.deleted_at.is_(None), model_filter()]
+        return vector_candidates(conds, self.query_vecs[qi].tolist(), self.args.top_k, storage)
+
+    async def measure_ann(self, gucs: dict[str, int], n_queries: int) -> dict:
+        latencies, recalls = [], []
+        async with self.Session() as session:
+            for i in range(self.args.warmup + n_queries):
+                qi = i % len(self.query_texts)
+                async with session.begin():
+                    for name, value in gucs.items():
+                        await session.execute(select(func.set_config(name, str(value), True)))
+                    started = time.perf_counter()
+                    ids = list((await session.execute(self._ann_stmt(qi))).scalars().all())
+                    elapsed = (time.perf_counter() - started) * 1000
+                if i >= self.args.warmup:
+                    latencies.append(elapsed)
+                    recalls.append(self.truth.recall(qi, ids))
+        return {"latency_ms": latency_summary(latencies), "recall_at_k": round(float(np.mean(recalls)), 4)}
+
+    async def measure_hybrid(self, recall: str) -> dict:
+        latencies = []
+        async with self.Session() as session:
+            repo = VectorRepository(session)
+            for i in range(self.args.warmup + self.args.queries):
+                qi = i % len(self.query_texts)
+                async with session.begin():
+                    started = time.perf_counter()
+                    await repo.search_hybrid(
+                        self.org_id, self.query_vecs[qi].tolist(), self.query_texts[qi],
+                        top_k=self.args.top_k, recall=recall,
+                    )
+                    elapsed = (time.perf_counter() - started) * 1000
+                if i >= self.args.warmup:
+                    latencies.append(elapsed)
+        return {"latency_ms": latency_summary(latencies)}
+
+    def sweep(self, plan: IndexPlan | None) -> list[dict]:
+        if plan is None:
+            return [{}]
+        if plan.type == "hnsw":
+            floor = compact_candidates(self.args.top_k, plan.storage)
+            values = sorted({v for v in _HNSW_EF if v >= floor} | {floor})
+            return [{"hnsw.ef_search": v} for v in values]
+        levels = {index_manager.search_settings(level, plan)["ivfflat.probes"] for level in ("fast", "balanced", "high")}
+        values = sorted({v for v in _IVF_PROBES if v <= plan.lists} | levels)
+        return [{"ivfflat.probes": v} for v in values]
+
+    async def run_size(self, rows: int):
+        await self.load_to(rows)
+        plans: list[IndexPlan | None] = [None] if self.args.exact else []
+        plans += [parse_index_spec(spec, rows) for spec in self.args.index]
+        for plan in plans:
+            label = index_label(plan)
+            build = await self.build_index(plan)
+            # the scratch table is unpartitioned: route the bench org to it
+            index_manager.tenants = {self.org_id: "textchunk"}
+            index_manager.plans = {("textchunk", None): plan} if plan else {}
+            print(f"  {label}: built in {build['build_seconds']}s, {build['index_bytes'] / 2**20:.1f} MiB")
+            base = {"rows": rows, "index": label, "plan": plan.__dict__ if plan else None, **build}
+            n_queries = self.args.exact_queries if plan is None else self.args.queries
+            for gucs in self.sweep(plan):
+                m = await self.measure_ann(gucs, n_queries)
+                self.results.append({**base, "mode": "ann", "settings": gucs, **m})
+                print(f"    ann {gucs or 'seqscan'}: recall@{self.args.top_k}={m['recall_at_k']} "
+                      f"p50={m['latency_ms']['p50']}ms p95={m['latency_ms']['p95']}ms p99={m['latency_ms']['p99']}ms")
+            if plan is None or self.args.no_hybrid:
+                continue
+            for level in ("fast", "balanced", "high"):
+                m = await self.measure_hybrid(level)
+                self.results.append({**base, "mode": "hybrid", "settings": {"recall": level, **index_manager.search_settings(level, plan)}, **m})
+                print(f"    hybrid {level}: p50={m['latency_ms']['p50']}ms p95={m['latency_ms']['p95']}ms p99={m['latency_ms']['p99']}ms")
+        index_manager.tenants, index_manager.plans = {}, {}
+
+    async def meta(self) -> dict:
+        async with self.engine.connect() as conn:
+            pg = (await conn.exec_driver_sql("SHOW server_version")).scalar()
+            ext = (await conn.exec_driver_sql("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+        try:
+            rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        except Exception:
+            rev = None
+        a = self.args
+        return {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_rev": rev,
+            "host": platform.node(),
+            "postgres": pg,
+            "pgvector": ext,
+            "dim": settings.EMBEDDINGS_DIM,
+            "seed": a.seed,
+            "queries": a.queries,
+            "top_k": a.top_k,
+            "sizes": a.sizes,
+            "index_specs": a.index,
+        }
+
+
+def compare(results: list[dict], baseline_path: str, max_recall_drop: float, max_p95_increase: float) -> bool:
+    """Print per-run deltas against a previous results file; False on regression."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        old = json.load(f)["results"]
+
+    def key(r):
+        return (r["rows"], r["index"], r["mode"], json.dumps(r["settings"], sort_keys=True))
+
+    before = {key(r): r for r in old}
+    ok = True
+    print(f"\nComparison with {baseline_path}:")
+    for r in results:
+        b = before.get(key(r))
+        if b is None:
+            continue
+        p95, p95_old = r["latency_ms"]["p95"], b["latency_ms"]["p95"]
+        line = f"  {r['rows']:>9} {r['index']:<40} {r['mode']:<6} {json.dumps(r['settings']):<28} p95 {p95_old:.2f} -> {p95:.2f}ms"
+        regressed = p95 > p95_old * (1 + max_p95_increase)
+        if "recall_at_k" in r and "recall_at_k" in b:
+            line += f"  recall {b['recall_at_k']:.4f} -> {r['recall_at_k']:.4f}"
+            regressed = regressed or r["recall_at_k"] < b["recall_at_k"] - max_recall_drop
+        print(line + ("  REGRESSION" if regressed else ""))
+        ok = ok and not regressed
+    return ok
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--dsn", default=settings.POSTGRES_DSN, help="asyncpg DSN of a local pgvector database")
+    p.add_argument("--schema", default="vecbench", help="scratch schema (dropped and recreated)")
+    p.add_argument("--sizes", type=lambda s: sorted(int(x) for x in s.split(",")), default=[10_000, 100_000],
+                   help="comma-separated corpus sizes, e.g. 10000,100000,1000000,5000000")
+    p.add_argument("--index", action="append", default=None,
+                   help="index config, repeatable: ivfflat | hnsw | ivfflat:lists=N | hnsw:m=N,ef_construction=N")
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--exact-queries", type=int, default=20, help="queries for the no-index (seq scan) baseline")
+    p.add_argument("--no-exact", dest="exact", action="store_false", help="skip the seq scan baseline")
+    p.add_argument("--no-hybrid", action="store_true", help="skip end-to-end search_hybrid timings")
+    p.add_argument("--top-k", type=int, default=10)
+    p.add_argument("--warmup", type=int, default=10)
+    p.add_argument("--batch-size", type=int, default=10_000)
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--maintenance-work-mem", default="1GB")
+    p.add_argument("--out", default="bench_vector_search.json")
+    p.add_argument("--baseline", help="previous results file to compare against")
+    p.add_argument("--max-recall-drop", type=float, default=0.02)
+    p.add_argument("--max-p95-increase", type=float, default=0.25, help="allowed relative p95 growth")
+    p.add_argument("--keep", action="store_true", help="keep the scratch schema afterwards")
+    args = p.parse_args(argv)
+    if args.schema.lower() in ("public", "pg_catalog", "information_schema"):
+        p.error("--schema must be a scratch schema; it is dropped with CASCADE")
+    args.index = args.index or ["ivfflat", "hnsw"]
+    return args
+
+
+async def main(argv=None) -> int:
+    args = parse_args(argv)
+    bench = Bench(args)
+    print(f"Benchmarking into schema '{args.schema}' (sizes={args.sizes}, queries={args.queries}, k={args.top_k})")
+    await bench.create_schema()
+    try:
+        meta = await bench.meta()
+        for rows in args.sizes:
+            print(f"\n== {rows} rows ==")
+            await bench.run_size(rows)
+    finally:
+        if not args.keep:
+            await bench.drop_schema()
+        await bench.engine.dispose()
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": bench.results}, f, indent=2)
+    print(f"\nWrote {len(bench.results)} results to {args.out}")
+    if args.baseline and not compare(bench.results, args.baseline, args.max_recall_drop, args.max_p95_increase):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))